@@ -7,6 +7,14 @@ import logging
 import aiohttp # Убедитесь, что этот импорт есть
 from dotenv import load_dotenv
 from utils.snag_api_client import SnagApiClient # Убедитесь, что этот импорт правильный
+from utils.rate_limiter import parse_endpoint_rate_limits
+from utils.response_cache import parse_endpoint_ttls
+from utils.identity_resolver import IdentityResolver
+from utils.identity_cache import IdentityCache
+from utils.transaction_store import TransactionStore
+from utils.rules_catalog import RulesCatalog
+from utils.currency_registry import CurrencyRegistry
+from utils.api_metrics import start_metrics_server
 
 # --- Настройка логирования ---
 log_level = logging.INFO
@@ -32,6 +40,99 @@ LEGACY_SNAG_API_KEY = os.getenv('OLD_SNAG_API_KEY')
 LEGACY_ORGANIZATION_ID = os.getenv('OLD_SNAG_ORGANIZATION_ID')
 LEGACY_WEBSITE_ID = os.getenv('OLD_SNAG_WEBSITE_ID')
 
+
+def _env_int(name: str, default: int) -> int:
+    """Читает целое число из .env, при ошибке возвращает значение по умолчанию."""
+    raw_value = os.getenv(name)
+    if raw_value is None or not raw_value.strip():
+        return default
+    try:
+        return int(raw_value)
+    except ValueError:
+        logger.warning(f"{name}={raw_value!r} is not a valid integer. Using default: {default}.")
+        return default
+
+def _env_float(name: str, default: float) -> float:
+    """Читает дробное число из .env, при ошибке возвращает значение по умолчанию."""
+    raw_value = os.getenv(name)
+    if raw_value is None or not raw_value.strip():
+        return default
+    try:
+        return float(raw_value)
+    except ValueError:
+        logger.warning(f"{name}={raw_value!r} is not a valid number. Using default: {default}.")
+        return default
+
+# Базовый URL Snag API для обоих клиентов. Пусто = боевой admin.snagsolutions.io;
+# для нагрузочных тестов можно указать локальный симулятор (python -m tools.snag_simulator)
+SNAG_API_BASE_URL = os.getenv('SNAG_API_BASE_URL') or None
+
+# Пул соединений общей aiohttp-сессии (оба Snag клиента ходят на один хост)
+HTTP_POOL_LIMIT = _env_int('SNAG_HTTP_POOL_LIMIT', 100)                   # Всего соединений в пуле
+HTTP_POOL_LIMIT_PER_HOST = _env_int('SNAG_HTTP_POOL_LIMIT_PER_HOST', 30)  # Соединений на один хост
+HTTP_DNS_CACHE_TTL = _env_int('SNAG_HTTP_DNS_CACHE_TTL', 300)             # Секунды кэширования DNS
+HTTP_KEEPALIVE_TIMEOUT = _env_int('SNAG_HTTP_KEEPALIVE_TIMEOUT', 30)      # Секунды жизни простаивающего соединения
+
+# Бюджет одновременных запросов для каждого клиента (0 = без ограничения)
+MAIN_SNAG_MAX_CONNECTIONS = _env_int('MAIN_SNAG_MAX_CONNECTIONS', 20)
+LEGACY_SNAG_MAX_CONNECTIONS = _env_int('LEGACY_SNAG_MAX_CONNECTIONS', 10)
+# Сколько из них доступно только интерактивным запросам (кнопки, модальные окна), а не массовым задачам
+MAIN_SNAG_INTERACTIVE_RESERVE = _env_int('MAIN_SNAG_INTERACTIVE_RESERVE', 4)
+LEGACY_SNAG_INTERACTIVE_RESERVE = _env_int('LEGACY_SNAG_INTERACTIVE_RESERVE', 2)
+# После скольких интерактивных запросов подряд пропускать один массовый, если оба ждут
+SNAG_BULK_FAIRNESS = _env_int('SNAG_BULK_FAIRNESS', 4)
+
+# Клиентский rate limit (запросов в секунду и размер всплеска, 0 = без ограничения)
+MAIN_SNAG_RATE_LIMIT = _env_float('MAIN_SNAG_RATE_LIMIT', 10.0)
+MAIN_SNAG_RATE_BURST = _env_int('MAIN_SNAG_RATE_BURST', 20)
+LEGACY_SNAG_RATE_LIMIT = _env_float('LEGACY_SNAG_RATE_LIMIT', 5.0)
+LEGACY_SNAG_RATE_BURST = _env_int('LEGACY_SNAG_RATE_BURST', 10)
+# Лимиты по эндпоинтам: "/api/loyalty/transaction_entries=3:3;/api/users=8:16"
+MAIN_SNAG_ENDPOINT_RATE_LIMITS = parse_endpoint_rate_limits(
+    os.getenv('MAIN_SNAG_ENDPOINT_RATE_LIMITS', '/api/loyalty/transaction_entries=3:3')
+)
+LEGACY_SNAG_ENDPOINT_RATE_LIMITS = parse_endpoint_rate_limits(
+    os.getenv('LEGACY_SNAG_ENDPOINT_RATE_LIMITS', '/api/loyalty/transaction_entries=2:2')
+)
+
+# Повторы GET-запросов при 429/5xx/таймаутах (общие для обоих клиентов)
+SNAG_MAX_RETRIES = _env_int('SNAG_MAX_RETRIES', 3)
+SNAG_RETRY_BACKOFF_BASE = _env_float('SNAG_RETRY_BACKOFF_BASE', 0.5)  # Секунды, первая задержка
+SNAG_RETRY_BACKOFF_MAX = _env_float('SNAG_RETRY_BACKOFF_MAX', 8.0)    # Секунды, потолок одной задержки
+SNAG_RETRY_BUDGET = _env_float('SNAG_RETRY_BUDGET', 30.0)             # Секунды на все повторы одного вызова
+
+# Circuit breaker: после N сбоев подряд эндпоинт отвечает ошибкой сразу, пробный запрос - через M секунд
+SNAG_CIRCUIT_FAILURE_THRESHOLD = _env_int('SNAG_CIRCUIT_FAILURE_THRESHOLD', 5)   # 0 отключает
+SNAG_CIRCUIT_RECOVERY_TIMEOUT = _env_float('SNAG_CIRCUIT_RECOVERY_TIMEOUT', 30.0)
+
+# Кэш GET-ответов Snag (0 отключает). TTL переопределяются строкой "эндпоинт=секунды;..."
+SNAG_CACHE_MAX_ENTRIES = _env_int('SNAG_CACHE_MAX_ENTRIES', 2000)
+SNAG_CACHE_TTLS = parse_endpoint_ttls(os.getenv('SNAG_CACHE_TTLS'))
+
+# Сколько Discord handle одновременно ищется при пакетном поиске кошельков
+IDENTITY_RESOLVER_CONCURRENCY = _env_int('IDENTITY_RESOLVER_CONCURRENCY', 25)
+
+# Локальный кэш "handle -> кошелек" в SQLite (пустой путь отключает кэш)
+IDENTITY_CACHE_PATH = os.getenv('IDENTITY_CACHE_PATH', 'data/identity_cache.sqlite3')
+IDENTITY_CACHE_FRESH_TTL = _env_float('IDENTITY_CACHE_FRESH_TTL', 6 * 3600)       # Секунды без повторной проверки
+IDENTITY_CACHE_STALE_TTL = _env_float('IDENTITY_CACHE_STALE_TTL', 7 * 86400)      # Секунды, пока запись отдается с фоновым обновлением
+IDENTITY_CACHE_NEGATIVE_TTL = _env_float('IDENTITY_CACHE_NEGATIVE_TTL', 3600)     # Секунды жизни записи "кошелек не найден"
+
+# Локальное хранилище истории транзакций кошельков в SQLite (пустой путь отключает):
+# повторные запросы скачивают только новые записи, длинная история догружается частями
+TRANSACTION_STORE_PATH = os.getenv('TRANSACTION_STORE_PATH', 'data/transaction_store.sqlite3')
+TRANSACTION_STORE_FRESH_TTL = _env_float('TRANSACTION_STORE_FRESH_TTL', 15.0)  # Секунды, когда полная история отдается без запроса к API
+
+# Общий каталог правил лояльности Main системы: загружается один раз и обновляется в фоне
+RULES_CATALOG_REFRESH_INTERVAL = _env_float('RULES_CATALOG_REFRESH_INTERVAL', 300.0)  # Секунды между обновлениями (0 - только загрузка при старте)
+
+# Общий справочник валют Main системы: читается без ожидания API, обновляется в фоне
+CURRENCY_REGISTRY_REFRESH_INTERVAL = _env_float('CURRENCY_REGISTRY_REFRESH_INTERVAL', 1800.0)  # Секунды между обновлениями
+
+# Локальный эндпоинт метрик Snag API в формате Prometheus: GET http://HOST:PORT/metrics (0 отключает)
+SNAG_METRICS_PORT = _env_int('SNAG_METRICS_PORT', 0)
+SNAG_METRICS_HOST = os.getenv('SNAG_METRICS_HOST', '127.0.0.1')
+
 # Проверки токенов
 if DISCORD_TOKEN is None:
     logger.critical("CRITICAL ERROR: DISCORD_TOKEN not found in .env file. Bot cannot start.")
@@ -185,17 +286,51 @@ async def load_extensions(bot_instance: commands.Bot):
     logger.info(f"Cogs loading finished. Success: {loaded_count}, Failed: {failed_count}.")
 
 
+# --- Пул соединений для Snag API ---
+def build_http_connector() -> aiohttp.TCPConnector:
+    """
+    Создает TCPConnector с ограниченным пулом, кэшем DNS и настроенным keep-alive.
+    Должен вызываться внутри запущенного event loop.
+    """
+    logger.info(
+        f"HTTP pool: limit={HTTP_POOL_LIMIT}, limit_per_host={HTTP_POOL_LIMIT_PER_HOST}, "
+        f"dns_cache_ttl={HTTP_DNS_CACHE_TTL}s, keepalive_timeout={HTTP_KEEPALIVE_TIMEOUT}s"
+    )
+    return aiohttp.TCPConnector(
+        limit=HTTP_POOL_LIMIT,
+        limit_per_host=HTTP_POOL_LIMIT_PER_HOST,
+        ttl_dns_cache=HTTP_DNS_CACHE_TTL,
+        use_dns_cache=HTTP_DNS_CACHE_TTL > 0,
+        keepalive_timeout=HTTP_KEEPALIVE_TIMEOUT,
+    )
+
+
 # --- Основная асинхронная функция запуска ---
 async def main():
-    # Создаем сессию aiohttp один раз
-    async with aiohttp.ClientSession() as session:
+    # Создаем сессию aiohttp один раз, с настроенным пулом соединений
+    async with aiohttp.ClientSession(connector=build_http_connector()) as session:
         # Инициализируем основной Snag API клиент (для нового API)
         bot.snag_client = SnagApiClient(
             session,
             MAIN_SNAG_API_KEY,
             MAIN_ORGANIZATION_ID,
             MAIN_WEBSITE_ID,
-            client_name="MainSnagClient" # Имя для логов
+            client_name="MainSnagClient", # Имя для логов
+            max_concurrent_requests=MAIN_SNAG_MAX_CONNECTIONS,
+            rate_limit=MAIN_SNAG_RATE_LIMIT,
+            rate_burst=MAIN_SNAG_RATE_BURST,
+            endpoint_rate_limits=MAIN_SNAG_ENDPOINT_RATE_LIMITS,
+            max_retries=SNAG_MAX_RETRIES,
+            retry_backoff_base=SNAG_RETRY_BACKOFF_BASE,
+            retry_backoff_max=SNAG_RETRY_BACKOFF_MAX,
+            retry_budget=SNAG_RETRY_BUDGET,
+            cache_max_entries=SNAG_CACHE_MAX_ENTRIES,
+            cache_ttls=SNAG_CACHE_TTLS,
+            circuit_failure_threshold=SNAG_CIRCUIT_FAILURE_THRESHOLD,
+            circuit_recovery_timeout=SNAG_CIRCUIT_RECOVERY_TIMEOUT,
+            interactive_reserve=MAIN_SNAG_INTERACTIVE_RESERVE,
+            bulk_fairness=SNAG_BULK_FAIRNESS,
+            base_url=SNAG_API_BASE_URL
         )
         # Инициализируем устаревший Snag API клиент (для старого API)
         bot.snag_client_legacy = SnagApiClient(
@@ -203,14 +338,94 @@ async def main():
             LEGACY_SNAG_API_KEY,
             LEGACY_ORGANIZATION_ID,
             LEGACY_WEBSITE_ID,
-            client_name="LegacySnagClient" # Имя для логов
+            client_name="LegacySnagClient", # Имя для логов
+            max_concurrent_requests=LEGACY_SNAG_MAX_CONNECTIONS,
+            rate_limit=LEGACY_SNAG_RATE_LIMIT,
+            rate_burst=LEGACY_SNAG_RATE_BURST,
+            endpoint_rate_limits=LEGACY_SNAG_ENDPOINT_RATE_LIMITS,
+            max_retries=SNAG_MAX_RETRIES,
+            retry_backoff_base=SNAG_RETRY_BACKOFF_BASE,
+            retry_backoff_max=SNAG_RETRY_BACKOFF_MAX,
+            retry_budget=SNAG_RETRY_BUDGET,
+            cache_max_entries=SNAG_CACHE_MAX_ENTRIES,
+            cache_ttls=SNAG_CACHE_TTLS,
+            circuit_failure_threshold=SNAG_CIRCUIT_FAILURE_THRESHOLD,
+            circuit_recovery_timeout=SNAG_CIRCUIT_RECOVERY_TIMEOUT,
+            interactive_reserve=LEGACY_SNAG_INTERACTIVE_RESERVE,
+            bulk_fairness=SNAG_BULK_FAIRNESS,
+            base_url=SNAG_API_BASE_URL
+        )
+        # Локальный кэш соответствий handle -> кошелек; переживает перезапуск бота
+        bot.identity_cache = None
+        if IDENTITY_CACHE_PATH:
+            try:
+                bot.identity_cache = IdentityCache(
+                    IDENTITY_CACHE_PATH,
+                    fresh_ttl=IDENTITY_CACHE_FRESH_TTL,
+                    stale_ttl=IDENTITY_CACHE_STALE_TTL,
+                    negative_ttl=IDENTITY_CACHE_NEGATIVE_TTL
+                )
+                # Перенос кошелька (запись метаданных) делает старые соответствия недействительными
+                bot.snag_client.add_write_listener(bot.identity_cache.handle_snag_write)
+                bot.snag_client_legacy.add_write_listener(bot.identity_cache.handle_snag_write)
+            except Exception as e:
+                logger.error(f"Failed to open identity cache at {IDENTITY_CACHE_PATH}: {e}. Continuing without it.")
+                bot.identity_cache = None
+        # Локальная история транзакций (используется для Main системы)
+        bot.transaction_store = None
+        if TRANSACTION_STORE_PATH:
+            try:
+                bot.transaction_store = TransactionStore(TRANSACTION_STORE_PATH, fresh_ttl=TRANSACTION_STORE_FRESH_TTL)
+                bot.snag_client.add_write_listener(bot.transaction_store.handle_snag_write)
+            except Exception as e:
+                logger.error(f"Failed to open transaction store at {TRANSACTION_STORE_PATH}: {e}. Continuing without it.")
+                bot.transaction_store = None
+        # Каталог правил (квестов) Main системы для статистики, поиска и смены видимости
+        bot.rules_catalog = RulesCatalog(
+            bot.snag_client,
+            organization_id=MAIN_ORGANIZATION_ID,
+            website_id=MAIN_WEBSITE_ID,
+            refresh_interval=RULES_CATALOG_REFRESH_INTERVAL
         )
+        bot.snag_client.add_write_listener(bot.rules_catalog.handle_snag_write)
+        # Справочник валют Main системы (имена валют для балансов, истории и сообщений)
+        bot.currency_registry = CurrencyRegistry(bot.snag_client, refresh_interval=CURRENCY_REGISTRY_REFRESH_INTERVAL)
+        # Пакетный поиск кошельков по Discord handle в обеих системах
+        bot.identity_resolver = IdentityResolver(
+            bot.snag_client,
+            bot.snag_client_legacy,
+            max_concurrency=IDENTITY_RESOLVER_CONCURRENCY,
+            identity_cache=bot.identity_cache
+        )
+
+        # Метрики обоих клиентов для Prometheus (то же, что показывает !snagstats)
+        metrics_runner = None
+        if SNAG_METRICS_PORT > 0:
+            try:
+                metrics_runner = await start_metrics_server(
+                    lambda: [bot.snag_client, bot.snag_client_legacy], SNAG_METRICS_HOST, SNAG_METRICS_PORT
+                )
+                logger.info(f"Snag API metrics available at http://{SNAG_METRICS_HOST}:{SNAG_METRICS_PORT}/metrics")
+            except OSError as e:
+                logger.error(f"Failed to start metrics server on {SNAG_METRICS_HOST}:{SNAG_METRICS_PORT}: {e}. Continuing without it.")
 
         # Запускаем бота с созданными клиентами
         async with bot:
             await load_extensions(bot)
+            bot.rules_catalog.start()
+            bot.currency_registry.start()
             logger.info("Starting bot...")
-            await bot.start(DISCORD_TOKEN)
+            try:
+                await bot.start(DISCORD_TOKEN)
+            finally:
+                await bot.rules_catalog.close()
+                await bot.currency_registry.close()
+                if bot.identity_cache:
+                    bot.identity_cache.close()
+                if bot.transaction_store:
+                    bot.transaction_store.close()
+                if metrics_runner:
+                    await metrics_runner.cleanup()
 
 # --- Точка входа скрипта ---
 if __name__ == "__main__":
@@ -9,6 +9,7 @@ import io
 from typing import Dict, Optional
 from decimal import Decimal, InvalidOperation
 from utils.checks import is_prefix_admin_in_guild 
+from utils.currency_registry import CurrencyRegistry
 
 logger = logging.getLogger(__name__)
 
@@ -128,6 +129,7 @@ class BalanceAdjustmentCog(commands.Cog, name="Balance Adjustments"):
         self.snag_client = getattr(bot, 'snag_client', None)
         if not self.snag_client:
             logger.error(f"{self.__class__.__name__}: Main SnagApiClient (bot.snag_client) not found! Balance adjustments will not work.")
+        self.currency_registry: Optional[CurrencyRegistry] = getattr(bot, 'currency_registry', None)
         logger.info(f"Cog '{self.__class__.__name__}' loaded.")
 
     async def cog_load(self):
@@ -140,6 +142,12 @@ class BalanceAdjustmentCog(commands.Cog, name="Balance Adjustments"):
             await interaction.followup.send("⚠️ Main Snag API client is not configured. Cannot proceed.", ephemeral=True)
             return
 
+        # Справочник валют читается без запроса к API; если он еще не загружен, проверка пропускается
+        currency_name = self.currency_registry.name(MATCHSTICKS_CURRENCY_ID, "Matchsticks") if self.currency_registry else "Matchsticks"
+        if self.currency_registry and self.currency_registry.is_deleted(MATCHSTICKS_CURRENCY_ID):
+            await interaction.followup.send(f"⚠️ Currency {currency_name} (`{MATCHSTICKS_CURRENCY_ID}`) is deleted in Snag. Adjustment aborted.", ephemeral=True)
+            return
+
         # Формируем основное описание, которое ПОЙДЕТ В UI (верхнеуровневый description)
         if not reason_from_modal: # Если причина пустая
             main_api_description = f"Administrative balance adjustment ({BOT_SIGNATURE})"
@@ -174,7 +182,7 @@ class BalanceAdjustmentCog(commands.Cog, name="Balance Adjustments"):
             final_payload_for_api['websiteId'] = self.snag_client._website_id
 
         try:
-            logger.info(f"Attempting balance adjustment for {wallet_address}: {direction} {abs_amount} Matchsticks. Reason from modal: '{reason_from_modal}'. API Payload: {final_payload_for_api}")
+            logger.info(f"Attempting balance adjustment for {wallet_address}: {direction} {abs_amount} {currency_name}. Reason from modal: '{reason_from_modal}'. API Payload: {final_payload_for_api}")
             response = await self.snag_client.create_transaction(tx_data=final_payload_for_api)
 
             is_successful_creation = False
@@ -193,7 +201,7 @@ class BalanceAdjustmentCog(commands.Cog, name="Balance Adjustments"):
                 display_reason_for_user = reason_from_modal if reason_from_modal else "Administrative adjustment"
                 success_msg = (
                     f"✅ Successfully processed balance adjustment for wallet `{wallet_address}`.\n"
-                    f"Operation: **{direction.upper()} {abs_amount} Matchsticks**.\n"
+                    f"Operation: **{direction.upper()} {abs_amount} {currency_name}**.\n"
                     f"Reason: {display_reason_for_user}.\n" 
                     f"Transaction Batch ID: ...{new_tx_batch_id[-6:] if new_tx_batch_id != 'N/A' else 'N/A'}"
                 )
@@ -8,10 +8,20 @@ import asyncio
 import math
 import re
 import os
-from typing import Dict, Any, Optional, List, Tuple
+import time
+import tempfile
+from typing import Dict, Any, Optional, List, Tuple, Awaitable, Callable, Union
+from collections import OrderedDict
 from decimal import Decimal
 
-from utils.snag_api_client import SnagApiClient
+from utils.snag_api_client import SnagApiClient, SnagPageIterator, PRIORITY_BULK
+from utils.identity_cache import IdentityCache, FRESH
+from utils.transaction_store import TransactionStore, StoredHistoryIterator, WalletAggregates
+from utils.transaction_records import TransactionRecord, parse_api_datetime
+from utils.rules_catalog import RulesCatalog
+from utils.currency_registry import CurrencyRegistry
+from utils.history_export import EXPORT_FORMATS, write_transaction_export
+from utils.identity_resolver import SYSTEM_MAIN, SYSTEM_LEGACY
 from cogs.block_checker_cog import BlockCheckModal
 from cogs.block_unblock_cog import BlockUnblockModal
 from utils.checks import is_prefix_admin_in_guild
@@ -22,11 +32,20 @@ EVM_ADDRESS_PATTERN = re.compile(r"^0x[a-fA-F0-9]{40}$")
 # --- КОНСТАНТЫ ---
 PAGE_LIMIT = 1000 
 MAX_API_PAGES_TO_FETCH = 20
-API_REQUEST_DELAY = 0.3
 ITEMS_PER_PAGE = 10 
 BADGES_PER_PAGE = 5 
+BADGE_API_PAGE_SIZE = 25 # Бейджей в одном запросе к API при листании (5 страниц Discord)
+BADGE_PAGE_CACHE_SIZE = 4 # Сколько страниц API с бейджами держит одно окно
+PAGE_EMBED_CACHE_SIZE = 32 # Сколько готовых embed страниц помнит один пагинатор
 VIEW_TIMEOUT = 300.0
+QUEST_STATS_TOP_RULES = 10 # Сколько квестов показывать в разбивке по правилам
+HISTORY_LIVE_UPDATE_INTERVAL = 2.0 # Секунды между обновлениями сообщения истории, пока догружаются страницы
 MATCHSTICKS_CURRENCY_ID = os.getenv("MATCHSTICKS_CURRENCY_ID", "7f74ae35-a6e2-496a-83ea-5b2e18769560")
+# Дедлайны (секунды) на ответ каждой системы при одновременном запросе в обе
+MAIN_SYSTEM_LOOKUP_TIMEOUT = float(os.getenv("MAIN_SYSTEM_LOOKUP_TIMEOUT", "25"))
+LEGACY_SYSTEM_LOOKUP_TIMEOUT = float(os.getenv("LEGACY_SYSTEM_LOOKUP_TIMEOUT", "15"))
+OLD_SYSTEM_FIELD = "Old Loyalty System"
+NEW_SYSTEM_FIELD = "New Loyalty System"
 
 # --- Модальные Окна ---
 class FindWalletModal(discord.ui.Modal, title="Find Wallet by Social Handle"):
@@ -67,68 +86,185 @@ class AddressForStatsModal(discord.ui.Modal, title="Get Quest Statistics"):
     async def on_submit(self, interaction: discord.Interaction): await interaction.response.defer(thinking=True, ephemeral=True); await self.cog.handle_quest_stats_logic(interaction, self.address_input.value)
     async def on_error(self, interaction: discord.Interaction, error: Exception): logger.error(f"AddressForStatsModal Error: {error}", exc_info=True); await interaction.followup.send('An error occurred in the quest stats modal.', ephemeral=True)
 
+class ExportHistoryModal(discord.ui.Modal, title="Export Full Transaction History"):
+    address_input = discord.ui.TextInput(label='EVM Wallet Address', placeholder='0x...', required=True, style=discord.TextStyle.short, min_length=42, max_length=42, row=0)
+    format_input = discord.ui.TextInput(label='Format (csv or ndjson)', placeholder='csv', default='csv', required=False, style=discord.TextStyle.short, max_length=10, row=1)
+    def __init__(self, cog_instance: "ControlPanelCog"): super().__init__(timeout=None); self.cog = cog_instance
+    async def on_submit(self, interaction: discord.Interaction): await interaction.response.defer(thinking=True, ephemeral=True); await self.cog.handle_export_history_logic(interaction, self.address_input.value, self.format_input.value)
+    async def on_error(self, interaction: discord.Interaction, error: Exception): logger.error(f"ExportHistoryModal Error: {error}", exc_info=True); await interaction.followup.send('An error occurred in the export modal.', ephemeral=True)
+
+
+# --- Обработка записей истории транзакций ---
+def _filter_transactions(transactions: List[Dict[str, Any]], name_filter: Optional[str]) -> Tuple[List[TransactionRecord], Decimal, Decimal]:
+    """Оставляет записи, подходящие под фильтр по названию (в компактном виде), и считает по ним Matchsticks (кредит, дебет)."""
+    name_filter = name_filter.strip().lower() if name_filter and name_filter.strip() else None
+    kept: List[TransactionRecord] = []
+    credits = Decimal('0'); debits = Decimal('0')
+    for tx in transactions:
+        record = TransactionRecord.from_entry(tx)
+        if name_filter and name_filter not in record.rule_name.lower():
+            continue
+        kept.append(record)
+        if record.currency_id == MATCHSTICKS_CURRENCY_ID and record.amount is not None:
+            if record.direction == "credit": credits += record.amount
+            elif record.direction == "debit": debits += record.amount
+    return kept, credits, debits
+
+def _history_warning(entries: Union[SnagPageIterator, StoredHistoryIterator], client_name: str) -> str:
+    warning_message = ""
+    if entries.error:
+        warning_message += f"⚙️ Error fetching transaction history (Page {entries.pages_fetched}) from {client_name}.\n"
+    if entries.truncated and isinstance(entries, StoredHistoryIterator):
+        warning_message += f"⚠️ Loaded max pages ({MAX_API_PAGES_TO_FETCH}) this time. Older history will continue loading on the next request.\n"
+    elif entries.truncated:
+        warning_message += f"⚠️ Loaded max pages ({MAX_API_PAGES_TO_FETCH}). History might be incomplete.\n"
+    return warning_message.strip()
+
+
+class PageEmbedCache:
+    """
+    LRU готовых embed страниц пагинатора. Ключ включает все, от чего зависит страница (номер, число
+    загруженных записей, флаги загрузки), поэтому после догрузки старые embed просто не находятся.
+    """
+    def __init__(self, max_size: int = PAGE_EMBED_CACHE_SIZE):
+        self.max_size = max_size
+        self._embeds: "OrderedDict[Tuple[Any, ...], discord.Embed]" = OrderedDict()
+
+    def get(self, key: Tuple[Any, ...]) -> Optional[discord.Embed]:
+        embed = self._embeds.get(key)
+        if embed is None: return None
+        self._embeds.move_to_end(key)
+        embed.timestamp = discord.utils.utcnow()
+        return embed
+
+    def put(self, key: Tuple[Any, ...], embed: discord.Embed) -> discord.Embed:
+        self._embeds[key] = embed; self._embeds.move_to_end(key)
+        while len(self._embeds) > self.max_size: self._embeds.popitem(last=False)
+        return embed
+
 
 # --- Пагинатор TransactionHistoryPaginatorView ---
 class TransactionHistoryPaginatorView(discord.ui.View):
+    """
+    Пагинатор истории транзакций. С entries (итератор страниц API) работает потоково:
+    первая страница показывается сразу, остальные догружаются в фоне, число страниц и суммы
+    Matchsticks обновляются на лету, а переход за пределы загруженного ждет нужных записей.
+    Записи хранятся как TransactionRecord, а не сырые ответы API; готовые embed страниц кэшируются.
+    """
     current_page: int = 1
     sep: int = ITEMS_PER_PAGE 
-    def __init__(self, original_interaction: discord.Interaction, all_transactions: List[Dict[str, Any]], target_address: str, total_matchsticks_credits: Decimal, total_matchsticks_debits: Decimal):
+    def __init__(self, original_interaction: discord.Interaction, all_transactions: List[TransactionRecord], target_address: str, total_matchsticks_credits: Decimal, total_matchsticks_debits: Decimal,
+                 entries: Optional[Union[SnagPageIterator, StoredHistoryIterator]] = None, name_filter: Optional[str] = None, client_name: str = "SnagClient",
+                 currency_registry: Optional[CurrencyRegistry] = None):
         super().__init__(timeout=VIEW_TIMEOUT)
         self.original_interaction = original_interaction
         self.all_transactions = all_transactions
         self.target_address = target_address
         self.total_matchsticks_credits = total_matchsticks_credits
         self.total_matchsticks_debits = total_matchsticks_debits
-        self.net_matchsticks_total = self.total_matchsticks_credits - self.total_matchsticks_debits
-        self.max_pages = math.ceil(len(self.all_transactions) / self.sep) if self.all_transactions else 1
         self.message: Optional[discord.Message] = None
+        self.warning_message = ""
+        self._entries = entries
+        self._name_filter = name_filter
+        self._client_name = client_name
+        self._currency_registry = currency_registry
+        self.loading = entries is not None
+        self.api_pages_loaded = 0
+        self._progress = asyncio.Condition()
+        self._load_task: Optional[asyncio.Task] = None
+        self._last_refresh = 0.0
+        self._embed_cache = PageEmbedCache()
         self._update_buttons()
 
-    async def _get_page_data(self) -> List[Dict[str, Any]]:
-        base = (self.current_page - 1) * self.sep
-        return self.all_transactions[base : base + self.sep]
+    @property
+    def net_matchsticks_total(self) -> Decimal:
+        return self.total_matchsticks_credits - self.total_matchsticks_debits
+
+    @property
+    def max_pages(self) -> int:
+        return math.ceil(len(self.all_transactions) / self.sep) if self.all_transactions else 1
 
-    async def _create_page_embed(self, page_transactions: List[Dict[str, Any]]) -> discord.Embed:
+    def start_loading(self):
+        if self._entries is not None and self._load_task is None:
+            self._load_task = asyncio.create_task(self._load_remaining())
+
+    async def _load_remaining(self):
+        try:
+            async for page in self._entries.pages():
+                kept, credits, debits = _filter_transactions(page, self._name_filter)
+                self.all_transactions.extend(kept)
+                self.all_transactions.sort(key=lambda record: record.sort_key, reverse=True)
+                self.total_matchsticks_credits += credits
+                self.total_matchsticks_debits += debits
+                self.api_pages_loaded += 1
+                async with self._progress: self._progress.notify_all()
+                await self._refresh_message()
+            self.warning_message = _history_warning(self._entries, self._client_name)
+            logger.info(f"[{self._client_name}] Loaded {len(self.all_transactions)} transactions for {self.target_address} in {self.api_pages_loaded} API pages.")
+        except asyncio.CancelledError:
+            self.loading = False
+            raise
+        except Exception as e:
+            logger.exception(f"[{self._client_name}] Error streaming transaction history for {self.target_address}")
+            self.warning_message = f"⚙️ Error fetching transaction history from {self._client_name}: {e}"
+        self.loading = False
+        async with self._progress: self._progress.notify_all()
+        await self._refresh_message(force=True)
+
+    async def _wait_for(self, predicate) -> None:
+        """Ждет, пока predicate() станет истинным или загрузка закончится."""
+        if not self.loading: return
+        async with self._progress:
+            await self._progress.wait_for(lambda: predicate() or not self.loading)
+
+    async def wait_for_first_page(self):
+        await self._wait_for(lambda: self.api_pages_loaded > 0)
+
+    async def _refresh_message(self, force: bool = False):
+        """Перерисовывает текущую страницу с новым числом страниц и суммами, не чаще HISTORY_LIVE_UPDATE_INTERVAL."""
+        if not self.message: return
+        now = time.monotonic()
+        if not force and now - self._last_refresh < HISTORY_LIVE_UPDATE_INTERVAL: return
+        self._last_refresh = now
+        self._update_buttons(); embed = await self._render_current_page()
+        try: await self.message.edit(content=self.warning_message or None, embed=embed, view=self)
+        except discord.HTTPException as e: logger.error(f"Error updating streaming transaction history message: {e}")
+
+    async def _prepare_page(self):
+        # Страница за пределами загруженного: ждем фоновую догрузку
+        await self._wait_for(lambda: len(self.all_transactions) >= self.current_page * self.sep)
+        self.current_page = max(1, min(self.current_page, self.max_pages))
+
+    async def _render_current_page(self) -> discord.Embed:
+        """Embed текущей страницы из кэша; перерисовывается, только если страница или данные изменились."""
+        key = (self.current_page, self.api_pages_loaded, len(self.all_transactions), self.loading)
+        embed = self._embed_cache.get(key)
+        if embed is None:
+            base = (self.current_page - 1) * self.sep
+            embed = self._embed_cache.put(key, await self._create_page_embed(self.all_transactions[base : base + self.sep]))
+        return embed
+
+    async def _create_page_embed(self, page_transactions: List[TransactionRecord]) -> discord.Embed:
         embed = discord.Embed(title=f"Transaction History for:",
                               description=f"`{self.target_address}`",
                               color=discord.Color.blue()) 
 
         if not page_transactions and self.current_page == 1:
-            embed.description += "\n\nNo relevant transactions found."
+            embed.description += "\n\n⏳ Loading transactions..." if self.loading else "\n\nNo relevant transactions found."
         else:
             for tx in page_transactions:
-                amount_str = tx.get("amount", "N/A")
-                created_at_str = tx.get("createdAt")
-                
-                rule_name = "Unknown Transaction"
-                loyalty_transaction_data = tx.get("loyaltyTransaction")
-                if isinstance(loyalty_transaction_data, dict):
-                    loyalty_rule_data = loyalty_transaction_data.get("loyaltyRule")
-                    if isinstance(loyalty_rule_data, dict):
-                        name_from_rule = loyalty_rule_data.get("name")
-                        if name_from_rule and name_from_rule.strip():
-                            rule_name = name_from_rule.strip()
-                    
-                    if rule_name == "Unknown Transaction" or not rule_name.strip():
-                        desc_from_lt = loyalty_transaction_data.get("description")
-                        if desc_from_lt and desc_from_lt.strip():
-                            rule_name = desc_from_lt.strip()
-                
-                if rule_name == "Unknown Transaction" or not rule_name.strip():
-                    desc_from_tx = tx.get("description")
-                    if desc_from_tx and desc_from_tx.strip():
-                        rule_name = desc_from_tx.strip()
-                
-                if not rule_name.strip():
-                    rule_name = "Unnamed Transaction Entry"
-
-                date_formatted = self._format_datetime_static(created_at_str)
-                currency_id_tx = tx.get("loyaltyCurrencyId")
-                currency_name_display = f"Currency ID: {currency_id_tx[:8]}"
+                amount_str = tx.amount if tx.amount is not None else "N/A"
+                rule_name = tx.rule_name
+                date_formatted = self._format_datetime_static(tx.created_at or tx.raw_created_at)
+                currency_id_tx = tx.currency_id
                 if currency_id_tx == MATCHSTICKS_CURRENCY_ID:
                     currency_name_display = "Matchsticks"
+                elif self._currency_registry:
+                    currency_name_display = self._currency_registry.name(currency_id_tx)
+                else:
+                    currency_name_display = f"Currency ID: {(currency_id_tx or 'N/A')[:8]}"
                 
-                direction = tx.get("direction", "unknown")
+                direction = tx.direction or "unknown"
                 icon = "⚙️" 
                 action_verb = "Action"
                 
@@ -143,7 +279,7 @@ class TransactionHistoryPaginatorView(discord.ui.View):
                 field_value = f"**{action_verb}:** `{amount_str}` {currency_name_display}**Date:** {date_formatted}"
                 embed.add_field(name=field_name, value=field_value, inline=False)
         
-        footer_lines = [f"Page {self.current_page} of {self.max_pages}"]
+        footer_lines = [f"Page {self.current_page} of {self.max_pages}+ (loading...)" if self.loading else f"Page {self.current_page} of {self.max_pages}"]
         if self.total_matchsticks_credits > 0 or self.total_matchsticks_debits > 0:
             footer_lines.append(f"Credit Matchsticks : {self.total_matchsticks_credits}")
             footer_lines.append(f"Debit Matchsticks : {self.total_matchsticks_debits}")
@@ -154,22 +290,16 @@ class TransactionHistoryPaginatorView(discord.ui.View):
         return embed
 
     @staticmethod
-    def _format_datetime_static(datetime_str: Optional[str]) -> str:
-        if not datetime_str: return "Date unknown"
-        formats_to_try = ["%Y-%m-%dT%H:%M:%S.%fZ", "%Y-%m-%dT%H:%M:%SZ"]
-        parsed_dt = None
-        for fmt in formats_to_try:
-            try:
-                dt_obj_naive = datetime.datetime.strptime(datetime_str.split('.')[0].replace('Z',''), '%Y-%m-%dT%H:%M:%S')
-                parsed_dt = dt_obj_naive.replace(tzinfo=timezone.utc)
-                break
-            except ValueError: continue
+    def _format_datetime_static(value: Union[str, datetime.datetime, None]) -> str:
+        if not value: return "Date unknown"
+        parsed_dt = value if isinstance(value, datetime.datetime) else parse_api_datetime(value)
         if parsed_dt: return parsed_dt.strftime("%d/%m/%y %H:%M")
-        logger.warning(f"Could not parse date format: {datetime_str}"); return datetime_str
+        logger.warning(f"Could not parse date format: {value}"); return value
 
     def _update_buttons(self):
         self.first_page.disabled = self.current_page == 1; self.prev_page.disabled = self.current_page == 1
-        self.next_page.disabled = self.current_page >= self.max_pages; self.last_page.disabled = self.current_page >= self.max_pages
+        at_end = self.current_page >= self.max_pages and not self.loading
+        self.next_page.disabled = at_end; self.last_page.disabled = at_end
 
     async def interaction_check(self, interaction: discord.Interaction) -> bool:
         if interaction.user.id != self.original_interaction.user.id: await interaction.response.send_message("Sorry, only the user who initiated this can use these buttons.", ephemeral=True); return False
@@ -177,7 +307,7 @@ class TransactionHistoryPaginatorView(discord.ui.View):
 
     async def _send_page(self, interaction: discord.Interaction):
         if not interaction.response.is_done(): await interaction.response.defer()
-        self._update_buttons(); page_data = await self._get_page_data(); embed = await self._create_page_embed(page_data)
+        await self._prepare_page(); self._update_buttons(); embed = await self._render_current_page()
         if self.message: await self.message.edit(embed=embed, view=self)
         elif interaction.is_original_response(): await interaction.edit_original_response(embed=embed, view=self)
         else: await interaction.followup.edit_message(message_id=interaction.message.id if interaction.message else "@original", embed=embed, view=self)
@@ -190,23 +320,99 @@ class TransactionHistoryPaginatorView(discord.ui.View):
         await self._send_page(interaction)
     @discord.ui.button(label="Next >", style=discord.ButtonStyle.primary, row=0, custom_id="txh_next_v1_final_rbk2")
     async def next_page(self, interaction: discord.Interaction, button: discord.ui.Button):
-        if self.current_page < self.max_pages: self.current_page += 1
+        if self.current_page < self.max_pages or self.loading: self.current_page += 1
         await self._send_page(interaction)
     @discord.ui.button(label="Last >|", style=discord.ButtonStyle.secondary, row=0, custom_id="txh_last_v1_final_rbk2")
-    async def last_page(self, interaction: discord.Interaction, button: discord.ui.Button): self.current_page = self.max_pages; await self._send_page(interaction)
+    async def last_page(self, interaction: discord.Interaction, button: discord.ui.Button):
+        if not interaction.response.is_done(): await interaction.response.defer()
+        await self._wait_for(lambda: False) # Последняя страница известна только после полной загрузки
+        self.current_page = self.max_pages; await self._send_page(interaction)
     async def on_timeout(self) -> None:
+        if self._load_task and not self._load_task.done(): self._load_task.cancel()
         if self.message:
             try: await self.message.edit(view=None)
             except discord.HTTPException as e: logger.error(f"Error removing view on timeout for TransactionHistoryPaginatorView: {e}")
 
 class BadgePaginatorView(discord.ui.View): 
+    """
+    Пагинатор бейджей. С fetch_page (курсор, размер -> ответ API) работает лениво: страницы API
+    запрашиваются по мере листания, последние BADGE_PAGE_CACHE_SIZE из них хранятся в LRU, а курсоры
+    и смещения всех страниц запоминаются, чтобы вытесненную страницу можно было перезапросить.
+    Пока последняя страница API не получена, показывается "at least N badges". Готовые embed страниц
+    кэшируются, так что возврат к уже показанной странице не запрашивает вытесненные страницы API.
+    """
     current_page: int = 1; sep: int = BADGES_PER_PAGE
-    def __init__(self, original_interaction: discord.Interaction, all_badges: List[Dict[str, Any]], target_address: str):
-        super().__init__(timeout=VIEW_TIMEOUT); self.original_interaction = original_interaction; self.all_badges = all_badges; self.target_address = target_address
-        self.max_pages = math.ceil(len(self.all_badges) / self.sep) if self.all_badges else 1; self.message: Optional[discord.Message] = None; self._update_buttons()
-    async def _get_page_data(self) -> List[Dict[str, Any]]: base = (self.current_page - 1) * self.sep; return self.all_badges[base : base + self.sep]
+    def __init__(self, original_interaction: discord.Interaction, all_badges: Optional[List[Dict[str, Any]]], target_address: str,
+                 fetch_page: Optional[Callable[[Optional[str], int], Awaitable[Optional[Dict]]]] = None):
+        super().__init__(timeout=VIEW_TIMEOUT); self.original_interaction = original_interaction; self.target_address = target_address
+        self.message: Optional[discord.Message] = None
+        self._fetch_page = fetch_page
+        self._api_pages: "OrderedDict[int, List[Dict[str, Any]]]" = OrderedDict()
+        self._page_cursors: List[Optional[str]] = [None]  # курсор startingAfter для каждой страницы API (+ следующей)
+        self._page_offsets: List[int] = [0]               # индекс первого бейджа каждой страницы API (+ всего известно)
+        self._page_sizes: List[int] = []                  # limit, с которым запрашивалась страница API
+        self.complete = fetch_page is None; self.truncated = False; self.error: Optional[Dict[str, Any]] = None
+        self._fetch_lock = asyncio.Lock()
+        self._embed_cache = PageEmbedCache()
+        if all_badges is not None:
+            self._api_pages[0] = all_badges; self._page_offsets.append(len(all_badges)); self._page_cursors.append(None); self._page_sizes.append(len(all_badges))
+        self._update_buttons()
+    @property
+    def known_badges(self) -> int: return self._page_offsets[-1]
+    @property
+    def max_pages(self) -> int: return math.ceil(self.known_badges / self.sep) if self.known_badges else 1
+    async def _fetch_api_page(self, index: int, page_size: int = BADGE_API_PAGE_SIZE) -> Optional[List[Dict[str, Any]]]:
+        if index < len(self._page_sizes): page_size = self._page_sizes[index] # Перезапрос вытесненной страницы теми же границами
+        response = await self._fetch_page(self._page_cursors[index], page_size)
+        if not response or response.get("error") or not isinstance(response.get("data"), list):
+            self.error = response or {"error": True, "status": "NoResponse", "message": "No API response."}
+            logger.error(f"Badge page {index + 1} for {self.target_address} failed: {self.error.get('status')} {self.error.get('message')}")
+            return None
+        raw_items = response["data"]; badges = [b for b in raw_items if isinstance(b, dict) and not b.get("deletedAt")]
+        if index == len(self._page_offsets) - 1: # Новая страница на границе известного
+            next_cursor = raw_items[-1].get("id") if raw_items and isinstance(raw_items[-1], dict) else None
+            self._page_offsets.append(self._page_offsets[index] + len(badges)); self._page_cursors.append(next_cursor); self._page_sizes.append(page_size)
+            if not (response.get("hasNextPage") and next_cursor): self.complete = True
+        self._api_pages[index] = badges; self._api_pages.move_to_end(index)
+        while len(self._api_pages) > BADGE_PAGE_CACHE_SIZE: self._api_pages.popitem(last=False)
+        return badges
+    async def _ensure_known(self, end_index: Optional[int]):
+        """Догружает страницы API, пока не известно end_index бейджей (None - все, крупными страницами)."""
+        async with self._fetch_lock:
+            big_pages = 0
+            while not self.complete and not self.error and (end_index is None or self.known_badges < end_index):
+                if end_index is None and big_pages >= MAX_API_PAGES_TO_FETCH: self.truncated = True; self.complete = True; break
+                page_size = PAGE_LIMIT if end_index is None else BADGE_API_PAGE_SIZE
+                if await self._fetch_api_page(len(self._page_offsets) - 1, page_size) is None: break
+                if end_index is None: big_pages += 1
+    async def _prepare_page(self):
+        await self._ensure_known(self.current_page * self.sep)
+        self.current_page = min(self.current_page, self.max_pages)
+    def _embed_key(self) -> Tuple[Any, ...]: return (self.current_page, self.known_badges, self.complete, self.truncated, self.error is not None)
+    async def _render_current_page(self) -> discord.Embed:
+        """Embed текущей страницы из кэша; бейджи собираются (и при необходимости перезапрашиваются) только при промахе."""
+        key = self._embed_key(); embed = self._embed_cache.get(key)
+        if embed is None:
+            embed = await self._create_page_embed(await self._collect_page_badges())
+            embed = self._embed_cache.put(self._embed_key(), embed) # Перезапрос мог изменить состояние (ошибка)
+        return embed
+    async def _get_page_data(self) -> List[Dict[str, Any]]:
+        await self._prepare_page(); return await self._collect_page_badges()
+    async def _collect_page_badges(self) -> List[Dict[str, Any]]:
+        start = (self.current_page - 1) * self.sep; end = start + self.sep
+        result: List[Dict[str, Any]] = []
+        for index in range(len(self._page_offsets) - 1):
+            page_start, page_end = self._page_offsets[index], self._page_offsets[index + 1]
+            if page_end <= start or page_start >= end: continue
+            badges = self._api_pages.get(index)
+            if badges is not None: self._api_pages.move_to_end(index)
+            else:
+                async with self._fetch_lock: badges = self._api_pages.get(index) or await self._fetch_api_page(index) or []
+            result.extend(badges[max(0, start - page_start):end - page_start])
+        return result
     async def _create_page_embed(self, page_badges: List[Dict[str, Any]]) -> discord.Embed:
-        embed = discord.Embed(title=f"Badges for: `{self.target_address}`", description=f"(New Loyalty System) - Page {self.current_page}/{self.max_pages}", color=discord.Color.gold())
+        pages_text = f"{self.max_pages}" if self.complete else f"{self.max_pages}+"
+        embed = discord.Embed(title=f"Badges for: `{self.target_address}`", description=f"(New Loyalty System) - Page {self.current_page}/{pages_text}", color=discord.Color.gold())
         if not page_badges and self.current_page == 1: embed.description += "\n\nNo badges found for this wallet."
         for i, badge_info in enumerate(page_badges):
             badge_name = badge_info.get("name", "Unnamed Badge"); badge_desc = badge_info.get("description") or "No description."
@@ -215,14 +421,19 @@ class BadgePaginatorView(discord.ui.View):
             if i == 0 and self.current_page == 1:
                 badge_image_url = badge_info.get("imageUrl")
                 if badge_image_url: embed.set_thumbnail(url=badge_image_url)
-        embed.set_footer(text=f"Total Badges associated: {len(self.all_badges)}"); embed.timestamp = discord.utils.utcnow(); return embed
-    def _update_buttons(self): self.first_badge_page.disabled = self.current_page == 1; self.prev_badge_page.disabled = self.current_page == 1; self.next_badge_page.disabled = self.current_page >= self.max_pages; self.last_badge_page.disabled = self.current_page >= self.max_pages
+        if self.complete: footer_text = f"Total Badges associated: {self.known_badges}" + (" (max badge pages loaded)" if self.truncated else "")
+        else: footer_text = f"At least {self.known_badges} badges associated (more load as you page)"
+        if self.error: footer_text += " | ⚠️ Error loading badges"
+        embed.set_footer(text=footer_text); embed.timestamp = discord.utils.utcnow(); return embed
+    def _update_buttons(self):
+        has_next = self.current_page < self.max_pages or (not self.complete and not self.error)
+        self.first_badge_page.disabled = self.current_page == 1; self.prev_badge_page.disabled = self.current_page == 1; self.next_badge_page.disabled = not has_next; self.last_badge_page.disabled = not has_next
     async def interaction_check(self, interaction: discord.Interaction) -> bool:
         if interaction.user.id != self.original_interaction.user.id: await interaction.response.send_message("Sorry, only the user who initiated this can use these buttons.", ephemeral=True); return False
         return True
     async def _send_page(self, interaction: discord.Interaction):
         if not interaction.response.is_done(): await interaction.response.defer()
-        self._update_buttons(); page_data = await self._get_page_data(); embed = await self._create_page_embed(page_data)
+        await self._prepare_page(); embed = await self._render_current_page(); self._update_buttons()
         if self.message: await self.message.edit(embed=embed, view=self)
         elif interaction.is_original_response(): await interaction.edit_original_response(embed=embed, view=self)
         else: await interaction.followup.edit_message(message_id=interaction.message.id if interaction.message else "@original", embed=embed, view=self)
@@ -234,10 +445,13 @@ class BadgePaginatorView(discord.ui.View):
         await self._send_page(interaction)
     @discord.ui.button(label="Next >", style=discord.ButtonStyle.primary, row=0, custom_id="badge_next_v4_ctrlpanel_rbk2")
     async def next_badge_page(self, interaction: discord.Interaction, button: discord.ui.Button):
-        if self.current_page < self.max_pages: self.current_page += 1
+        self.current_page += 1 # _prepare_page догрузит страницу или вернет на последнюю существующую
         await self._send_page(interaction)
     @discord.ui.button(label="Last >|", style=discord.ButtonStyle.secondary, row=0, custom_id="badge_last_v4_ctrlpanel_rbk2")
-    async def last_badge_page(self, interaction: discord.Interaction, button: discord.ui.Button): self.current_page = self.max_pages; await self._send_page(interaction)
+    async def last_badge_page(self, interaction: discord.Interaction, button: discord.ui.Button):
+        if not interaction.response.is_done(): await interaction.response.defer()
+        await self._ensure_known(None) # Последняя страница известна только после загрузки всех бейджей
+        self.current_page = self.max_pages; await self._send_page(interaction)
     async def on_timeout(self) -> None:
         if self.message:
             try: await self.message.edit(view=None)
@@ -277,6 +491,10 @@ class InfoPanelView(discord.ui.View):
     async def get_user_badges_button(self, interaction: discord.Interaction, button: discord.ui.Button):
         if not await self._check_ranger_role(interaction): return
         await interaction.response.send_modal(AddressForBadgesModal(self.cog))
+    @discord.ui.button(label="📦 Export History", style=discord.ButtonStyle.grey, custom_id="info_panel:export_history_v1", row=3)
+    async def export_history_button(self, interaction: discord.Interaction, button: discord.ui.Button):
+        if not await self._check_ranger_role(interaction): return
+        await interaction.response.send_modal(ExportHistoryModal(self.cog))
     @discord.ui.button(label="Quest Stats", style=discord.ButtonStyle.blurple, custom_id="info_panel:quest_stats_v8_final", row=2)
     async def quest_stats_button(self, interaction: discord.Interaction, button: discord.ui.Button):
         if not await self._check_ranger_role(interaction): return
@@ -300,9 +518,10 @@ class ControlPanelCog(commands.Cog, name="Control Panel"):
         self.bot = bot
         self.snag_client: Optional[SnagApiClient] = getattr(bot, 'snag_client', None)
         self.snag_client_legacy: Optional[SnagApiClient] = getattr(bot, 'snag_client_legacy', None)
-        self._currency_cache: Optional[Dict[str, Dict[str, Any]]] = None
-        self._currency_cache_time: Optional[datetime.datetime] = None
-        self._currency_cache_lock = asyncio.Lock()
+        self.identity_cache: Optional[IdentityCache] = getattr(bot, 'identity_cache', None)
+        self.transaction_store: Optional[TransactionStore] = getattr(bot, 'transaction_store', None)
+        self.rules_catalog: Optional[RulesCatalog] = getattr(bot, 'rules_catalog', None)
+        self.currency_registry: Optional[CurrencyRegistry] = getattr(bot, 'currency_registry', None)
         logger.info(f"Cog '{self.__class__.__name__}' loaded.")
         if not self.snag_client: logger.error(f"Main SnagApiClient not found for {self.__class__.__name__}!")
         if not self.snag_client_legacy: logger.warning(f"Legacy SnagApiClient not found for {self.__class__.__name__}!")
@@ -313,9 +532,6 @@ class ControlPanelCog(commands.Cog, name="Control Panel"):
     async def on_ready_register_views(self):
         if not self.snag_client or not self.snag_client._api_key: logger.warning(f"{self.__class__.__name__}: Main Snag client missing. InfoPanelView might not function correctly.")
         self.bot.add_view(InfoPanelView(self)); logger.info(f"{self.__class__.__name__}: Persistent InfoPanelView registered.")
-        if self.snag_client and self.snag_client._api_key:
-            await self._get_currency_map(include_deleted_currencies=True) 
-        else: logger.warning(f"{self.__class__.__name__}: Could not pre-fetch currency map as main Snag client is not ready.")
 
     @commands.command(name="send_info_panel")
     @is_prefix_admin_in_guild()
@@ -329,34 +545,48 @@ class ControlPanelCog(commands.Cog, name="Control Panel"):
         if isinstance(error, commands.MissingAnyRole): await ctx.send("⛔ You do not have the required role ('Ranger') to use this command.")
         else: logger.error(f"Error in send_info_panel_command: {error}", exc_info=True); await ctx.send("⚙️ An unexpected error occurred.")
 
-    async def _get_currency_map(self, force_refresh: bool = False, include_deleted_currencies: bool = False) -> Optional[Dict[str, Dict[str, Any]]]:
-        if not self.snag_client or not self.snag_client._api_key: 
-            logger.error("Cannot get currency map: Main SnagApiClient is not available or API key missing.")
-            return self._currency_cache 
-        cache_duration = datetime.timedelta(minutes=30); now = discord.utils.utcnow()
-        async with self._currency_cache_lock:
-            if not force_refresh and self._currency_cache and self._currency_cache_time and (now - self._currency_cache_time < cache_duration):
-                logger.debug("Using cached currency map."); return self._currency_cache
-            logger.info(f"Refreshing currency map from Main Snag API (include_deleted={include_deleted_currencies})...")
-            response_data = await self.snag_client.get_currencies(limit=PAGE_LIMIT, include_deleted=include_deleted_currencies)
-            if response_data and isinstance(response_data.get("data"), list):
-                self._currency_cache = {c['id']: c for c in response_data["data"] if isinstance(c, dict) and c.get("id")}
-                self._currency_cache_time = now; logger.info(f"Currency map updated. Found {len(self._currency_cache)} currencies from Main API.")
-                return self._currency_cache
-            logger.error("Failed to refresh currency map from Main API. Response was invalid or empty.")
-            return self._currency_cache
-            
     async def _get_user_object_from_api(self, client: SnagApiClient, identifier_type: str, identifier_value: str) -> Optional[Dict[str, Any]]:
         if not client or not client._api_key:
             return None
         kwargs = {identifier_type: identifier_value}
         response = await client.get_user_data(**kwargs)
         if response and not response.get("error") and isinstance(response.get("data"), list) and response["data"]:
+            self._remember_identity(client, identifier_type, identifier_value, response["data"][0])
             return response["data"][0]
         if response and response.get("error"):
             logger.error(f"[{getattr(client, '_client_name', 'SnagClient')}] API error getting user by {identifier_type}={identifier_value}: {response}")
+        elif response:
+            self._remember_identity(client, identifier_type, identifier_value, None)
         return None
 
+    def _remember_identity(self, client: SnagApiClient, identifier_type: str, identifier_value: str, user_data: Optional[Dict[str, Any]]):
+        """Записывает в локальный кэш соответствия handle -> кошелек из успешного ответа API."""
+        if not self.identity_cache:
+            return
+        system = SYSTEM_MAIN if client is self.snag_client else SYSTEM_LEGACY
+        wallet = user_data.get("walletAddress") if user_data else None
+        if identifier_type in ("discord_user", "twitter_user"):
+            self.identity_cache.put(system, identifier_type, identifier_value, wallet)
+        # Поиск по кошельку тоже сообщает привязанные соцсети
+        metadata_list = user_data.get("userMetadata") if user_data else None
+        if wallet and isinstance(metadata_list, list) and metadata_list and isinstance(metadata_list[0], dict):
+            meta = metadata_list[0]
+            for meta_key, id_type in (("discordUser", "discord_user"), ("twitterUser", "twitter_user")):
+                if isinstance(meta.get(meta_key), str) and meta[meta_key].strip():
+                    self.identity_cache.put(system, id_type, meta[meta_key].strip(), wallet)
+
+    async def _find_wallet_by_handle(self, client: SnagApiClient, identifier_type: str, identifier_value: str) -> Optional[str]:
+        """Кошелек по handle: свежая запись локального кэша или запрос к API."""
+        if not client or not client._api_key:
+            return None
+        if self.identity_cache:
+            system = SYSTEM_MAIN if client is self.snag_client else SYSTEM_LEGACY
+            cached = self.identity_cache.get(system, identifier_type, identifier_value)
+            if cached and cached.state == FRESH:
+                return cached.wallet
+        user_data = await self._get_user_object_from_api(client, identifier_type, identifier_value)
+        return user_data.get("walletAddress") if user_data else None
+
     async def handle_find_wallet_logic(self, interaction: discord.Interaction, discord_h: Optional[str], twitter_h: Optional[str]):
         discord_h = discord_h.strip() if discord_h else None
         twitter_h = twitter_h.strip().lstrip('@') if twitter_h else None
@@ -373,23 +603,66 @@ class ControlPanelCog(commands.Cog, name="Control Panel"):
              return
 
         display_identifier_type = "Discord" if identifier_type == "discord_user" else "Twitter/X"
-        response_header = f"Search results for {display_identifier_type} handle: **`{identifier_value}`**"
-        
-        user_main = await self._get_user_object_from_api(self.snag_client, identifier_type, identifier_value)
-        user_legacy = await self._get_user_object_from_api(self.snag_client_legacy, identifier_type, identifier_value)
 
-        response_lines = []
-        if user_legacy and user_legacy.get("walletAddress"):
-            response_lines.append(f"**Old Loyalty System Wallet:** `{user_legacy['walletAddress']}`")
-        if user_main and user_main.get("walletAddress"):
-            response_lines.append(f"**New Loyalty System Wallet:** `{user_main['walletAddress']}`")
+        async def wallet_text(client: SnagApiClient) -> str:
+            wallet = await self._find_wallet_by_handle(client, identifier_type, identifier_value)
+            return f"**Wallet:** `{wallet}`" if wallet else "No linked wallet found."
 
-        if not response_lines:
-            final_message = f"{response_header}\n\nCould not find any linked wallets for this handle in either system."
-        else:
-            final_message = f"{response_header}\n\n" + "\n".join(response_lines)
-            
-        await interaction.followup.send(final_message, ephemeral=True)
+        await self._fan_out_to_systems(
+            interaction, f"Search results for {display_identifier_type} handle:", f"**`{identifier_value}`**",
+            legacy_lookup=wallet_text(self.snag_client_legacy) if self._client_ready(self.snag_client_legacy) else None,
+            main_lookup=wallet_text(self.snag_client) if self._client_ready(self.snag_client) else None,
+        )
+
+    @staticmethod
+    def _client_ready(client: Optional[SnagApiClient]) -> bool:
+        return bool(client and client._api_key)
+
+    async def _fan_out_to_systems(self, interaction: discord.Interaction, title: str, description: str,
+                                  legacy_lookup: Optional[Awaitable[str]], main_lookup: Optional[Awaitable[str]],
+                                  main_first: bool = False):
+        """
+        Запрашивает старую и новую системы одновременно, у каждой свой дедлайн.
+        Embed отправляется сразу и дополняется по мере прихода ответов; система, не уложившаяся
+        в дедлайн, помечается как timeout и не задерживает вторую. None - клиент недоступен.
+        """
+        sides: List[Tuple[str, Optional[Awaitable[str]], float]] = [
+            (OLD_SYSTEM_FIELD, legacy_lookup, LEGACY_SYSTEM_LOOKUP_TIMEOUT),
+            (NEW_SYSTEM_FIELD, main_lookup, MAIN_SYSTEM_LOOKUP_TIMEOUT),
+        ]
+        if main_first: sides.reverse()
+
+        embed = discord.Embed(title=title, description=description, color=discord.Color.blue())
+        tasks: Dict[asyncio.Task, int] = {}
+        for index, (field_name, lookup, timeout) in enumerate(sides):
+            if lookup is None:
+                embed.add_field(name=field_name, value="ℹ️ API client not available.", inline=False)
+                continue
+            embed.add_field(name=field_name, value="⏳ Loading...", inline=False)
+            tasks[asyncio.create_task(asyncio.wait_for(lookup, timeout))] = index
+
+        pending = set(tasks)
+        try:
+            message = await interaction.followup.send(embed=embed, ephemeral=True)
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    index = tasks[task]; field_name, _, timeout = sides[index]
+                    try:
+                        value = task.result() or "No data."
+                    except asyncio.TimeoutError:
+                        logger.warning(f"{field_name} lookup for '{title} {description}' timed out after {timeout:.0f}s.")
+                        value = f"⌛ Timed out after {timeout:.0f}s. Try again later."
+                    except Exception as e:
+                        logger.error(f"{field_name} lookup for '{title} {description}' failed: {e}", exc_info=True)
+                        value = "⚙️ Error while querying this system. Check logs."
+                    if len(value) > 1024: value = value[:1020] + "..."
+                    embed.set_field_at(index, name=field_name, value=value, inline=False)
+                embed.timestamp = discord.utils.utcnow()
+                try: await message.edit(embed=embed)
+                except discord.HTTPException as e: logger.error(f"Failed to update dual-system lookup message: {e}")
+        finally:
+            for task in pending: task.cancel()
 
     def _extract_socials_from_user_data(self, user_data: Optional[Dict[str, Any]]) -> str:
         if not user_data:
@@ -425,22 +698,18 @@ class ControlPanelCog(commands.Cog, name="Control Panel"):
             
         logger.info(f"User {interaction.user.id} requested socials for wallet: {target_address}")
 
-        user_main = await self._get_user_object_from_api(self.snag_client, "wallet_address", target_address)
-        socials_text_main = self._extract_socials_from_user_data(user_main)
+        async def socials_text(client: SnagApiClient) -> str:
+            return self._extract_socials_from_user_data(await self._get_user_object_from_api(client, "wallet_address", target_address))
 
-        user_legacy = await self._get_user_object_from_api(self.snag_client_legacy, "wallet_address", target_address)
-        socials_text_legacy = self._extract_socials_from_user_data(user_legacy)
-        
-        full_response = (f"**--- Old Loyalty System ---**\n{socials_text_legacy}\n\n"
-                         f"**--- New Loyalty System ---**\n{socials_text_main}").strip()
-        
-        if len(full_response) > 1950: full_response = full_response[:1950] + "..."
-        await interaction.followup.send(full_response, ephemeral=True)
+        await self._fan_out_to_systems(
+            interaction, "Socials for wallet:", f"`{target_address}`",
+            legacy_lookup=socials_text(self.snag_client_legacy) if self._client_ready(self.snag_client_legacy) else None,
+            main_lookup=socials_text(self.snag_client) if self._client_ready(self.snag_client) else None,
+        )
         
     async def _get_all_wallet_balances_from_client(self, client: SnagApiClient, wallet_address: str, system_name: str) -> str:
         if not client or not client._api_key: return f"⚙️ API Client for **{system_name}** is not available."
-        currency_map = await self._get_currency_map(include_deleted_currencies=True) 
-        if currency_map is None: return f"⚠️ Error: Could not retrieve currency info."
+        if not self.currency_registry: return f"⚠️ Error: Could not retrieve currency info."
         
         logger.info(f"[{getattr(client, '_client_name', 'SnagClient')}] Requesting balances for {wallet_address} for {system_name}")
         acc_resp = await client.get_all_accounts_for_wallet(wallet_address)
@@ -454,12 +723,7 @@ class ControlPanelCog(commands.Cog, name="Control Panel"):
                 currency_id = acc.get("loyaltyCurrencyId"); amount_val = acc.get("amount")
                 if currency_id and amount_val is not None:
                     amount_str = str(amount_val); found_valid_balance = True
-                    currency_info = currency_map.get(currency_id)
-                    if currency_info:
-                        currency_name = currency_info.get("name", f"Unknown Currency (ID: {currency_id[:8]})"); currency_symbol = currency_info.get("symbol", "")
-                        display_name = f"{currency_name} ({currency_symbol})" if currency_symbol else currency_name
-                        if currency_info.get("deletedAt"): display_name += " (Deleted Currency)"
-                    else: display_name = f"Currency ID: {currency_id} (Not in map)"
+                    display_name = self.currency_registry.display_name(currency_id)
                     lines.append(f"- **{display_name}:** `{amount_str}`")
             if found_valid_balance: return "\n".join(lines)
             else: return f"ℹ️ No valid balance entries found for `{wallet_address}` in **{system_name}**."
@@ -471,81 +735,42 @@ class ControlPanelCog(commands.Cog, name="Control Panel"):
         target_address = address_val.strip().lower()
         if not EVM_ADDRESS_PATTERN.match(target_address): await interaction.followup.send("⚠️ Invalid EVM address format.", ephemeral=True); return
         logger.info(f"User {interaction.user.id} requested all balances for wallet: {target_address}")
-        results = []
-        if self.snag_client and self.snag_client._api_key: 
-            results.append(await self._get_all_wallet_balances_from_client(self.snag_client, target_address, "New Loyalty System"))
-        else: 
-            results.append("ℹ️ Main Loyalty System API client not available.")
-        if self.snag_client_legacy and self.snag_client_legacy._api_key: 
-            results.append(await self._get_all_wallet_balances_from_client(self.snag_client_legacy, target_address, "Old Loyalty System"))
-        else: 
-            results.append("ℹ️ Legacy Loyalty System API client not available.")
-            
-        full_response = "\n\n".join(results).strip()
-        if not full_response: full_response = "⚙️ No API clients available to check balances."
-        if len(full_response) > 1950: full_response = full_response[:1950] + "..."
-        await interaction.followup.send(full_response, ephemeral=True)
+        await self._fan_out_to_systems(
+            interaction, "💰 Balances for wallet:", f"`{target_address}`",
+            legacy_lookup=self._get_all_wallet_balances_from_client(self.snag_client_legacy, target_address, OLD_SYSTEM_FIELD) if self._client_ready(self.snag_client_legacy) else None,
+            main_lookup=self._get_all_wallet_balances_from_client(self.snag_client, target_address, NEW_SYSTEM_FIELD) if self._client_ready(self.snag_client) else None,
+            main_first=True,
+        )
         
-    async def _fetch_and_process_all_transactions(self, client: SnagApiClient, target_address: str, name_filter: Optional[str] = None, exclude_deleted_curr_flag: bool = False) -> Tuple[List[Dict[str, Any]], str, Decimal, Decimal]:
+    def _iter_wallet_history(self, client: SnagApiClient, target_address: str, exclude_deleted_curr_flag: bool = False) -> Union[SnagPageIterator, StoredHistoryIterator]:
+        """История кошелька: через локальное хранилище (только новые записи и догрузка с курсора) или напрямую из API."""
+        if self.transaction_store and client is self.snag_client and not exclude_deleted_curr_flag:
+            return self.transaction_store.iter_history(client, SYSTEM_MAIN, target_address, page_size=PAGE_LIMIT, max_pages=MAX_API_PAGES_TO_FETCH)
+        return client.iter_transaction_entries(
+            wallet_address=target_address, page_size=PAGE_LIMIT,
+            exclude_deleted_currency=exclude_deleted_curr_flag,
+            max_pages=MAX_API_PAGES_TO_FETCH, prefetch=True
+        )
+
+    async def _fetch_and_process_all_transactions(self, client: SnagApiClient, target_address: str, name_filter: Optional[str] = None, exclude_deleted_curr_flag: bool = False) -> Tuple[List[TransactionRecord], str, Decimal, Decimal]:
         # ... (код этого метода без изменений) ...
-        all_fetched_transactions: List[Dict[str, Any]] = []
-        last_transaction_id: Optional[str] = None
-        has_more_pages = True; api_page_count = 0; warning_message = ""
+        all_fetched_transactions: List[TransactionRecord] = []
         total_matchsticks_credits_processed = Decimal('0')
         total_matchsticks_debits_processed = Decimal('0')
         client_name = getattr(client, '_client_name', 'SnagClient')
         logger.info(f"[{client_name}] Fetching all transaction_entries for {target_address}...")
-        
-        while has_more_pages and api_page_count < MAX_API_PAGES_TO_FETCH:
-            api_page_count += 1
-            transaction_page_data = await client.get_transaction_entries(
-                wallet_address=target_address, limit=PAGE_LIMIT, 
-                starting_after=last_transaction_id,
-                exclude_deleted_currency=exclude_deleted_curr_flag 
-            )
-            if not transaction_page_data or transaction_page_data.get("error"):
-                warning_message += f"⚙️ Error fetching transaction history (Page {api_page_count}) from {client_name}.\n"; break 
-            current_page_transactions = transaction_page_data.get("data", [])
-            has_more_pages = transaction_page_data.get("hasNextPage", False)
-            if not isinstance(current_page_transactions, list):
-                logger.warning(f"[{client_name}] Transactions: 'data' not a list. Stopping."); break
-            if not current_page_transactions:
-                logger.info(f"[{client_name}] Transactions: Page {api_page_count} is empty."); break
-
-            for tx in current_page_transactions:
-                tx_name_for_filter = "Unknown Transaction"
-                loyalty_transaction_data = tx.get("loyaltyTransaction")
-                if isinstance(loyalty_transaction_data, dict):
-                    loyalty_rule_data = loyalty_transaction_data.get("loyaltyRule")
-                    if isinstance(loyalty_rule_data, dict):
-                        name_from_rule = loyalty_rule_data.get("name")
-                        if name_from_rule and name_from_rule.strip(): tx_name_for_filter = name_from_rule.strip()
-                    if tx_name_for_filter == "Unknown Transaction":
-                        desc_from_lt = loyalty_transaction_data.get("description")
-                        if desc_from_lt and desc_from_lt.strip(): tx_name_for_filter = desc_from_lt.strip()
-                if tx_name_for_filter == "Unknown Transaction":
-                    desc_from_tx = tx.get("description")
-                    if desc_from_tx and desc_from_tx.strip(): tx_name_for_filter = desc_from_tx.strip()
-                
-                if name_filter and name_filter.strip() and name_filter.strip().lower() not in tx_name_for_filter.lower():
-                    continue 
-                all_fetched_transactions.append(tx)
-                if tx.get("loyaltyCurrencyId") == MATCHSTICKS_CURRENCY_ID:
-                    try:
-                        amount = Decimal(str(tx.get("amount", "0")))
-                        if tx.get("direction") == "credit": total_matchsticks_credits_processed += amount
-                        elif tx.get("direction") == "debit": total_matchsticks_debits_processed += amount
-                    except: pass 
-            
-            if current_page_transactions: last_transaction_id = current_page_transactions[-1].get('id')
-            if has_more_pages: await asyncio.sleep(API_REQUEST_DELAY)
-        
-        if api_page_count >= MAX_API_PAGES_TO_FETCH and has_more_pages:
-            warning_message += f"⚠️ Loaded max pages ({MAX_API_PAGES_TO_FETCH}). History might be incomplete.\n"
-        
-        all_fetched_transactions.sort(key=lambda x: x.get('createdAt', '0'), reverse=True)
+
+        entries = self._iter_wallet_history(client, target_address, exclude_deleted_curr_flag)
+        async for page in entries.pages():
+            kept, credits, debits = _filter_transactions(page, name_filter)
+            all_fetched_transactions.extend(kept)
+            total_matchsticks_credits_processed += credits
+            total_matchsticks_debits_processed += debits
+        warning_message = _history_warning(entries, client_name)
+
+        all_fetched_transactions.sort(key=lambda record: record.sort_key, reverse=True)
         logger.info(f"[{client_name}] Found {len(all_fetched_transactions)} transactions for {target_address} after filter.")
-        return all_fetched_transactions, warning_message.strip(), total_matchsticks_credits_processed, total_matchsticks_debits_processed
+        return all_fetched_transactions, warning_message, total_matchsticks_credits_processed, total_matchsticks_debits_processed
 
     async def _process_and_send_transaction_history(self, interaction: discord.Interaction, target_address_str: str, name_filter: Optional[str]):
         # ... (код без изменений) ...
@@ -553,28 +778,95 @@ class ControlPanelCog(commands.Cog, name="Control Panel"):
         if not EVM_ADDRESS_PATTERN.match(target_address): await interaction.followup.send("⚠️ Invalid EVM address format.", ephemeral=True); return
         if not self.snag_client or not self.snag_client._api_key: await interaction.followup.send("⚙️ Main API Client not available.", ephemeral=True); return
 
-        processed_transactions, warning_message, total_credits, total_debits = await self._fetch_and_process_all_transactions(
-            self.snag_client, target_address, name_filter, exclude_deleted_curr_flag=False 
-        )
-        
-        final_message_content = warning_message
-        if not processed_transactions:
+        # История грузится потоково: первая страница показывается сразу, остальные догружаются в фоне
+        client_name = getattr(self.snag_client, '_client_name', 'SnagClient')
+        logger.info(f"[{client_name}] Streaming transaction_entries for {target_address}...")
+        entries = self._iter_wallet_history(self.snag_client, target_address)
+        view = TransactionHistoryPaginatorView(interaction, [], target_address, Decimal('0'), Decimal('0'),
+                                               entries=entries, name_filter=name_filter, client_name=client_name,
+                                               currency_registry=self.currency_registry)
+        view.start_loading()
+        await view.wait_for_first_page()
+
+        if not view.loading and not view.all_transactions:
+            view.stop()
+            final_message_content = f"{view.warning_message}\n" if view.warning_message else ""
             filter_msg_part = f" matching '{name_filter.strip()}'" if name_filter and name_filter.strip() else ""
             final_message_content += f"✅ No transactions{filter_msg_part} found for `{target_address}`."
             await interaction.edit_original_response(content=final_message_content, view=None, embed=None)
-        else:
-            view = TransactionHistoryPaginatorView(interaction, processed_transactions, target_address, total_credits, total_debits)
-            try:
-                original_message = await interaction.original_response()
-                view.message = original_message
-                initial_page_data = await view._get_page_data(); initial_embed = await view._create_page_embed(initial_page_data)
-                await interaction.edit_original_response(content=final_message_content or None, embed=initial_embed, view=view)
-            except discord.NotFound:
-                 logger.warning("Could not get original_response for transaction history, sending as new followup.")
-                 initial_page_data = await view._get_page_data(); initial_embed = await view._create_page_embed(initial_page_data)
-                 new_view_for_followup = TransactionHistoryPaginatorView(interaction, processed_transactions, target_address, total_credits, total_debits)
-                 followup_message = await interaction.followup.send(content=final_message_content or None, embed=initial_embed, view=new_view_for_followup, ephemeral=True)
-                 new_view_for_followup.message = followup_message
+            return
+
+        view._update_buttons(); initial_embed = await view._render_current_page()
+        try:
+            await interaction.edit_original_response(content=view.warning_message or None, embed=initial_embed, view=view)
+            view.message = await interaction.original_response()
+        except discord.NotFound:
+            logger.warning("Could not get original_response for transaction history, sending as new followup.")
+            view.message = await interaction.followup.send(content=view.warning_message or None, embed=initial_embed, view=view, ephemeral=True)
+        # Страницы, пришедшие пока отправлялось первое сообщение
+        await view._refresh_message(force=True)
+
+    async def handle_export_history_logic(self, interaction: discord.Interaction, address_val: str, format_val: Optional[str]):
+        target_address = address_val.strip().lower()
+        export_format = (format_val or "csv").strip().lower() or "csv"
+        if not EVM_ADDRESS_PATTERN.match(target_address): await interaction.followup.send("⚠️ Invalid EVM address format.", ephemeral=True); return
+        if export_format not in EXPORT_FORMATS: await interaction.followup.send(f"⚠️ Unknown format `{export_format}`. Use one of: {', '.join(EXPORT_FORMATS)}.", ephemeral=True); return
+        if not self.snag_client or not self.snag_client._api_key: await interaction.followup.send("⚙️ Main API Client not available.", ephemeral=True); return
+        logger.info(f"User {interaction.user.id} requested a {export_format} export of the full history of {target_address}")
+
+        # Без ограничения числа страниц: записи сразу уходят в сжатый временный файл, в памяти только текущая страница
+        entries = self.snag_client.iter_transaction_entries(wallet_address=target_address, page_size=PAGE_LIMIT, exclude_deleted_currency=False,
+                                                           max_pages=None, prefetch=True, priority=PRIORITY_BULK)
+        last_progress_update = time.monotonic()
+        async def report_progress(pages: int, exported: int):
+            nonlocal last_progress_update
+            if time.monotonic() - last_progress_update < HISTORY_LIVE_UPDATE_INTERVAL: return
+            last_progress_update = time.monotonic()
+            try: await interaction.edit_original_response(content=f"⏳ Exporting history of `{target_address}`: {exported} entries ({pages} pages)...")
+            except discord.HTTPException: pass
+
+        currency_name = self.currency_registry.name if self.currency_registry else None
+        with tempfile.TemporaryFile() as export_file:
+            result = await write_transaction_export(entries, export_file, export_format, currency_name=currency_name, on_page=report_progress)
+            warning_msg = f"⚠️ Export stopped on page {entries.pages_fetched}: {result.error.get('message', 'API error')}. The file is incomplete.\n" if result.error else ""
+            if not result.entries:
+                await interaction.followup.send(warning_msg + f"ℹ️ No transactions found for `{target_address}`.", ephemeral=True); return
+            size_limit = interaction.guild.filesize_limit if interaction.guild else 10 * 1024 * 1024
+            if result.compressed_bytes > size_limit:
+                await interaction.followup.send(warning_msg + f"⚠️ The export of {result.entries} entries is {result.compressed_bytes / 1024 / 1024:.1f} MB compressed, above the {size_limit / 1024 / 1024:.0f} MB upload limit of this server.", ephemeral=True); return
+            export_file.seek(0)
+            filename = f"history_{target_address}.{export_format}.gz"
+            summary = f"📦 Full transaction history of `{target_address}`: **{result.entries}** entries from {result.pages} pages ({result.compressed_bytes / 1024:.0f} KB, gzip {export_format.upper()})."
+            await interaction.followup.send(content=warning_msg + summary, file=discord.File(fp=export_file, filename=filename), ephemeral=True)
+        logger.info(f"History export of {target_address} sent: {result.entries} entries, {result.pages} pages, {result.compressed_bytes} bytes")
+
+    async def _get_wallet_aggregates(self, client: SnagApiClient, target_address: str) -> Tuple[WalletAggregates, str]:
+        """Сводка по истории кошелька: из хранилища (догружаются только новые записи) или подсчетом по полной истории."""
+        client_name = getattr(client, '_client_name', 'SnagClient')
+        if self.transaction_store and client is self.snag_client:
+            history = await self.transaction_store.sync(client, SYSTEM_MAIN, target_address, page_size=PAGE_LIMIT, max_pages=MAX_API_PAGES_TO_FETCH)
+            return await self.transaction_store.get_aggregates(SYSTEM_MAIN, target_address), _history_warning(history, client_name)
+        entries = self._iter_wallet_history(client, target_address)
+        aggregates = WalletAggregates()
+        async for page in entries.pages():
+            for tx in page: aggregates.add(tx)
+        return aggregates, _history_warning(entries, client_name)
+
+    async def _get_active_public_rules(self) -> Tuple[List[Dict[str, Any]], str]:
+        """Активные неудаленные правила, видимые в UI: из общего каталога правил или постранично из API."""
+        warning_msg = ""
+        if self.rules_catalog:
+            if not await self.rules_catalog.ensure_loaded():
+                return [], "⚙️ Error fetching loyalty rules.\n"
+            if not self.rules_catalog.complete: warning_msg += "⚠️ Max rule pages loaded.\n"
+            return self.rules_catalog.rules(active=True, hidden=False), warning_msg
+        rules: List[Dict[str, Any]] = []
+        rules_iter = self.snag_client.iter_loyalty_rules(page_size=PAGE_LIMIT, include_deleted=False, max_pages=MAX_API_PAGES_TO_FETCH, prefetch=True)
+        async for rule in rules_iter:
+            if isinstance(rule, dict) and not rule.get("deletedAt") and rule.get("hideInUi") is not True and rule.get("isActive") is True: rules.append(rule)
+        if rules_iter.error: warning_msg += f"⚙️ Error fetching loyalty rules (Page {rules_iter.pages_fetched}).\n"
+        if rules_iter.truncated: warning_msg += "⚠️ Max rule pages loaded.\n"
+        return rules, warning_msg
 
     async def handle_quest_stats_logic(self, interaction: discord.Interaction, address_val: str):
         # ... (код без изменений) ...
@@ -582,29 +874,11 @@ class ControlPanelCog(commands.Cog, name="Control Panel"):
         if not EVM_ADDRESS_PATTERN.match(target_address): await interaction.followup.send("⚠️ Invalid EVM address format.", ephemeral=True); return
         if not self.snag_client or not self.snag_client._api_key: await interaction.followup.send("⚙️ Main API Client is not available.", ephemeral=True); return
         logger.info(f"User {interaction.user.id} requested quest statistics for wallet: {target_address}")
-        all_txns, warning_msg_txn, total_matchsticks_credits, _ = await self._fetch_and_process_all_transactions(self.snag_client, target_address)
-        completed_quest_executions = []
-        for tx in all_txns:
-            if tx.get("direction") == "credit":
-                loyalty_transaction = tx.get("loyaltyTransaction")
-                # Проверяем, что loyalty_transaction это словарь, а не None
-                if isinstance(loyalty_transaction, dict):
-                    loyalty_rule = loyalty_transaction.get("loyaltyRule")
-                    # Проверяем, что loyalty_rule это словарь и у него есть поле name
-                    if isinstance(loyalty_rule, dict) and loyalty_rule.get("name"):
-                        completed_quest_executions.append(tx)
-        num_total_completed_executions = len(completed_quest_executions)
-        all_available_rules_api: List[Dict[str, Any]] = []; last_rule_id: Optional[str] = None; has_more_rules_pages = True; api_rule_page_count = 0; warning_msg_rules = ""
-        while has_more_rules_pages and api_rule_page_count < MAX_API_PAGES_TO_FETCH:
-            api_rule_page_count += 1; rules_page_data = await self.snag_client.get_loyalty_rules(limit=PAGE_LIMIT, starting_after=last_rule_id, include_deleted=False)
-            if not rules_page_data or rules_page_data.get("error"): warning_msg_rules += f"⚙️ Error fetching loyalty rules (Page {api_rule_page_count}).\n"; break
-            current_page_rules = rules_page_data.get("data", []); has_more_rules_pages = rules_page_data.get("hasNextPage", False)
-            if not isinstance(current_page_rules, list): has_more_rules_pages = False; continue
-            all_available_rules_api.extend(rule for rule in current_page_rules if isinstance(rule, dict) and not rule.get("deletedAt") and rule.get("hideInUi") is not True and rule.get("isActive") is True)
-            if current_page_rules: last_rule_id = current_page_rules[-1].get("id")
-            if not last_rule_id: has_more_rules_pages = False
-            if has_more_rules_pages: await asyncio.sleep(API_REQUEST_DELAY)
-        if api_rule_page_count >= MAX_API_PAGES_TO_FETCH and has_more_rules_pages: warning_msg_rules += "⚠️ Max rule pages loaded.\n"
+        aggregates, warning_msg_txn = await self._get_wallet_aggregates(self.snag_client, target_address)
+        if warning_msg_txn: warning_msg_txn += "\n"
+        num_total_completed_executions = aggregates.total_completions
+        total_matchsticks_credits = aggregates.credits(MATCHSTICKS_CURRENCY_ID)
+        all_available_rules_api, warning_msg_rules = await self._get_active_public_rules()
         total_available_quests_count = len(all_available_rules_api); max_possible_matchsticks = Decimal('0')
         for rule in all_available_rules_api:
             if rule.get("rewardType") == "points" and rule.get("loyaltyCurrencyId") == MATCHSTICKS_CURRENCY_ID:
@@ -616,6 +890,14 @@ class ControlPanelCog(commands.Cog, name="Control Panel"):
         if total_available_quests_count > 0:
             embed.add_field(name="Total Active Public Quests", value=f"**{total_available_quests_count}**", inline=True)
             if max_possible_matchsticks > 0 : embed.add_field(name=f"Max Possible Matchsticks from Active", value=f"**{max_possible_matchsticks}**", inline=True)
+        if aggregates.first_activity:
+            embed.add_field(name="First Activity", value=TransactionHistoryPaginatorView._format_datetime_static(aggregates.first_activity), inline=True)
+            embed.add_field(name="Last Activity", value=TransactionHistoryPaginatorView._format_datetime_static(aggregates.last_activity), inline=True)
+        top_rules = aggregates.top_rules(QUEST_STATS_TOP_RULES)
+        if top_rules:
+            top_rules_text = "\n".join(f"`{rule['count']}×` {rule['name']}" for rule in top_rules)
+            if len(top_rules_text) > 1024: top_rules_text = top_rules_text[:1020] + "..."
+            embed.add_field(name=f"Top Quests ({len(aggregates.rule_completions)} distinct)", value=top_rules_text, inline=False)
         final_content_stats = (warning_msg_txn + warning_msg_rules).strip()
         await interaction.followup.send(content=final_content_stats or None, embed=embed, ephemeral=True)
         
@@ -625,30 +907,21 @@ class ControlPanelCog(commands.Cog, name="Control Panel"):
         if not EVM_ADDRESS_PATTERN.match(target_address): await interaction.followup.send("⚠️ Invalid EVM address format.", ephemeral=True); return
         if not self.snag_client or not self.snag_client._api_key: await interaction.followup.send("⚙️ Main API Client not available.", ephemeral=True); return
         logger.info(f"User {interaction.user.id} requested badges for wallet: {target_address}")
-        all_user_badges: List[Dict[str, Any]] = []; last_badge_id: Optional[str] = None; has_more_pages = True; api_page_count = 0; warning_msg = ""
-        while has_more_pages and api_page_count < MAX_API_PAGES_TO_FETCH:
-            api_page_count += 1; badges_response = await self.snag_client.get_badges_by_wallet(wallet_address=target_address, limit=PAGE_LIMIT, starting_after=last_badge_id, include_deleted=False)
-            if not badges_response or badges_response.get("error"): await interaction.followup.send(warning_msg + f"⚙️ Error fetching badges (Page {api_page_count}).", ephemeral=True); return
-            current_page_data = badges_response.get("data", []); has_more_pages = badges_response.get("hasNextPage", False)
-            if not isinstance(current_page_data, list): has_more_pages = False; continue
-            all_user_badges.extend(badge for badge in current_page_data if not badge.get("deletedAt"))
-            if current_page_data: last_badge_id = current_page_data[-1].get("id")
-            if not last_badge_id: has_more_pages = False
-            if has_more_pages: await asyncio.sleep(API_REQUEST_DELAY)
-        if api_page_count >= MAX_API_PAGES_TO_FETCH and has_more_pages: warning_msg += "⚠️ Max badge pages loaded.\n"
-        if not all_user_badges: await interaction.followup.send(warning_msg + f"ℹ️ No active badges found for `{target_address}`.", ephemeral=True); return
-        view = BadgePaginatorView(interaction, all_user_badges, target_address)
+        # Страницы бейджей запрашиваются по мере листания, а не все сразу
+        async def fetch_badge_page(cursor: Optional[str], page_size: int) -> Optional[Dict]:
+            return await self.snag_client.get_badges_by_wallet(target_address, limit=page_size, starting_after=cursor, include_deleted=False)
+        view = BadgePaginatorView(interaction, None, target_address, fetch_page=fetch_badge_page)
+        initial_page_data = await view._get_page_data()
+        if view.error and not initial_page_data: view.stop(); await interaction.followup.send("⚙️ Error fetching badges (Page 1).", ephemeral=True); return
+        if not initial_page_data: view.stop(); await interaction.followup.send(f"ℹ️ No active badges found for `{target_address}`.", ephemeral=True); return
+        view._update_buttons(); initial_embed = await view._render_current_page()
         try:
             original_message = await interaction.original_response()
             view.message = original_message
-            initial_page_data = await view._get_page_data(); initial_embed = await view._create_page_embed(initial_page_data)
-            await interaction.edit_original_response(content=warning_msg or None, embed=initial_embed, view=view)
+            await interaction.edit_original_response(content=None, embed=initial_embed, view=view)
         except discord.NotFound:
             logger.warning("Could not get original_response for badge history, sending as new followup.")
-            initial_page_data = await view._get_page_data(); initial_embed = await view._create_page_embed(initial_page_data)
-            new_view_for_followup = BadgePaginatorView(interaction, all_user_badges, target_address)
-            followup_message = await interaction.followup.send(content=warning_msg or None, embed=initial_embed, view=new_view_for_followup, ephemeral=True)
-            new_view_for_followup.message = followup_message
+            view.message = await interaction.followup.send(embed=initial_embed, view=view, ephemeral=True)
 
 # --- Обязательная функция setup ---
 async def setup(bot: commands.Bot):
@@ -6,9 +6,8 @@ from typing import Optional, Dict, Any, List
 import asyncio 
 import json
 import os
-# --- НАЧАЛО ИЗМЕНЕНИЙ: Импортируем константу эндпоинта ---
-from utils.snag_api_client import RULES_ENDPOINT
-# --- КОНЕЦ ИЗМЕНЕНИЙ ---
+from utils.rules_catalog import RulesCatalog
+from utils.currency_registry import CurrencyRegistry
 
 logger = logging.getLogger(__name__)
 
@@ -61,6 +60,8 @@ class FindRuleIDCog(commands.Cog, name="Find Quest ID"):
         self.snag_client = getattr(bot, 'snag_client', None)
         if not self.snag_client:
             logger.error(f"{self.__class__.__name__}: SnagApiClient (bot.snag_client) not found! Functionality will be disabled.")
+        self.rules_catalog: Optional[RulesCatalog] = getattr(bot, 'rules_catalog', None)
+        self.currency_registry: Optional[CurrencyRegistry] = getattr(bot, 'currency_registry', None)
         logger.info(f"Cog '{self.__class__.__name__}' loaded.")
 
     async def cog_load(self):
@@ -68,16 +69,17 @@ class FindRuleIDCog(commands.Cog, name="Find Quest ID"):
         if not self.snag_client or not self.snag_client._api_key:
              logger.error(f"{self.__class__.__name__}: Snag API client is unavailable or API key is missing.")
 
+    def _currency_label(self) -> str:
+        """Имя требуемой валюты из общего справочника, иначе конец ее ID."""
+        currency = self.currency_registry.get(REQUIRED_LOYALTY_CURRENCY_ID) if self.currency_registry else None
+        return f"**{currency.get('name')}**" if currency and currency.get("name") else f"ID `...{(REQUIRED_LOYALTY_CURRENCY_ID or '')[-6:]}`"
+
     async def find_and_display_rule_ids(self, interaction: discord.Interaction, name_substring: str):
-        if not self.snag_client or not self.snag_client._api_key:
+        if not self.snag_client or not self.snag_client._api_key or not self.rules_catalog:
             await interaction.followup.send("⚠️ Snag API client is not configured. Cannot perform search.", ephemeral=True)
             return
 
         all_matching_rules: List[Dict[str, Any]] = []
-        has_more_pages = True
-        starting_after: Optional[str] = None
-        pages_fetched = 0
-        max_pages_to_fetch = 10 
         
         original_message_for_edit: Optional[discord.WebhookMessage] = None
         try:
@@ -85,82 +87,41 @@ class FindRuleIDCog(commands.Cog, name="Find Quest ID"):
             await original_message_for_edit.edit(content=f"⏳ Searching and verifying quests containing '{name_substring}'...")
         except (discord.NotFound, discord.HTTPException): pass
 
-        while has_more_pages and pages_fetched < max_pages_to_fetch:
-            pages_fetched += 1
-            logger.info(f"Fetching page {pages_fetched} of loyalty rules for name '{name_substring}'...")
-            
-            rules_response = await self.snag_client.get_loyalty_rules(
-                limit=1000, 
-                starting_after=starting_after,
-                include_deleted=False,
-                organization_id_filter=TARGET_ORGANIZATION_ID, 
-                website_id_filter=TARGET_WEBSITE_ID           
-            )
-
-            if not rules_response or rules_response.get("error"):
-                error_msg = rules_response.get("message", "Failed to fetch quest list.") if rules_response else "No API response."
-                content_to_send = f"❌ Error fetching quest list: {error_msg}"
-                if original_message_for_edit: await original_message_for_edit.edit(content=content_to_send, embed=None, view=None)
-                else: await interaction.followup.send(content=content_to_send, ephemeral=True)
-                return
-
-            rules_on_page: List[Dict[str, Any]] = rules_response.get("data", [])
-            if not rules_on_page:
-                has_more_pages = False; break
-
-            for rule in rules_on_page:
-                # 1. Быстрые первичные фильтры
-                if not (isinstance(rule, dict) and isinstance(rule.get("name"), str) and name_substring.lower() in rule["name"].lower()):
-                    continue
-                if rule.get("organizationId") != TARGET_ORGANIZATION_ID:
-                    continue
-                if rule.get("websiteId") != TARGET_WEBSITE_ID:
-                    continue
-                if rule.get("loyaltyCurrencyId") != REQUIRED_LOYALTY_CURRENCY_ID:
-                    continue 
-
-                # --- НАЧАЛО ИЗМЕНЕНИЙ: Локальная верификация "призраков" ---
-                # Мы делаем прямой запрос к API, используя только ID квеста.
-                # Это в точности повторяет ваш ручной тест и отсеивает квесты, которые
-                # возвращают `{"data": []}` при запросе только по ID.
-                logger.debug(f"Performing localized verification for rule ID {rule.get('id')}...")
-                verification_params = {'loyaltyRuleId': rule.get('id'), 'limit': 1}
-                verification_response = await self.snag_client._make_request(
-                    "GET",
-                    RULES_ENDPOINT,
-                    params=verification_params
-                )
-                
-                # Проверяем, что ответ не содержит ошибок и что массив 'data' не пуст
-                if (not verification_response or
-                    verification_response.get("error") or
-                    not isinstance(verification_response.get("data"), list) or
-                    not verification_response.get("data")):
-                    
-                    logger.warning(f"Rule ID {rule.get('id')} ('{rule.get('name')}') failed verification (is a 'ghost' quest). Skipping.")
-                    continue
-                # --- КОНЕЦ ИЗМЕНЕНИЙ ---
-
-                # Если все проверки пройдены, добавляем в список.
-                # Мы можем использовать `rule` из общего списка, т.к. он уже прошел верификацию.
-                all_matching_rules.append(rule)
-            
-            has_more_pages = rules_response.get("hasNextPage", False)
-            if has_more_pages and rules_on_page:
-                starting_after = rules_on_page[-1].get("id")
-                if pages_fetched < max_pages_to_fetch : await asyncio.sleep(0.3) 
-            else:
-                has_more_pages = False
-        
+        # Правила берутся из общего каталога (загружается один раз и обновляется в фоне)
+        if not await self.rules_catalog.ensure_loaded():
+            error_msg = self.rules_catalog.last_error or "Failed to fetch quest list."
+            content_to_send = f"❌ Error fetching quest list: {error_msg}"
+            if original_message_for_edit: await original_message_for_edit.edit(content=content_to_send, embed=None, view=None)
+            else: await interaction.followup.send(content=content_to_send, ephemeral=True)
+            return
+
+        # 1. Быстрые первичные фильтры по индексу имен каталога
+        candidates = [
+            rule for rule in self.rules_catalog.search_by_name(name_substring)
+            if rule.get("organizationId") == TARGET_ORGANIZATION_ID
+            and rule.get("websiteId") == TARGET_WEBSITE_ID
+            and rule.get("loyaltyCurrencyId") == REQUIRED_LOYALTY_CURRENCY_ID
+        ]
+        logger.info(f"Quest name '{name_substring}': {len(candidates)} candidate(s) in rules catalog of {self.rules_catalog.stats()['rules']} rules.")
+
+        # 2. Верификация "призраков": квестов, которые возвращают `{"data": []}` при запросе только по ID.
+        # Результат проверки каталог запоминает, пока правило не изменится.
+        verified = await asyncio.gather(*(self.rules_catalog.is_retrievable(rule.get("id")) for rule in candidates))
+        for rule, is_valid in zip(candidates, verified):
+            if not is_valid:
+                logger.warning(f"Rule ID {rule.get('id')} ('{rule.get('name')}') failed verification (is a 'ghost' quest). Skipping.")
+                continue
+            all_matching_rules.append(rule)
+
         if not all_matching_rules:
-            message_content = f"ℹ️ No quests found meeting all criteria (name containing '{name_substring}', valid 'data' field, and currency ID `...{REQUIRED_LOYALTY_CURRENCY_ID[-6:]}`) for the specified Organization/Website."
+            message_content = f"ℹ️ No quests found meeting all criteria (name containing '{name_substring}', valid 'data' field, and currency {self._currency_label()}) for the specified Organization/Website."
             if original_message_for_edit: await original_message_for_edit.edit(content=message_content, embed=None, view=None)
             else: await interaction.followup.send(content=message_content, ephemeral=True)
             return
 
         embed = discord.Embed(
             title=f"Quests Found Matching '{name_substring}'",
-            description=f"For Org ID: `...{TARGET_ORGANIZATION_ID[-8:]}` & Site ID: `...{TARGET_WEBSITE_ID[-8:]}`\n(Filtered by required currency ID & non-empty 'data' field)",
+            description=f"For Org ID: `...{TARGET_ORGANIZATION_ID[-8:]}` & Site ID: `...{TARGET_WEBSITE_ID[-8:]}`\n(Filtered by currency {self._currency_label()} & non-empty 'data' field)",
             color=discord.Color.blue()
         )
         
@@ -198,4 +159,7 @@ async def setup(bot: commands.Bot):
     if not snag_api_client or not getattr(snag_api_client, '_api_key', None):
         logger.critical("CRITICAL: FindRuleIDCog will NOT be loaded. Snag API client missing or no API key.")
         return
+    if not getattr(bot, 'rules_catalog', None):
+        logger.critical("CRITICAL: FindRuleIDCog will NOT be loaded. Rules catalog (bot.rules_catalog) is missing.")
+        return
     await bot.add_cog(FindRuleIDCog(bot))
\ No newline at end of file
@@ -8,7 +8,7 @@ import re
 import os
 from typing import List, Dict, Any, Optional
 
-from utils.snag_api_client import SnagApiClient
+from utils.snag_api_client import SnagApiClient, PRIORITY_BULK
 from utils.checks import is_admin_in_guild # Import our permission check
 
 logger = logging.getLogger(__name__)
@@ -130,7 +130,8 @@ class MassBlockCog(commands.Cog, name="Mass Block Tool"):
         logger.info(f"User {interaction.user.name} initiated mass check for {len(wallets)} wallets.")
 
         # --- 2. Parallel status checking ---
-        tasks = [self.snag_client.get_user_data(wallet_address=w) for w in wallets]
+        # Массовые запросы идут в очереди BULK, чтобы не задерживать одиночные проверки других Rangers
+        tasks = [self.snag_client.get_user_data(wallet_address=w, priority=PRIORITY_BULK) for w in wallets]
         responses = await asyncio.gather(*tasks)
 
         # --- 3. Process results and build report ---
@@ -186,7 +187,7 @@ class MassBlockCog(commands.Cog, name="Mass Block Tool"):
                 "websiteId": self.snag_client._website_id,
                 "isBlocked": block_flag
             }
-            tasks.append(self.snag_client.create_user_metadata(payload))
+            tasks.append(self.snag_client.create_user_metadata(payload, priority=PRIORITY_BULK))
 
         # Execute requests and collect results, including exceptions
         responses = await asyncio.gather(*tasks, return_exceptions=True)
@@ -12,6 +12,7 @@ import os
 from typing import Dict, List, Tuple, Optional
 from decimal import Decimal
 from utils.snag_api_client import SnagApiClient
+from utils.currency_registry import CurrencyRegistry
 from utils.checks import is_admin_in_guild
 
 logger = logging.getLogger(__name__)
@@ -97,17 +98,24 @@ class PokerCog(commands.Cog, name="Poker"):
     def __init__(self, bot: commands.Bot):
         self.bot = bot
         self.snag_client: Optional[SnagApiClient] = getattr(bot, 'snag_client', None)
+        self.currency_registry: Optional[CurrencyRegistry] = getattr(bot, 'currency_registry', None)
         self.participants: Dict[int, List[Tuple[str, str, str, Optional[str]]]] = {}
         self.event_configs: Dict[int, Decimal] = {}
         self.invite_codes: Dict[int, List[str]] = {}
         self.assigned_codes: Dict[int, Dict[str, str]] = {}
-        self._lock = asyncio.Lock()
+        # Проверки пользователей идут параллельно; атомарны только выдача кода и список участников события
+        self._event_locks: Dict[int, asyncio.Lock] = {}
+        self._pending_checks: Dict[Tuple[int, int], asyncio.Task] = {}
         if not self.snag_client or not self.snag_client._api_key:
             logger.error(f"{self.__class__.__name__}: Main SnagApiClient missing or no API key. Poker functionality will fail.")
 
     async def cog_load(self):
         logger.info(f"Cog '{self.__class__.__name__}' successfully initialized and loaded.")
 
+    def _currency_name(self) -> str:
+        """Имя валюты баланса из общего справочника (без запроса к API)."""
+        return self.currency_registry.name(MATCHSTICKS_CURRENCY_ID, "Matchsticks") if self.currency_registry else "Matchsticks"
+
     async def _get_wallet_balance(self, wallet_address: str) -> Decimal:
         if not self.snag_client:
             logger.error("SnagApiClient not available for balance check.")
@@ -167,54 +175,85 @@ class PokerCog(commands.Cog, name="Poker"):
         balance = await self._get_wallet_balance(wallet_address)
         if balance < min_matchsticks:
             logger.info(f"Eligibility check failed for '{discord_handle}' (Event {event_id}): Insufficient Matchsticks balance. Required: {min_matchsticks}, Has: {balance}, Wallet: {wallet_address}")
-            return False, f"Insufficient Matchsticks balance. You need at least {min_matchsticks}, but have {balance}.", wallet_address
+            return False, f"Insufficient {self._currency_name()} balance. You need at least {min_matchsticks}, but have {balance}.", wallet_address
 
         logger.info(f"Eligibility check PASSED for '{discord_handle}' (Event {event_id}). Wallet: {wallet_address}, Balance: {balance}")
         return True, "", wallet_address
 
+    def _event_lock(self, event_id: int) -> asyncio.Lock:
+        lock = self._event_locks.get(event_id)
+        if lock is None:
+            lock = self._event_locks[event_id] = asyncio.Lock()
+        return lock
+
+    async def _check_user_eligibility_shared(self, user: discord.User, event_id: int) -> Tuple[bool, str, Optional[str]]:
+        """Повторные нажатия одного пользователя, пока его проверка идет, ждут ее результат, а не делают новые запросы."""
+        key = (event_id, user.id)
+        task = self._pending_checks.get(key)
+        if task is None:
+            task = asyncio.create_task(self._check_user_eligibility(user, event_id))
+            self._pending_checks[key] = task
+            task.add_done_callback(lambda _: self._pending_checks.pop(key, None))
+        # shield: отмена одного ожидающего не должна отменять общую проверку
+        return await asyncio.shield(task)
+
+    def _registered_code(self, event_id: int, discord_handle: str) -> Optional[str]:
+        """Код уже зарегистрированного пользователя ("No code assigned", если кода нет); None - не зарегистрирован."""
+        if not any(entry[1] == discord_handle for entry in self.participants.get(event_id, [])):
+            return None
+        return self.assigned_codes.get(event_id, {}).get(discord_handle, "No code assigned")
+
+    async def _send_already_registered(self, interaction: discord.Interaction, discord_handle: str, link: str, event_id: int, invite_code: str):
+        await interaction.followup.send(
+            f"✅ You are already registered. Poker game link: {link}\nHere is your invite code: `{invite_code}`",
+            ephemeral=True
+        )
+        logger.info(f"User {discord_handle} re-requested poker details for event {event_id}. Sent link and invite code: {invite_code}")
+
     async def process_poker_request(self, interaction: discord.Interaction, poker_login: str, link: str, event_id: int):
-        async with self._lock:
-            eligible, error_message, wallet_address = await self._check_user_eligibility(interaction.user, event_id)
-            discord_handle = interaction.user.name if interaction.user.discriminator == '0' else f"{interaction.user.name}#{interaction.user.discriminator}"
+        discord_handle = interaction.user.name if interaction.user.discriminator == '0' else f"{interaction.user.name}#{interaction.user.discriminator}"
 
-            if not eligible:
-                await interaction.followup.send(f"⚠️ {error_message}", ephemeral=True)
-                return
+        # Уже зарегистрированному пользователю повторная проверка в Snag не нужна
+        invite_code = self._registered_code(event_id, discord_handle)
+        if invite_code is not None:
+            await self._send_already_registered(interaction, discord_handle, link, event_id, invite_code)
+            return
 
-            if wallet_address is None:
-                logger.error(f"Wallet address is None for eligible user {discord_handle} in event {event_id}.")
-                await interaction.followup.send("⚙️ An internal error occurred with your wallet information.", ephemeral=True)
-                return
+        # Проверка (два запроса к Snag) идет вне блокировки, параллельно с проверками других пользователей
+        eligible, error_message, wallet_address = await self._check_user_eligibility_shared(interaction.user, event_id)
 
-            if event_id not in self.participants:
-                self.participants[event_id] = []
-            if event_id not in self.assigned_codes:
-                self.assigned_codes[event_id] = {}
-
-            existing_entry = next((entry for entry in self.participants[event_id] if entry[1] == discord_handle), None)
-            if existing_entry:
-                invite_code = self.assigned_codes[event_id].get(discord_handle, "No code assigned")
-                await interaction.followup.send(
-                    f"✅ You are already registered. Poker game link: {link}\nHere is your invite code: `{invite_code}`",
-                    ephemeral=True
-                )
-                logger.info(f"User {discord_handle} re-requested poker details for event {event_id}. Sent link and invite code: {invite_code}")
-                return
+        if not eligible:
+            await interaction.followup.send(f"⚠️ {error_message}", ephemeral=True)
+            return
 
-            if not self.invite_codes.get(event_id):
-                await interaction.followup.send("⚠️ No invite codes available for this event.", ephemeral=True)
-                logger.error(f"No invite codes available for event {event_id} for user {discord_handle}.")
-                return
+        if wallet_address is None:
+            logger.error(f"Wallet address is None for eligible user {discord_handle} in event {event_id}.")
+            await interaction.followup.send("⚙️ An internal error occurred with your wallet information.", ephemeral=True)
+            return
 
-            invite_code = self.invite_codes[event_id].pop(0)
-            self.assigned_codes[event_id][discord_handle] = invite_code
+        # Выдача кода и запись в список участников - атомарно для события, без ожиданий внутри
+        async with self._event_lock(event_id):
+            invite_code = self._registered_code(event_id, discord_handle)
+            already_registered = invite_code is not None
+            if not already_registered and self.invite_codes.get(event_id):
+                invite_code = self.invite_codes[event_id].pop(0)
+                self.assigned_codes.setdefault(event_id, {})[discord_handle] = invite_code
+                self.participants.setdefault(event_id, []).append((poker_login, discord_handle, wallet_address, invite_code))
+
+        if already_registered:
+            await self._send_already_registered(interaction, discord_handle, link, event_id, invite_code)
+            return
 
-            self.participants[event_id].append((poker_login, discord_handle, wallet_address, invite_code))
-            logger.info(f"User {discord_handle} (Wallet: {wallet_address}) registered for poker event {event_id} with PokerNow login: {poker_login} and invite code: {invite_code}")
-            await interaction.followup.send(
-                f"✅ Success! You are registered. Poker game link: {link}\nHere is your invite code: `{invite_code}`",
-                ephemeral=True
-            )
+        if invite_code is None:
+            await interaction.followup.send("⚠️ No invite codes available for this event.", ephemeral=True)
+            logger.error(f"No invite codes available for event {event_id} for user {discord_handle}.")
+            return
+
+        logger.info(f"User {discord_handle} (Wallet: {wallet_address}) registered for poker event {event_id} with PokerNow login: {poker_login} and invite code: {invite_code}")
+        await interaction.followup.send(
+            f"✅ Success! You are registered. Poker game link: {link}\nHere is your invite code: `{invite_code}`",
+            ephemeral=True
+        )
 
     async def create_poker_event(self, interaction: discord.Interaction, link: str, expiry_time: datetime.datetime, min_matchsticks: Decimal, invite_codes: List[str]):
         channel = self.bot.get_channel(POKER_CHANNEL_ID)
@@ -256,7 +295,7 @@ class PokerCog(commands.Cog, name="Poker"):
                 f"{discord.utils.format_dt(expiry_time, style='F')} ({discord.utils.format_dt(expiry_time, style='R')})\n\n"
                 f"**📋 Requirements to Join**:\n"
                 f"1. Linked Discord account in the Snag Loyalty System.\n"
-                f"2. Minimum **{min_matchsticks} Matchsticks** balance.\n"
+                f"2. Minimum **{min_matchsticks} {self._currency_name()}** balance.\n"
             ),
             color=discord.Color.green(),
             timestamp=discord.utils.utcnow()
@@ -380,7 +419,7 @@ class PokerCog(commands.Cog, name="Poker"):
                     )
                 )
 
-            async with self._lock:
+            async with self._event_lock(event_id):
                 if event_id in self.participants:
                     del self.participants[event_id]
                     logger.info(f"Cleared participants data for event {event_id}.")
@@ -393,6 +432,7 @@ class PokerCog(commands.Cog, name="Poker"):
                 if event_id in self.assigned_codes:
                     del self.assigned_codes[event_id]
                     logger.info(f"Cleared assigned codes for event {event_id}.")
+            self._event_locks.pop(event_id, None)
 
     async def _schedule_timed_message_deletion(self, message: discord.Message, delay_seconds: int, event_id_for_log: int):
         await asyncio.sleep(delay_seconds)
@@ -546,13 +586,14 @@ class PokerCog(commands.Cog, name="Poker"):
                 await interaction.followup.send("⚠️ This command must be run in a guild.", ephemeral=True)
                 return
 
+            # Индекс handle -> участник строится один раз, вместо перебора всех участников для каждого handle
+            members_by_handle: Dict[str, discord.Member] = {}
+            for guild_member in guild.members:
+                guild_handle = guild_member.name if guild_member.discriminator == '0' else f"{guild_member.name}#{guild_member.discriminator}"
+                members_by_handle.setdefault(guild_handle, guild_member)
+
             for handle in discord_handles:
-                member = None
-                for guild_member in guild.members:
-                    guild_handle = guild_member.name if guild_member.discriminator == '0' else f"{guild_member.name}#{guild_member.discriminator}"
-                    if guild_handle == handle:
-                        member = guild_member
-                        break
+                member = members_by_handle.get(handle)
 
                 if member:
                     member_since = member.joined_at
@@ -7,6 +7,8 @@ from typing import Optional, Dict, Any, List
 import json 
 import datetime
 
+from utils.rules_catalog import RulesCatalog
+
 logger = logging.getLogger(__name__)
 
 class QuestIDModal(discord.ui.Modal, title="Enter Quest ID"):
@@ -34,7 +36,7 @@ class QuestIDModal(discord.ui.Modal, title="Enter Quest ID"):
         view = ConfirmVisibilityActionView(self.cog, rule_id, self.original_interaction)
         try:
             message_with_buttons = await self.original_interaction.followup.send(
-                f"Choose visibility for Quest ID: `{rule_id}`", 
+                f"Choose visibility for Quest ID: `{rule_id}`{await self.cog.describe_rule(rule_id)}", 
                 view=view, 
                 ephemeral=True
             )
@@ -139,6 +141,7 @@ class QuestVisibilityCog(commands.Cog, name="Quest Visibility"):
         self.snag_client = getattr(bot, 'snag_client', None)
         if not self.snag_client:
             logger.error(f"{self.__class__.__name__}: SnagApiClient (bot.snag_client) not found! Functionality will be disabled.")
+        self.rules_catalog: Optional[RulesCatalog] = getattr(bot, 'rules_catalog', None)
         logger.info(f"Cog '{self.__class__.__name__}' loaded.")
 
     async def cog_load(self):
@@ -146,8 +149,21 @@ class QuestVisibilityCog(commands.Cog, name="Quest Visibility"):
         if not self.snag_client or not self.snag_client._api_key:
              logger.error(f"{self.__class__.__name__}: Snag API client is unavailable or API key is missing. Functionality will be disabled.")
 
+    async def describe_rule(self, rule_id: str) -> str:
+        """Имя и текущая видимость квеста из каталога правил (запрос к API - только если квеста там еще нет)."""
+        if not self.rules_catalog:
+            return ""
+        rule = self.rules_catalog.get(rule_id) or await self.rules_catalog.refresh_rule(rule_id)
+        if not rule:
+            return "\n⚠️ Quest not found in the rules catalog."
+        visibility_status = "🙈 Hidden" if rule.get("hideInUi") else "👁️ Visible"
+        return f"\n**{rule.get('name', 'N/A')}** (currently {visibility_status})"
+
     async def toggle_quest_visibility_action(self, original_interaction: discord.Interaction, rule_id_to_modify: str, hide_ui_flag: bool, action_gerund: str, action_verb_past_tense: str):
-        current_rule_details_response = await self.snag_client.get_loyalty_rule_details(rule_id_to_modify)
+        # Обновление перезаписывает правило целиком, поэтому данные берем прямо из API - не из каталога
+        # и не из кэша ответов, иначе правка, сделанная в Snag за время жизни кэша, будет затерта.
+        # Каталог перечитает правило сам после update_loyalty_rule.
+        current_rule_details_response = await self.snag_client.get_loyalty_rule_details(rule_id_to_modify, use_cache=False)
 
         if not current_rule_details_response or current_rule_details_response.get("error"):
             status = current_rule_details_response.get("status", "N/A") if current_rule_details_response else "N/A"
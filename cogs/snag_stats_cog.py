@@ -0,0 +1,95 @@
+# cogs/snag_stats_cog.py
+import discord
+from discord.ext import commands
+import logging
+import io
+from typing import Any, Dict, List, Optional
+
+from utils.api_metrics import render_prometheus
+from utils.checks import is_prefix_admin_in_guild
+
+logger = logging.getLogger(__name__)
+
+# Сколько эндпоинтов показывать в embed на каждого клиента (полный список - в файле)
+MAX_ENDPOINTS_IN_EMBED = 8
+
+
+def _format_latency(seconds: Optional[float]) -> str:
+    return f"{seconds * 1000:.0f}ms" if seconds is not None else "-"
+
+
+def _format_bytes(size: int) -> str:
+    for unit in ("B", "KB", "MB"):
+        if size < 1024:
+            return f"{size:.0f}{unit}"
+        size /= 1024
+    return f"{size:.1f}GB"
+
+
+def _format_row(row: Dict[str, Any]) -> str:
+    line = (f"`{row['method']} {row['endpoint']}` {row['requests']} req, {row['errors']} err | "
+            f"avg {_format_latency(row['avg_latency'])}, p50 {_format_latency(row['p50_latency'])}, "
+            f"p95 {_format_latency(row['p95_latency'])} | {_format_bytes(row['bytes_received'])}")
+    extras = []
+    if row['retries']: extras.append(f"retries {row['retries']}")
+    if row['cache_hits'] or row['cache_misses']: extras.append(f"cache {row['cache_hits']}/{row['cache_hits'] + row['cache_misses']}")
+    if row['coalesced']: extras.append(f"coalesced {row['coalesced']}")
+    if row['circuit_rejections']: extras.append(f"circuit rejected {row['circuit_rejections']}")
+    if extras: line += " | " + ", ".join(extras)
+    return line
+
+
+class SnagStatsCog(commands.Cog, name="Snag API Stats"):
+    """
+    Метрики Snag API клиентов: задержки, ошибки и кэш по эндпоинтам (!snagstats).
+    """
+    def __init__(self, bot: commands.Bot):
+        self.bot = bot
+        logger.info(f"Cog '{self.__class__.__name__}' loaded.")
+
+    def _clients(self) -> List[Any]:
+        return [client for client in (getattr(self.bot, 'snag_client', None), getattr(self.bot, 'snag_client_legacy', None)) if client]
+
+    @commands.command(name="snagstats")
+    @is_prefix_admin_in_guild()
+    async def snagstats_command(self, ctx: commands.Context):
+        """Показывает задержки, коды ответов и кэш Snag API по эндпоинтам; полные метрики - файлом."""
+        clients = self._clients()
+        if not clients:
+            await ctx.send("⚠️ Snag API clients are not configured.")
+            return
+
+        embed = discord.Embed(title="📈 Snag API Stats", color=discord.Color.blue())
+        for client in clients:
+            rows = client.metrics.summary()
+            total_requests = sum(row['requests'] for row in rows)
+            total_errors = sum(row['errors'] for row in rows)
+            lines = [_format_row(row) for row in rows[:MAX_ENDPOINTS_IN_EMBED]]
+            if len(rows) > MAX_ENDPOINTS_IN_EMBED:
+                lines.append(f"...and {len(rows) - MAX_ENDPOINTS_IN_EMBED} more endpoints (see file)")
+            cache_stats = client.cache_stats()
+            if cache_stats:
+                lines.append(f"Cache: {cache_stats.get('entries', 0)} entries, {cache_stats.get('evictions', 0)} evictions")
+            value = "\n".join(lines) if lines else "No requests yet."
+            if len(value) > 1024:
+                value = value[:1020] + "..."
+            embed.add_field(name=f"{client.metrics.client_name}: {total_requests} requests, {total_errors} errors",
+                            value=value, inline=False)
+        embed.set_footer(text="Latency: connection slot acquired to body read. Counters since bot start.")
+        embed.timestamp = discord.utils.utcnow()
+
+        metrics_file = discord.File(io.BytesIO(render_prometheus(clients).encode('utf-8')), filename="snag_metrics.txt")
+        await ctx.send(embed=embed, file=metrics_file)
+        logger.info(f"Snag API stats sent to {ctx.author.name} in channel {ctx.channel.id}")
+
+    @snagstats_command.error
+    async def snagstats_error(self, ctx: commands.Context, error: commands.CommandError):
+        if isinstance(error, (commands.MissingRole, commands.CheckFailure)):
+            await ctx.send("⛔ You do not have permission to use this command.")
+        else:
+            logger.error(f"Error in snagstats command: {error}", exc_info=True)
+            await ctx.send("⚙️ An unexpected error occurred while collecting Snag API stats.")
+
+
+async def setup(bot: commands.Bot):
+    await bot.add_cog(SnagStatsCog(bot))
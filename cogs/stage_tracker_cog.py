@@ -8,6 +8,7 @@ import asyncio
 import io # Для создания файла в памяти
 from typing import Dict, Set, Optional, List, Tuple # Добавлены List и Tuple
 from utils.checks import is_prefix_admin_in_guild
+from utils.identity_resolver import IdentityResolver
 
 logger = logging.getLogger(__name__)
 
@@ -121,6 +122,7 @@ class StageTrackerCog(commands.Cog, name="Stage Tracker"):
         # API Clients
         self.snag_client = getattr(bot, 'snag_client', None)
         self.snag_client_legacy = getattr(bot, 'snag_client_legacy', None)
+        self.identity_resolver: IdentityResolver = getattr(bot, 'identity_resolver', None) or IdentityResolver(self.snag_client, self.snag_client_legacy)
 
         self.min_duration: Optional[datetime.timedelta] = None
         self.is_running: bool = False
@@ -207,6 +209,22 @@ class StageTrackerCog(commands.Cog, name="Stage Tracker"):
         self.is_running = False
         logger.info(f"Stage channel monitoring {self.target_channel_id} STOPPED.")
 
+    def _snag_api_status_text(self) -> str:
+        """Состояние circuit breaker'ов обоих Snag клиентов для статусного embed."""
+        lines = []
+        for label, client in (("Main", self.snag_client), ("Legacy", self.snag_client_legacy)):
+            if not client:
+                lines.append(f"⚪ {label}: not configured")
+                continue
+            degraded = [
+                f"{'🔴' if info['state'] == 'open' else '🟡'} `{endpoint}` {info['state']}"
+                + (f" (probe in {info['retry_in']:.0f}s)" if info['retry_in'] > 0 else "")
+                for endpoint, info in client.circuit_states().items() if info['state'] != 'closed'
+            ]
+            if degraded: lines.append(f"**{label}:**\n" + "\n".join(degraded))
+            else: lines.append(f"🟢 {label}: OK")
+        return "\n".join(lines)[:1024]
+
     async def get_status_embed(self) -> discord.Embed:
         status_text = "🟢 Running" if self.is_running else "🔴 Stopped"
         channel_name = "Not configured or not found"
@@ -222,6 +240,7 @@ class StageTrackerCog(commands.Cog, name="Stage Tracker"):
         embed.add_field(name="Min. Duration", value=f"{self.min_duration.total_seconds()} sec" if self.min_duration else "Not set", inline=True)
         embed.add_field(name="Currently in Channel", value=f"{len(self.active_sessions)} users", inline=True)
         embed.add_field(name="Eligible for Processing", value=f"{users_ready_count} users", inline=True)
+        embed.add_field(name="Snag API", value=self._snag_api_status_text(), inline=False)
         embed.set_footer(text="Eligible users have met the duration criteria; their wallets have not yet been fetched.")
         embed.timestamp = discord.utils.utcnow()
         return embed
@@ -246,25 +265,6 @@ class StageTrackerCog(commands.Cog, name="Stage Tracker"):
             else:
                  logger.warning(f"⚠️ StageTracker: {member.name} ({member.id}) left channel {target_id}, but not found in active_sessions.")
 
-    # --- ИЗМЕНЕННЫЙ ХЕЛПЕР ---
-    async def _fetch_wallet_from_api_st(self, client, handle: str) -> Optional[str]:
-        """Helper to fetch wallet from a single API client."""
-        if not client or not client._api_key:
-            client_name = getattr(client, '_client_name', 'Unknown Snag client')
-            logger.warning(f"Client {client_name} has no API key. Skipping request for {handle}.")
-            return None
-            
-        # Используем новый метод get_user_data
-        response = await client.get_user_data(discord_user=handle)
-        
-        # Парсим ответ от get_user_data
-        if response and not response.get("error") and isinstance(response.get("data"), list) and response["data"]:
-            user_data = response["data"][0]
-            wallet_address = user_data.get("walletAddress")
-            if wallet_address:
-                return str(wallet_address).lower()
-        return None
-
     async def process_eligible_users(self) -> Tuple[int, Optional[str], Optional[str]]:
         """Processes users from users_met_voice_criteria, fetches wallets, and returns content for a TXT file."""
         async with self._lock:
@@ -282,7 +282,7 @@ class StageTrackerCog(commands.Cog, name="Stage Tracker"):
         logger.info(f"Processing {len(user_ids_to_process)} eligible users from Stage channel...")
         
         final_wallet_statuses: List[Tuple[str, str]] = []
-        api_tasks_meta = [] 
+        handles_to_resolve: List[str] = []
 
         for user_id in user_ids_to_process:
             user = self.bot.get_user(user_id)
@@ -299,41 +299,16 @@ class StageTrackerCog(commands.Cog, name="Stage Tracker"):
             
             if user.discriminator == '0': discord_handle = user.name
             else: discord_handle = f"{user.name}#{user.discriminator}"
+            handles_to_resolve.append(discord_handle)
 
-            tasks_for_handle = []
-            if self.snag_client: tasks_for_handle.append(self._fetch_wallet_from_api_st(self.snag_client, discord_handle))
-            else: tasks_for_handle.append(asyncio.sleep(0, result=None)) 
+        async def log_progress(done: int, total: int):
+            logger.info(f"Stage: resolved wallets for {done}/{total} users.")
 
-            if self.snag_client_legacy: tasks_for_handle.append(self._fetch_wallet_from_api_st(self.snag_client_legacy, discord_handle))
-            else: tasks_for_handle.append(asyncio.sleep(0, result=None)) 
-            
-            api_tasks_meta.append((discord_handle, asyncio.gather(*tasks_for_handle, return_exceptions=True)))
-            if len(api_tasks_meta) % 10 == 0: await asyncio.sleep(0.1) 
-
-        processed_api_tasks_count = 0
-        for handle, gather_task in api_tasks_meta:
-            try:
-                api_responses = await gather_task
-                wallet_main = api_responses[0] if len(api_responses) > 0 and not isinstance(api_responses[0], Exception) else None
-                wallet_legacy = api_responses[1] if len(api_responses) > 1 and not isinstance(api_responses[1], Exception) else None
-
-                if len(api_responses) > 0 and isinstance(api_responses[0], Exception): logger.error(f"Stage API Error (Main) for {handle}: {api_responses[0]}")
-                if len(api_responses) > 1 and isinstance(api_responses[1], Exception): logger.error(f"Stage API Error (Legacy) for {handle}: {api_responses[1]}")
-
-                chosen_wallet = "Wallet Not Found"
-                if wallet_main and wallet_legacy:
-                    if wallet_main == wallet_legacy: chosen_wallet = wallet_main
-                    else:
-                        chosen_wallet = wallet_main 
-                        logger.info(f"Stage: For {handle} addresses DIFFER. Main: {wallet_main}, Legacy: {wallet_legacy}. Chose Main.")
-                elif wallet_main: chosen_wallet = wallet_main
-                elif wallet_legacy: chosen_wallet = wallet_legacy
-                
-                final_wallet_statuses.append((handle, chosen_wallet))
-            except Exception as e_gather:
-                logger.error(f"Error processing Stage API requests for {handle}: {e_gather}", exc_info=True)
-                final_wallet_statuses.append((handle, "Error during API lookup"))
-            processed_api_tasks_count +=1
+        resolved = await self.identity_resolver.resolve_many(handles_to_resolve, progress_callback=log_progress, progress_every=200)
+        for handle, identity in resolved.items():
+            if identity.chosen_wallet: final_wallet_statuses.append((handle, identity.chosen_wallet))
+            elif identity.error: final_wallet_statuses.append((handle, "Error during API lookup"))
+            else: final_wallet_statuses.append((handle, "Wallet Not Found"))
         
         if not final_wallet_statuses and not user_ids_to_process : 
              return 0, None, "No users were processed, or no wallet data could be retrieved."
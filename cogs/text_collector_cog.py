@@ -4,10 +4,10 @@ from discord.ext import commands
 import logging
 import datetime
 import os
-import asyncio
 import io
 from typing import Dict, Set, Optional, Tuple, List, Union
 from utils.checks import is_prefix_admin_in_guild
+from utils.identity_resolver import IdentityResolver
 
 logger = logging.getLogger(__name__)
 
@@ -101,6 +101,7 @@ class TextCollectorCog(commands.Cog, name="Text Chat Collector"):
         self.bot = bot
         self.snag_client = getattr(bot, 'snag_client', None)
         self.snag_client_legacy = getattr(bot, 'snag_client_legacy', None)
+        self.identity_resolver: IdentityResolver = getattr(bot, 'identity_resolver', None) or IdentityResolver(self.snag_client, self.snag_client_legacy)
         
         if not self.snag_client:
             logger.error(f"{self.__class__.__name__}: Main SnagApiClient (bot.snag_client) not found!")
@@ -115,25 +116,6 @@ class TextCollectorCog(commands.Cog, name="Text Chat Collector"):
     async def cog_unload(self):
         logger.info(f"Cog '{self.__class__.__name__}' unloaded.")
 
-    # --- ИЗМЕНЕННЫЙ ХЕЛПЕР ---
-    async def _fetch_wallet_from_api(self, client, handle: str) -> Optional[str]:
-        """Helper to fetch wallet from a single API client."""
-        if not client or not client._api_key:
-            client_name = getattr(client, '_client_name', 'Unknown Snag client')
-            logger.warning(f"Client {client_name} has no API key. Skipping request for {handle}.")
-            return None
-            
-        # Используем новый метод get_user_data
-        response = await client.get_user_data(discord_user=handle)
-        
-        # Парсим ответ от get_user_data
-        if response and not response.get("error") and isinstance(response.get("data"), list) and response["data"]:
-            user_data = response["data"][0]
-            wallet_address = user_data.get("walletAddress")
-            if wallet_address:
-                return str(wallet_address).lower()
-        return None
-
     async def process_text_collection_request(self, interaction: discord.Interaction, channel_id_str: str, date_str: str, limit_str: Optional[str]):
         target_channel: Optional[Union[discord.TextChannel, discord.VoiceChannel]] = None
         channel_type_str = "channel" 
@@ -221,8 +203,8 @@ class TextCollectorCog(commands.Cog, name="Text Chat Collector"):
 
         await interaction.edit_original_response(content=f"⏳ Collected {len(unique_user_ids)} unique users from {channel_type_str}. Fetching wallets...") # MODIFIED
 
-        results: List[Tuple[str, str]] = []
-        api_tasks = []
+        final_wallet_statuses: List[Tuple[str, str]] = []
+        handles_to_resolve: List[str] = []
 
         for user_id in unique_user_ids:
             user = self.bot.get_user(user_id)
@@ -230,55 +212,25 @@ class TextCollectorCog(commands.Cog, name="Text Chat Collector"):
                 try: user = await self.bot.fetch_user(user_id)
                 except discord.NotFound:
                     logger.warning(f"Could not find user with ID {user_id} for text collection.")
-                    results.append((f"UnknownUser (ID: {user_id})", "User not found"))
+                    final_wallet_statuses.append((f"UnknownUser (ID: {user_id})", "User not found"))
                     continue
                 except Exception as e_fetch:
                     logger.error(f"Error fetching user {user_id}: {e_fetch}")
-                    results.append((f"UnknownUser (ID: {user_id})", "Error fetching user"))
+                    final_wallet_statuses.append((f"UnknownUser (ID: {user_id})", "Error fetching user"))
                     continue
             
             if user.discriminator == '0': discord_handle = user.name
             else: discord_handle = f"{user.name}#{user.discriminator}"
+            handles_to_resolve.append(discord_handle)
 
-            tasks_for_handle = []
-            if self.snag_client: tasks_for_handle.append(self._fetch_wallet_from_api(self.snag_client, discord_handle))
-            else: tasks_for_handle.append(asyncio.sleep(0, result=None))
-
-            if self.snag_client_legacy: tasks_for_handle.append(self._fetch_wallet_from_api(self.snag_client_legacy, discord_handle))
-            else: tasks_for_handle.append(asyncio.sleep(0, result=None))
+        async def report_progress(done: int, total: int):
+            await interaction.edit_original_response(content=f"⏳ Fetching wallets... {done}/{total} users processed...")
 
-            api_tasks.append((discord_handle, asyncio.gather(*tasks_for_handle, return_exceptions=True)))
-            
-            if len(api_tasks) % 10 == 0: await asyncio.sleep(0.1) 
-
-        final_wallet_statuses: List[Tuple[str, str]] = []
-        processed_api_tasks = 0
-        for handle, gather_task in api_tasks:
-            try:
-                api_responses = await gather_task
-                wallet_main = api_responses[0] if len(api_responses) > 0 and not isinstance(api_responses[0], Exception) else None
-                wallet_legacy = api_responses[1] if len(api_responses) > 1 and not isinstance(api_responses[1], Exception) else None
-
-                if len(api_responses) > 0 and isinstance(api_responses[0], Exception): logger.error(f"API Error (Main) for {handle}: {api_responses[0]}")
-                if len(api_responses) > 1 and isinstance(api_responses[1], Exception): logger.error(f"API Error (Legacy) for {handle}: {api_responses[1]}")
-                
-                chosen_wallet = "Wallet Not Found"
-                if wallet_main and wallet_legacy:
-                    if wallet_main == wallet_legacy: chosen_wallet = wallet_main
-                    else:
-                        chosen_wallet = wallet_main
-                        logger.info(f"For {handle} addresses DIFFER. Main: {wallet_main}, Legacy: {wallet_legacy}. Chose Main.")
-                elif wallet_main: chosen_wallet = wallet_main
-                elif wallet_legacy: chosen_wallet = wallet_legacy
-                
-                final_wallet_statuses.append((handle, chosen_wallet))
-            except Exception as e_gather:
-                logger.error(f"Error processing API requests for {handle}: {e_gather}", exc_info=True)
-                final_wallet_statuses.append((handle, "Error during API lookup"))
-            
-            processed_api_tasks += 1
-            if processed_api_tasks % 20 == 0:
-                 await interaction.edit_original_response(content=f"⏳ Fetching wallets... {processed_api_tasks}/{len(api_tasks)} users processed...") # MODIFIED
+        resolved = await self.identity_resolver.resolve_many(handles_to_resolve, progress_callback=report_progress)
+        for handle, identity in resolved.items():
+            if identity.chosen_wallet: final_wallet_statuses.append((handle, identity.chosen_wallet))
+            elif identity.error: final_wallet_statuses.append((handle, "Error during API lookup"))
+            else: final_wallet_statuses.append((handle, "Wallet Not Found"))
 
         if not final_wallet_statuses:
              await interaction.edit_original_response(content="Could not retrieve wallet information for the collected users.") # MODIFIED
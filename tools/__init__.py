@@ -0,0 +1,2 @@
+# tools/__init__.py
+# Вспомогательные утилиты для разработки (симулятор Snag API, бенчмарки). Боту не нужны.
@@ -0,0 +1,419 @@
+# tools/benchmarks.py
+"""
+Бенчмарки тяжелых сценариев бота против локального симулятора Snag API и фейкового Discord.
+
+Запуск:
+    python -m tools.benchmarks --output benchmark_results.json
+    python -m tools.benchmarks --scenarios mass_block_check,find_rule_id --latency 0.1
+    python -m tools.benchmarks --baseline benchmark_results_prev.json --fail-on-regression
+
+Для каждого сценария измеряются время выполнения, число HTTP-запросов к Snag и запросов в
+секунду, p50/p95/max задержки запросов (по данным aiohttp TraceConfig), пиковая память
+Python (tracemalloc) и число вызовов фейкового Discord API. Результаты пишутся в JSON;
+с --baseline время сравнивается с прошлым прогоном и регрессии выделяются.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timezone
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+import aiohttp
+
+from tools.fake_discord import FakeAttachment, FakeBot, FakeDiscord, FakeInteraction, make_users
+from tools.snag_simulator import SimulatorSettings, SnagSimulator
+
+logger = logging.getLogger("benchmarks")
+
+BENCHMARK_ORGANIZATION_ID = "sim-organization"
+BENCHMARK_WEBSITE_ID = "sim-website"
+
+
+class RequestRecorder:
+    """Собирает длительность и статус каждого HTTP-запроса сессии через aiohttp TraceConfig."""
+    def __init__(self):
+        self.durations: List[float] = []
+        self.statuses: Dict[str, int] = {}
+
+    def reset(self):
+        self.durations = []
+        self.statuses = {}
+
+    def trace_config(self) -> aiohttp.TraceConfig:
+        config = aiohttp.TraceConfig()
+
+        async def on_start(session, ctx, params):
+            ctx.started_at = time.perf_counter()
+
+        async def on_end(session, ctx, params):
+            self._record(ctx, str(params.response.status))
+
+        async def on_exception(session, ctx, params):
+            self._record(ctx, type(params.exception).__name__)
+
+        config.on_request_start.append(on_start)
+        config.on_request_end.append(on_end)
+        config.on_request_exception.append(on_exception)
+        return config
+
+    def _record(self, ctx, status: str):
+        self.durations.append(time.perf_counter() - getattr(ctx, "started_at", time.perf_counter()))
+        self.statuses[status] = self.statuses.get(status, 0) + 1
+
+
+def _percentile(values: List[float], fraction: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(fraction * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+class BenchmarkContext:
+    """Симулятор, сессия и параметры, общие для всех сценариев одного прогона."""
+    def __init__(self, args: argparse.Namespace, simulator: SnagSimulator, session: aiohttp.ClientSession,
+                 recorder: RequestRecorder):
+        self.args = args
+        self.simulator = simulator
+        self.session = session
+        self.recorder = recorder
+        self.hub = FakeDiscord(latency=args.discord_latency)
+
+    def make_client(self, client_name: str):
+        from utils.snag_api_client import SnagApiClient
+        return SnagApiClient(
+            self.session, "benchmark-key", BENCHMARK_ORGANIZATION_ID, BENCHMARK_WEBSITE_ID,
+            client_name=client_name,
+            max_concurrent_requests=self.args.max_connections,
+            rate_limit=self.args.rate_limit,
+            rate_burst=self.args.rate_burst,
+            max_retries=self.args.max_retries,
+            retry_backoff_base=0.1,
+            cache_max_entries=self.args.cache_entries,
+            base_url=self.simulator.base_url,
+        )
+
+    def make_bot(self, users=()) -> FakeBot:
+        """Свежий фейковый бот с новыми клиентами (пустые кэши) для каждого прогона сценария."""
+        from utils.identity_resolver import IdentityResolver
+        from utils.rules_catalog import RulesCatalog
+        from utils.currency_registry import CurrencyRegistry
+        bot = FakeBot(self.hub, users)
+        bot.snag_client = self.make_client("MainSnagClient")
+        bot.snag_client_legacy = self.make_client("LegacySnagClient")
+        bot.identity_cache = None
+        bot.rules_catalog = RulesCatalog(bot.snag_client, BENCHMARK_ORGANIZATION_ID, BENCHMARK_WEBSITE_ID)
+        bot.currency_registry = CurrencyRegistry(bot.snag_client)
+        bot.identity_resolver = IdentityResolver(bot.snag_client, bot.snag_client_legacy,
+                                                 max_concurrency=self.args.resolver_concurrency)
+        return bot
+
+    def wallets(self, count: int) -> List[str]:
+        users = self.simulator.users
+        return [users[i % len(users)]["walletAddress"] for i in range(count)]
+
+
+# --- Сценарии: каждый возвращает словарь с размером обработанных данных ---
+async def scenario_transaction_history(ctx: BenchmarkContext) -> Dict[str, Any]:
+    from cogs.control_panel_cog import ControlPanelCog
+    wallet = ctx.simulator.users[0]["walletAddress"]
+    ctx.simulator.generate_history(wallet, ctx.args.history_entries)
+    bot = ctx.make_bot()
+    cog = ControlPanelCog(bot)
+    transactions, warning, _, _ = await cog._fetch_and_process_all_transactions(bot.snag_client, wallet)
+    return {"items": len(transactions), "warning": warning or None}
+
+
+async def scenario_mass_block_check(ctx: BenchmarkContext) -> Dict[str, Any]:
+    from cogs.mass_block_cog import MassBlockCog
+    wallets = ctx.wallets(ctx.args.wallets)
+    # Часть адресов неизвестна системе, как в реальных списках
+    wallets += [f"0x{i:040x}" for i in range(max(1, ctx.args.wallets // 20))]
+    attachment = FakeAttachment("wallets.txt", "\n".join(wallets).encode())
+    bot = ctx.make_bot()
+    cog = MassBlockCog(bot)
+    interaction = FakeInteraction(ctx.hub)
+    await MassBlockCog.mass_block_tool.callback(cog, interaction, attachment)
+    return {"items": len(set(wallets)), "messages_sent": len(interaction.followup.sent)}
+
+
+async def scenario_mass_block_update(ctx: BenchmarkContext) -> Dict[str, Any]:
+    from cogs.mass_block_cog import MassBlockCog
+    wallets_data = [{"walletAddress": wallet} for wallet in dict.fromkeys(ctx.wallets(ctx.args.wallets))]
+    bot = ctx.make_bot()
+    cog = MassBlockCog(bot)
+    results = await cog.process_mass_update(wallets_data, False, FakeInteraction(ctx.hub).user)
+    return {"items": len(wallets_data), "failed": results["failed"]}
+
+
+async def scenario_text_collector_resolution(ctx: BenchmarkContext) -> Dict[str, Any]:
+    from cogs.text_collector_cog import TextCollectorCog
+    handles = [f"sim_user_{i % ctx.simulator.settings.users}" for i in range(ctx.args.handles)]
+    handles += [f"unknown_user_{i}" for i in range(max(1, ctx.args.handles // 10))]
+    bot = ctx.make_bot()
+    cog = TextCollectorCog(bot)
+    interaction = FakeInteraction(ctx.hub)
+
+    async def report_progress(done: int, total: int):
+        await interaction.edit_original_response(content=f"⏳ Fetching wallets... {done}/{total} users processed...")
+
+    resolved = await cog.identity_resolver.resolve_many(handles, progress_callback=report_progress)
+    found = sum(1 for identity in resolved.values() if identity.chosen_wallet)
+    return {"items": len(resolved), "found": found, "progress_edits": interaction.original_message.edits}
+
+
+async def scenario_stage_tracker(ctx: BenchmarkContext) -> Dict[str, Any]:
+    from cogs.stage_tracker_cog import StageTrackerCog
+    users = make_users(ctx.args.handles)
+    bot = ctx.make_bot()
+    # Половина пользователей не в кэше бота и запрашивается через fetch_user
+    for index, user in enumerate(users):
+        bot.add_user(user, cached=index % 2 == 0)
+    cog = StageTrackerCog(bot)
+    cog.users_met_voice_criteria.update(user.id for user in users)
+    processed, file_content, error = await cog.process_eligible_users()
+    return {"items": processed, "error": error, "report_bytes": len(file_content or "")}
+
+
+async def scenario_account_checker(ctx: BenchmarkContext) -> Dict[str, Any]:
+    from cogs.account_checker_cog import AccountCheckerCog
+    users = make_users(ctx.args.account_ids)
+    bot = ctx.make_bot(users)
+    ids_file = FakeAttachment("ids.txt", "\n".join(str(user.id) for user in users).encode())
+    cog = AccountCheckerCog(bot)
+    interaction = FakeInteraction(ctx.hub)
+    await AccountCheckerCog.check_accounts_slash_command.callback(cog, interaction, ids_file, None, 2)
+    return {"items": len(users), "messages_sent": len(interaction.followup.sent)}
+
+
+async def scenario_find_rule_id(ctx: BenchmarkContext) -> Dict[str, Any]:
+    from cogs.find_rule_id_cog import FindRuleIDCog
+    bot = ctx.make_bot()
+    cog = FindRuleIDCog(bot)
+    interaction = FakeInteraction(ctx.hub)
+    await cog.find_and_display_rule_ids(interaction, ctx.args.rule_query)
+    embed = interaction.original_message.embed
+    return {"items": len(ctx.simulator.rules), "result": embed.footer.text if embed else interaction.original_message.content}
+
+
+async def scenario_poker_join_burst(ctx: BenchmarkContext) -> Dict[str, Any]:
+    from decimal import Decimal
+    from cogs.poker_cog import PokerCog
+    users = make_users(ctx.args.poker_joins)
+    bot = ctx.make_bot(users)
+    cog = PokerCog(bot)
+    event_id = 1
+    cog.event_configs[event_id] = Decimal("0")
+    cog.invite_codes[event_id] = [f"code{i:06d}" for i in range(len(users))]
+    join_times: List[float] = []
+
+    # Все нажимают Join одновременно; время - от отправки формы до ответа пользователю
+    async def join(user):
+        interaction = FakeInteraction(ctx.hub, user)
+        started_at = time.perf_counter()
+        await cog.process_poker_request(interaction, f"poker_{user.name}", "https://poker.invalid/game", event_id)
+        join_times.append(time.perf_counter() - started_at)
+
+    await asyncio.gather(*(join(user) for user in users))
+    codes = [entry[3] for entry in cog.participants.get(event_id, [])]
+    return {
+        "items": len(users), "registered": len(codes), "duplicate_codes": len(codes) - len(set(codes)),
+        "join_p50_ms": round(_percentile(join_times, 0.50) * 1000, 2),
+        "join_max_ms": round(max(join_times, default=0.0) * 1000, 2),
+    }
+
+
+SCENARIOS: Dict[str, Callable[[BenchmarkContext], Awaitable[Dict[str, Any]]]] = {
+    "transaction_history": scenario_transaction_history,
+    "mass_block_check": scenario_mass_block_check,
+    "mass_block_update": scenario_mass_block_update,
+    "text_collector_resolution": scenario_text_collector_resolution,
+    "stage_tracker": scenario_stage_tracker,
+    "account_checker": scenario_account_checker,
+    "find_rule_id": scenario_find_rule_id,
+    "poker_join_burst": scenario_poker_join_burst,
+}
+
+
+async def run_scenario(ctx: BenchmarkContext, name: str) -> Dict[str, Any]:
+    scenario = SCENARIOS[name]
+    runs: List[Dict[str, Any]] = []
+    for _ in range(ctx.args.repeat):
+        ctx.recorder.reset()
+        discord_calls_before = ctx.hub.api_calls
+        tracemalloc.start()
+        started_at = time.perf_counter()
+        error = None
+        details: Dict[str, Any] = {}
+        try:
+            details = await scenario(ctx)
+        except Exception as e:
+            logger.exception(f"Scenario {name} failed")
+            error = f"{type(e).__name__}: {e}"
+        wall_time = time.perf_counter() - started_at
+        _, peak_memory = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        durations = ctx.recorder.durations
+        runs.append({
+            "wall_time_s": round(wall_time, 4),
+            "requests": len(durations),
+            "requests_per_s": round(len(durations) / wall_time, 2) if wall_time > 0 else 0.0,
+            "latency_p50_ms": round(_percentile(durations, 0.50) * 1000, 2),
+            "latency_p95_ms": round(_percentile(durations, 0.95) * 1000, 2),
+            "latency_max_ms": round(max(durations, default=0.0) * 1000, 2),
+            "http_statuses": dict(ctx.recorder.statuses),
+            "peak_memory_mb": round(peak_memory / (1024 * 1024), 2),
+            "discord_calls": ctx.hub.api_calls - discord_calls_before,
+            "details": details,
+            "error": error,
+        })
+    # Итог сценария - прогон с медианным временем
+    runs_by_time = sorted(runs, key=lambda run: run["wall_time_s"])
+    result = dict(runs_by_time[(len(runs_by_time) - 1) // 2])
+    result["runs_wall_time_s"] = [run["wall_time_s"] for run in runs]
+    return result
+
+
+def _git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def compare_with_baseline(results: Dict[str, Any], baseline: Dict[str, Any], threshold: float) -> List[str]:
+    """Печатает изменение времени по сценариям и возвращает список регрессий."""
+    regressions: List[str] = []
+    print(f"\n{'scenario':<28}{'baseline s':>12}{'current s':>12}{'change':>10}")
+    for name, current in results["scenarios"].items():
+        previous = baseline.get("scenarios", {}).get(name)
+        if not previous or not previous.get("wall_time_s"):
+            print(f"{name:<28}{'-':>12}{current['wall_time_s']:>12.3f}{'new':>10}")
+            continue
+        change = current["wall_time_s"] / previous["wall_time_s"] - 1
+        marker = ""
+        if change > threshold:
+            marker = "  REGRESSION"
+            regressions.append(name)
+        print(f"{name:<28}{previous['wall_time_s']:>12.3f}{current['wall_time_s']:>12.3f}{change:>+10.1%}{marker}")
+    return regressions
+
+
+async def run_benchmarks(args: argparse.Namespace) -> Dict[str, Any]:
+    settings = SimulatorSettings(
+        users=args.users, rules=args.rules, latency=args.latency, latency_jitter=args.latency_jitter,
+        error_rate=args.error_rate, rate_limit_rate=args.rate_limit_rate, max_rps=args.max_rps,
+        retry_after=args.retry_after, seed=args.seed,
+        organization_id=BENCHMARK_ORGANIZATION_ID, website_id=BENCHMARK_WEBSITE_ID,
+    )
+    simulator = SnagSimulator(settings)
+    await simulator.start()
+    recorder = RequestRecorder()
+    connector = aiohttp.TCPConnector(limit=args.pool_limit, limit_per_host=args.pool_limit)
+    results: Dict[str, Any] = {
+        "meta": {
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "git_revision": _git_revision(),
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "args": {key: value for key, value in vars(args).items() if key not in ("output", "baseline")},
+        },
+        "scenarios": {},
+    }
+    try:
+        async with aiohttp.ClientSession(connector=connector, trace_configs=[recorder.trace_config()]) as session:
+            ctx = BenchmarkContext(args, simulator, session, recorder)
+            for name in args.scenarios:
+                print(f"Running {name}...", flush=True)
+                result = await run_scenario(ctx, name)
+                results["scenarios"][name] = result
+                status = f"ERROR {result['error']}" if result["error"] else "ok"
+                print(f"  {result['wall_time_s']:.3f}s, {result['requests']} requests ({result['requests_per_s']}/s), "
+                      f"p50 {result['latency_p50_ms']}ms, p95 {result['latency_p95_ms']}ms, "
+                      f"peak {result['peak_memory_mb']}MB - {status}", flush=True)
+    finally:
+        await simulator.stop()
+    return results
+
+
+def _parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Benchmarks for the bot's bulk pipelines against the Snag simulator.")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS),
+                        help=f"Comma-separated list. Available: {', '.join(SCENARIOS)}")
+    parser.add_argument("--output", default="benchmark_results.json", help="Where to write JSON results.")
+    parser.add_argument("--baseline", default=None, help="Previous results JSON to compare against.")
+    parser.add_argument("--regression-threshold", type=float, default=0.15, help="Slowdown share reported as regression.")
+    parser.add_argument("--fail-on-regression", action="store_true", help="Exit with code 1 on regressions.")
+    parser.add_argument("--repeat", type=int, default=1, help="Runs per scenario; the median run is reported.")
+    # Размеры сценариев
+    parser.add_argument("--history-entries", type=int, default=20000, help="Transaction entries for the history scenario (20 pages x 1000).")
+    parser.add_argument("--wallets", type=int, default=500, help="Wallets in the mass block file.")
+    parser.add_argument("--handles", type=int, default=500, help="Handles for text collector / stage tracker.")
+    parser.add_argument("--account-ids", type=int, default=20, help="Discord IDs for the account checker (it paces itself at ~0.35s/ID).")
+    parser.add_argument("--rule-query", default="Quest #1", help="Search string for the find rule ID scenario.")
+    parser.add_argument("--poker-joins", type=int, default=100, help="Users pressing Join at once in the poker burst scenario.")
+    # Симулятор
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--rules", type=int, default=300)
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--latency-jitter", type=float, default=0.01)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0)
+    parser.add_argument("--max-rps", type=float, default=0.0)
+    parser.add_argument("--retry-after", type=float, default=0.5)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--discord-latency", type=float, default=0.0, help="Latency of each fake Discord API call.")
+    # Клиент
+    parser.add_argument("--max-connections", type=int, default=20)
+    parser.add_argument("--pool-limit", type=int, default=100)
+    parser.add_argument("--rate-limit", type=float, default=0.0, help="Client-side req/s limit (0 = off).")
+    parser.add_argument("--rate-burst", type=int, default=20)
+    parser.add_argument("--max-retries", type=int, default=3)
+    parser.add_argument("--cache-entries", type=int, default=0, help="Response cache size (0 = cold runs).")
+    parser.add_argument("--resolver-concurrency", type=int, default=25)
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args(argv)
+    args.scenarios = [name.strip() for name in args.scenarios.split(",") if name.strip()]
+    unknown = [name for name in args.scenarios if name not in SCENARIOS]
+    if unknown:
+        parser.error(f"Unknown scenarios: {', '.join(unknown)}")
+    args.repeat = max(1, args.repeat)
+    return args
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = _parse_args(argv)
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING,
+                        format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    # Коги читают ID организации и валюты из окружения при импорте; организация всегда симуляторная
+    os.environ["NEW_SNAG_ORGANIZATION_ID"] = BENCHMARK_ORGANIZATION_ID
+    os.environ["NEW_SNAG_WEBSITE_ID"] = BENCHMARK_WEBSITE_ID
+    os.environ.setdefault("MATCHSTICKS_CURRENCY_ID", "7f74ae35-a6e2-496a-83ea-5b2e18769560")
+
+    results = asyncio.run(run_benchmarks(args))
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2, ensure_ascii=False, default=str)
+    print(f"\nResults written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare_with_baseline(results, baseline, args.regression_threshold)
+        if regressions:
+            print(f"\nRegressions (>{args.regression_threshold:.0%} slower): {', '.join(regressions)}")
+            if args.fail_on_regression:
+                return 1
+    failed = [name for name, result in results["scenarios"].items() if result["error"]]
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
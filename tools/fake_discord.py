@@ -0,0 +1,178 @@
+# tools/fake_discord.py
+"""
+Минимальная замена объектов discord.py (бот, interaction, сообщения, вложения) для бенчмарков.
+
+Поддерживается только то, что реально вызывают коги: defer/send_message, followup.send,
+edit_original_response/original_response, get_user/fetch_user, чтение вложений. Каждый
+"вызов Discord API" проходит через FakeDiscord, который добавляет задержку и считает вызовы.
+"""
+import asyncio
+import itertools
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+from typing import Any, Dict, Iterable, List, Optional
+
+import discord
+
+_ids = itertools.count(1_000_000_000_000_000_000)
+_user_ids = itertools.count(200_000_000_000_000_000)  # 18 цифр, как у настоящих Discord ID
+
+
+class FakeDiscord:
+    """Общие настройки фейкового Discord: задержка одного вызова API и счетчик вызовов."""
+    def __init__(self, latency: float = 0.0):
+        self.latency = max(0.0, float(latency))
+        self.api_calls = 0
+
+    async def call(self):
+        self.api_calls += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+
+class FakeUser:
+    def __init__(self, user_id: int, name: str, discriminator: str = "0", bot: bool = False,
+                 created_at: Optional[datetime] = None, roles: Iterable[Any] = ()):
+        self.id = user_id
+        self.name = name
+        self.display_name = name
+        self.global_name = name
+        self.discriminator = discriminator
+        self.bot = bot
+        self.created_at = created_at or datetime(2022, 1, 1, tzinfo=timezone.utc)
+        self.roles = list(roles)
+        self.mention = f"<@{user_id}>"
+
+    def __str__(self):
+        return self.name if self.discriminator == "0" else f"{self.name}#{self.discriminator}"
+
+
+class FakeMessage:
+    def __init__(self, hub: FakeDiscord, content: Optional[str] = None, **kwargs):
+        self.hub = hub
+        self.id = next(_ids)
+        self.content = content
+        self.embed = kwargs.get("embed")
+        self.view = kwargs.get("view")
+        self.attachments = list(kwargs.get("attachments") or ([kwargs["file"]] if kwargs.get("file") else []))
+        self.edits = 0
+
+    async def edit(self, **kwargs):
+        await self.hub.call()
+        self.edits += 1
+        for key in ("content", "embed", "view"):
+            if key in kwargs:
+                setattr(self, key, kwargs[key])
+        if "attachments" in kwargs:
+            self.attachments = list(kwargs["attachments"])
+        return self
+
+
+class FakeInteractionResponse:
+    def __init__(self, interaction: "FakeInteraction"):
+        self._interaction = interaction
+        self._done = False
+
+    def is_done(self) -> bool:
+        return self._done
+
+    async def defer(self, **kwargs):
+        await self._interaction.hub.call()
+        self._done = True
+
+    async def send_message(self, content: Optional[str] = None, **kwargs):
+        await self._interaction.hub.call()
+        self._done = True
+        self._interaction.original_message = FakeMessage(self._interaction.hub, content, **kwargs)
+
+    async def edit_message(self, **kwargs):
+        self._done = True
+        await self._interaction.original_message.edit(**kwargs)
+
+
+class FakeFollowup:
+    def __init__(self, interaction: "FakeInteraction"):
+        self._interaction = interaction
+        self.sent: List[FakeMessage] = []
+
+    async def send(self, content: Optional[str] = None, **kwargs) -> FakeMessage:
+        await self._interaction.hub.call()
+        message = FakeMessage(self._interaction.hub, content, **kwargs)
+        self.sent.append(message)
+        return message
+
+
+class FakeInteraction:
+    def __init__(self, hub: FakeDiscord, user: Optional[FakeUser] = None):
+        self.hub = hub
+        self.id = next(_ids)
+        self.user = user or FakeUser(next(_user_ids), "benchmark_admin")
+        self.guild = None
+        self.guild_id = None
+        self.channel = None
+        self.response = FakeInteractionResponse(self)
+        self.followup = FakeFollowup(self)
+        self.original_message = FakeMessage(hub)
+
+    def is_expired(self) -> bool:
+        return False
+
+    async def original_response(self) -> FakeMessage:
+        await self.hub.call()
+        return self.original_message
+
+    async def edit_original_response(self, **kwargs) -> FakeMessage:
+        return await self.original_message.edit(**kwargs)
+
+
+class FakeAttachment:
+    def __init__(self, filename: str, data: bytes):
+        self.filename = filename
+        self.size = len(data)
+        self._data = data
+
+    async def read(self) -> bytes:
+        return self._data
+
+
+def _not_found() -> discord.NotFound:
+    return discord.NotFound(SimpleNamespace(status=404, reason="Not Found"), "Unknown User")
+
+
+class FakeBot:
+    """
+    Замена commands.Bot: хранит атрибуты, которые коги берут через getattr(bot, ...),
+    и реестр пользователей для get_user/fetch_user.
+    """
+    def __init__(self, hub: FakeDiscord, users: Iterable[FakeUser] = ()):
+        self.hub = hub
+        self.users: Dict[int, FakeUser] = {user.id: user for user in users}
+        self.cached_user_ids: set = set(self.users)
+
+    def add_user(self, user: FakeUser, cached: bool = True):
+        self.users[user.id] = user
+        if cached:
+            self.cached_user_ids.add(user.id)
+
+    def get_user(self, user_id: int) -> Optional[FakeUser]:
+        return self.users.get(user_id) if user_id in self.cached_user_ids else None
+
+    async def fetch_user(self, user_id: int) -> FakeUser:
+        await self.hub.call()
+        user = self.users.get(user_id)
+        if not user:
+            raise _not_found()
+        return user
+
+    def get_channel(self, channel_id: int):
+        return None
+
+    def add_view(self, view, **kwargs):
+        pass
+
+
+def make_users(count: int, name_template: str = "sim_user_{}",
+               created_step: timedelta = timedelta(hours=7)) -> List[FakeUser]:
+    """Пользователи с именами как у симулятора Snag (sim_user_0, sim_user_1, ...)."""
+    base = datetime(2020, 1, 1, tzinfo=timezone.utc)
+    return [FakeUser(next(_user_ids), name_template.format(i), created_at=base + created_step * i) for i in range(count)]
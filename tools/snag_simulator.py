@@ -0,0 +1,537 @@
+# tools/snag_simulator.py
+"""
+Локальная замена Snag API (admin.snagsolutions.io) для нагрузочных тестов и бенчмарков.
+
+Запуск:
+    python -m tools.snag_simulator --port 8787 --latency 0.05 --error-rate 0.01 --rate-limit-rate 0.02
+
+и в .env бота:
+    SNAG_API_BASE_URL=http://127.0.0.1:8787
+
+Данные генерируются детерминированно из --seed: пользователи с метаданными, валюты, правила,
+история транзакций, балансы и бейджи. Пагинация повторяет Snag: limit + startingAfter (id
+последнего элемента) и флаг hasNextPage. Задержка, доля 5xx и 429 (случайные и по лимиту
+запросов в секунду) настраиваются флагами и меняются на лету через POST /_simulator/config.
+Счетчики запросов по эндпоинтам и статусам: GET /_simulator/stats.
+"""
+import argparse
+import asyncio
+import logging
+import os
+import random
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+MATCHSTICKS_CURRENCY_ID = os.getenv("MATCHSTICKS_CURRENCY_ID", "7f74ae35-a6e2-496a-83ea-5b2e18769560")
+API_KEY_HEADER = "X-API-KEY"
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+HISTORY_START = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+# Параметры, которые можно менять на лету через POST /_simulator/config
+RUNTIME_SETTINGS = ("latency", "latency_jitter", "error_rate", "rate_limit_rate", "max_rps", "retry_after")
+
+
+class SimulatorSettings:
+    """Размер набора данных и параметры внесения сбоев."""
+    def __init__(self, users: int = 500, rules: int = 300, max_entries_per_user: int = 400,
+                 max_badges_per_user: int = 30, latency: float = 0.05, latency_jitter: float = 0.02,
+                 error_rate: float = 0.0, rate_limit_rate: float = 0.0, max_rps: float = 0.0,
+                 retry_after: float = 1.0, api_key: Optional[str] = None, seed: int = 42,
+                 organization_id: str = "sim-organization", website_id: str = "sim-website"):
+        self.users = max(1, int(users))
+        self.rules = max(1, int(rules))
+        self.max_entries_per_user = max(0, int(max_entries_per_user))
+        self.max_badges_per_user = max(0, int(max_badges_per_user))
+        self.latency = max(0.0, float(latency))
+        self.latency_jitter = max(0.0, float(latency_jitter))
+        self.error_rate = min(1.0, max(0.0, float(error_rate)))
+        self.rate_limit_rate = min(1.0, max(0.0, float(rate_limit_rate)))
+        self.max_rps = max(0.0, float(max_rps))
+        self.retry_after = max(0.0, float(retry_after))
+        self.api_key = api_key
+        self.seed = int(seed)
+        self.organization_id = organization_id
+        self.website_id = website_id
+
+    def as_dict(self) -> Dict[str, Any]:
+        data = dict(vars(self))
+        data["api_key"] = bool(self.api_key)
+        return data
+
+
+def _uuid(rng: random.Random) -> str:
+    return str(uuid.UUID(int=rng.getrandbits(128), version=4))
+
+
+def _wallet(rng: random.Random) -> str:
+    return "0x" + format(rng.getrandbits(160), "040x")
+
+
+def _iso(moment: datetime) -> str:
+    return moment.strftime("%Y-%m-%dT%H:%M:%S.") + f"{moment.microsecond // 1000:03d}Z"
+
+
+def _flag(value: Optional[str]) -> Optional[bool]:
+    if value is None:
+        return None
+    return value.strip().lower() == "true"
+
+
+class SnagSimulator:
+    """Детерминированный набор данных Snag и aiohttp-приложение, которое его отдает."""
+
+    def __init__(self, settings: Optional[SimulatorSettings] = None):
+        self.settings = settings or SimulatorSettings()
+        self._runner: Optional[web.AppRunner] = None
+        self.base_url: Optional[str] = None
+        self.request_counts: Dict[str, Dict[str, int]] = {}
+        self._bucket_tokens = 0.0
+        self._bucket_updated_at = time.monotonic()
+        self._fault_rng = random.Random(self.settings.seed + 1)
+        self._build_dataset()
+
+    # --- Набор данных ---
+    def _build_dataset(self):
+        rng = random.Random(self.settings.seed)
+        self.currencies: List[Dict[str, Any]] = [
+            {"id": MATCHSTICKS_CURRENCY_ID, "name": "Matchsticks", "symbol": "MS", "decimals": 0, "deletedAt": None},
+            {"id": _uuid(rng), "name": "Stars", "symbol": "STAR", "decimals": 0, "deletedAt": None},
+            {"id": _uuid(rng), "name": "Old Points", "symbol": "OLD", "decimals": 0, "deletedAt": "2024-06-01T00:00:00.000Z"},
+        ]
+        active_currency_ids = [c["id"] for c in self.currencies if not c["deletedAt"]]
+
+        self.rules: List[Dict[str, Any]] = []
+        for i in range(self.settings.rules):
+            self.rules.append({
+                "id": _uuid(rng),
+                "name": f"Sim Quest #{i + 1}",
+                "description": f"Simulated quest number {i + 1}",
+                "amount": rng.choice([1, 5, 10, 25, 50, 100]),
+                "loyaltyCurrencyId": rng.choice(active_currency_ids),
+                "rewardType": rng.choice(["points", "points", "badge"]),
+                "isActive": rng.random() > 0.1,
+                "hideInUi": rng.random() < 0.05,
+                "deletedAt": "2024-09-01T00:00:00.000Z" if rng.random() < 0.03 else None,
+                "organizationId": self.settings.organization_id,
+                "websiteId": self.settings.website_id,
+                "startTime": _iso(HISTORY_START),
+                "endTime": None,
+            })
+        self._rules_by_id = {rule["id"]: rule for rule in self.rules}
+
+        self.users: List[Dict[str, Any]] = []
+        self._users_by_wallet: Dict[str, Dict[str, Any]] = {}
+        self._users_by_discord: Dict[str, Dict[str, Any]] = {}
+        self._users_by_twitter: Dict[str, Dict[str, Any]] = {}
+        self._users_by_id: Dict[str, Dict[str, Any]] = {}
+        for i in range(self.settings.users):
+            wallet = _wallet(rng)
+            metadata = {
+                "id": _uuid(rng),
+                "walletAddress": wallet,
+                "discordUser": f"sim_user_{i}",
+                "twitterUser": f"simtw{i}",
+                "telegramUserId": str(100000000 + i) if rng.random() < 0.3 else None,
+                "displayName": f"Sim User {i}",
+                "isBlocked": rng.random() < 0.02,
+            }
+            self._add_user({"id": _uuid(rng), "walletAddress": wallet, "createdAt": _iso(HISTORY_START), "userMetadata": [metadata]})
+
+        # История, балансы и бейджи строятся лениво для каждого кошелька
+        self._entries_by_wallet: Dict[str, List[Dict[str, Any]]] = {}
+        self._badges_by_wallet: Dict[str, List[Dict[str, Any]]] = {}
+        self._all_entries: Optional[List[Dict[str, Any]]] = None
+
+    def _add_user(self, user: Dict[str, Any]):
+        self.users.append(user)
+        self._users_by_wallet[user["walletAddress"].lower()] = user
+        self._users_by_id[user["id"]] = user
+        self._index_user_handles(user)
+
+    def _index_user_handles(self, user: Dict[str, Any]):
+        metadata = user["userMetadata"][0] if user["userMetadata"] else {}
+        if metadata.get("discordUser"):
+            self._users_by_discord[metadata["discordUser"].lower()] = user
+        if metadata.get("twitterUser"):
+            self._users_by_twitter[metadata["twitterUser"].lower()] = user
+
+    def _wallet_rng(self, wallet: str, salt: str) -> random.Random:
+        return random.Random(f"{self.settings.seed}:{salt}:{wallet}")
+
+    def _make_entry(self, rng: random.Random, wallet: str, created_at: datetime, rule: Optional[Dict[str, Any]],
+                    amount: Any, direction: str, currency_id: str, description: str) -> Dict[str, Any]:
+        return {
+            "id": _uuid(rng),
+            "amount": amount,
+            "direction": direction,
+            "loyaltyCurrencyId": currency_id,
+            "walletAddress": wallet,
+            "createdAt": _iso(created_at),
+            "description": description,
+            "loyaltyTransaction": {
+                "id": _uuid(rng),
+                "description": description,
+                "loyaltyRule": {"id": rule["id"], "name": rule["name"]} if rule else None,
+            },
+            "loyaltyAccount": {"user": {"walletAddress": wallet}},
+        }
+
+    def entries_for_wallet(self, wallet: str) -> List[Dict[str, Any]]:
+        """История кошелька, от новых к старым."""
+        wallet = wallet.lower()
+        entries = self._entries_by_wallet.get(wallet)
+        if entries is not None:
+            return entries
+        entries = []
+        if wallet in self._users_by_wallet and self.settings.max_entries_per_user:
+            rng = self._wallet_rng(wallet, "entries")
+            moment = HISTORY_START
+            for _ in range(rng.randint(0, self.settings.max_entries_per_user)):
+                moment += timedelta(seconds=rng.randint(60, 86400))
+                rule = rng.choice(self.rules)
+                if rng.random() < 0.1:
+                    entries.append(self._make_entry(rng, wallet, moment, None, rng.choice([5, 10, 20]), "debit",
+                                                    MATCHSTICKS_CURRENCY_ID, "Poker buy-in"))
+                else:
+                    entries.append(self._make_entry(rng, wallet, moment, rule, rule["amount"], "credit",
+                                                    rule["loyaltyCurrencyId"], rule["description"]))
+            entries.reverse()
+        self._entries_by_wallet[wallet] = entries
+        return entries
+
+    def generate_history(self, wallet: str, count: int) -> List[Dict[str, Any]]:
+        """Заменяет историю кошелька на `count` записей (для сценариев с очень длинной историей)."""
+        wallet = wallet.lower()
+        if wallet not in self._users_by_wallet:
+            raise KeyError(f"Unknown simulated wallet {wallet}")
+        rng = self._wallet_rng(wallet, f"history:{count}")
+        moment = HISTORY_START
+        entries = []
+        for _ in range(count):
+            moment += timedelta(seconds=rng.randint(1, 3600))
+            rule = rng.choice(self.rules)
+            entries.append(self._make_entry(rng, wallet, moment, rule, rule["amount"], "credit",
+                                            rule["loyaltyCurrencyId"], rule["description"]))
+        entries.reverse()
+        self._entries_by_wallet[wallet] = entries
+        self._all_entries = None
+        return entries
+
+    def all_entries(self) -> List[Dict[str, Any]]:
+        if self._all_entries is None:
+            merged = [entry for user in self.users for entry in self.entries_for_wallet(user["walletAddress"])]
+            merged.sort(key=lambda entry: entry["createdAt"], reverse=True)
+            self._all_entries = merged
+        return self._all_entries
+
+    def accounts_for_wallet(self, wallet: str) -> List[Dict[str, Any]]:
+        user = self._users_by_wallet.get(wallet.lower())
+        if not user:
+            return []
+        balances: Dict[str, float] = {}
+        for entry in self.entries_for_wallet(wallet):
+            sign = 1 if entry["direction"] == "credit" else -1
+            balances[entry["loyaltyCurrencyId"]] = balances.get(entry["loyaltyCurrencyId"], 0) + sign * float(entry["amount"])
+        return [
+            {
+                "id": str(uuid.uuid5(uuid.NAMESPACE_URL, f"{user['walletAddress']}:{currency_id}")),
+                "amount": int(amount) if float(amount).is_integer() else amount,
+                "loyaltyCurrencyId": currency_id,
+                "user": {"id": user["id"], "walletAddress": user["walletAddress"]},
+            }
+            for currency_id, amount in balances.items()
+        ]
+
+    def badges_for_wallet(self, wallet: str) -> List[Dict[str, Any]]:
+        wallet = wallet.lower()
+        badges = self._badges_by_wallet.get(wallet)
+        if badges is not None:
+            return badges
+        badges = []
+        if wallet in self._users_by_wallet and self.settings.max_badges_per_user:
+            rng = self._wallet_rng(wallet, "badges")
+            for i in range(rng.randint(0, self.settings.max_badges_per_user)):
+                badges.append({
+                    "id": _uuid(rng),
+                    "name": f"Sim Badge {i + 1}",
+                    "description": f"Simulated badge {i + 1}",
+                    "imageUrl": f"https://example.invalid/badges/{i + 1}.png",
+                    "deletedAt": None,
+                })
+        self._badges_by_wallet[wallet] = badges
+        return badges
+
+    # --- Пагинация ---
+    @staticmethod
+    def _paginate(items: List[Dict[str, Any]], query) -> Dict[str, Any]:
+        try:
+            limit = int(query.get("limit", DEFAULT_PAGE_SIZE))
+        except ValueError:
+            raise web.HTTPBadRequest(text='{"message": "limit must be an integer"}', content_type="application/json")
+        limit = min(MAX_PAGE_SIZE, max(1, limit))
+        start = 0
+        cursor = query.get("startingAfter")
+        if cursor:
+            position = next((i for i, item in enumerate(items) if item.get("id") == cursor), None)
+            if position is None:
+                raise web.HTTPBadRequest(text='{"message": "Unknown startingAfter cursor"}', content_type="application/json")
+            start = position + 1
+        page = items[start:start + limit]
+        return {"data": page, "hasNextPage": start + limit < len(items)}
+
+    # --- Обработчики эндпоинтов ---
+    async def handle_users(self, request: web.Request) -> web.Response:
+        query = request.query
+        user = None
+        if query.get("walletAddress"):
+            user = self._users_by_wallet.get(query["walletAddress"].lower())
+        elif query.get("discordUser"):
+            user = self._users_by_discord.get(query["discordUser"].lower())
+        elif query.get("twitterUser"):
+            user = self._users_by_twitter.get(query["twitterUser"].lower())
+        elif query.get("userId"):
+            user = self._users_by_id.get(query["userId"])
+        else:
+            return web.json_response(self._paginate(self.users, query))
+        return web.json_response({"data": [user] if user else [], "hasNextPage": False})
+
+    async def handle_user_metadatas(self, request: web.Request) -> web.Response:
+        payload = await request.json()
+        wallet = str(payload.get("walletAddress") or "").lower()
+        if not wallet:
+            return web.json_response({"message": "walletAddress is required"}, status=400)
+        user = self._users_by_wallet.get(wallet)
+        if not user:
+            rng = self._wallet_rng(wallet, "user")
+            user = {"id": _uuid(rng), "walletAddress": wallet, "createdAt": _iso(datetime.now(timezone.utc)),
+                    "userMetadata": [{"id": _uuid(rng), "walletAddress": wallet}]}
+            self._add_user(user)
+            self._all_entries = None
+        metadata = user["userMetadata"][0]
+        metadata.update({key: value for key, value in payload.items() if key not in ("walletAddress", "organizationId", "websiteId")})
+        self._index_user_handles(user)
+        return web.json_response(metadata)
+
+    async def handle_accounts(self, request: web.Request) -> web.Response:
+        wallet = request.query.get("walletAddress")
+        if not wallet:
+            return web.json_response({"message": "walletAddress is required"}, status=400)
+        return web.json_response(self._paginate(self.accounts_for_wallet(wallet), request.query))
+
+    async def handle_transaction_entries(self, request: web.Request) -> web.Response:
+        query = request.query
+        entries = self.entries_for_wallet(query["walletAddress"]) if query.get("walletAddress") else self.all_entries()
+        rule_id = query.get("loyaltyRuleId")
+        direction = query.get("direction")
+        if rule_id or direction:
+            entries = [
+                entry for entry in entries
+                if (not rule_id or (entry["loyaltyTransaction"]["loyaltyRule"] or {}).get("id") == rule_id)
+                and (not direction or entry["direction"] == direction)
+            ]
+        return web.json_response(self._paginate(entries, query))
+
+    async def handle_transactions(self, request: web.Request) -> web.Response:
+        payload = await request.json()
+        entries_in = payload.get("entries")
+        if not isinstance(entries_in, list) or not entries_in:
+            return web.json_response({"message": "entries must be a non-empty list"}, status=400)
+        rng = random.Random()
+        now = datetime.now(timezone.utc)
+        created = []
+        for entry_in in entries_in:
+            wallet = str(entry_in.get("walletAddress") or "").lower()
+            if wallet not in self._users_by_wallet:
+                return web.json_response({"message": f"Unknown walletAddress {wallet}"}, status=404)
+            rule = self._rules_by_id.get(entry_in.get("loyaltyRuleId"))
+            entry = self._make_entry(rng, wallet, now, rule, entry_in.get("amount", 0), entry_in.get("direction", "credit"),
+                                     entry_in.get("loyaltyCurrencyId") or MATCHSTICKS_CURRENCY_ID,
+                                     payload.get("description") or entry_in.get("description") or "Manual adjustment")
+            self.entries_for_wallet(wallet).insert(0, entry)
+            created.append(entry)
+        self._all_entries = None
+        return web.json_response({"id": _uuid(rng), "description": payload.get("description"), "entries": created})
+
+    async def handle_rules(self, request: web.Request) -> web.Response:
+        query = request.query
+        rules = self.rules
+        rule_id = query.get("loyaltyRuleId")
+        organization_id = query.get("organizationId")
+        website_id = query.get("websiteId")
+        include_deleted = _flag(query.get("includeDeleted")) or False
+        is_active = _flag(query.get("isActive"))
+        hide_in_ui = _flag(query.get("hideInUi"))
+        rules = [
+            rule for rule in rules
+            if (not rule_id or rule["id"] == rule_id)
+            and (not organization_id or rule["organizationId"] == organization_id)
+            and (not website_id or rule["websiteId"] == website_id)
+            and (include_deleted or not rule["deletedAt"])
+            and (is_active is None or rule["isActive"] == is_active)
+            and (hide_in_ui is None or rule["hideInUi"] == hide_in_ui)
+        ]
+        return web.json_response(self._paginate(rules, query))
+
+    async def handle_rule_update(self, request: web.Request) -> web.Response:
+        rule = self._rules_by_id.get(request.match_info["rule_id"])
+        if not rule:
+            return web.json_response({"message": "Rule not found"}, status=404)
+        payload = await request.json()
+        rule.update({key: value for key, value in payload.items() if key != "id"})
+        return web.json_response(rule)
+
+    async def handle_rule_complete(self, request: web.Request) -> web.Response:
+        if request.match_info["rule_id"] not in self._rules_by_id:
+            return web.json_response({"message": "Rule not found"}, status=404)
+        return web.json_response({"success": True, "message": "Completion queued"})
+
+    async def handle_badges(self, request: web.Request) -> web.Response:
+        wallet = request.query.get("walletAddress")
+        if not wallet:
+            return web.json_response({"message": "walletAddress is required"}, status=400)
+        return web.json_response(self._paginate(self.badges_for_wallet(wallet), request.query))
+
+    async def handle_badge_reward(self, request: web.Request) -> web.Response:
+        return web.json_response({"success": True})
+
+    async def handle_currencies(self, request: web.Request) -> web.Response:
+        include_deleted = _flag(request.query.get("includeDeleted"))
+        currencies = [c for c in self.currencies if include_deleted or not c["deletedAt"]]
+        return web.json_response(self._paginate(currencies, request.query))
+
+    async def handle_stats(self, request: web.Request) -> web.Response:
+        return web.json_response({"settings": self.settings.as_dict(), "requests": self.request_counts})
+
+    async def handle_config(self, request: web.Request) -> web.Response:
+        payload = await request.json()
+        for key in RUNTIME_SETTINGS:
+            if key in payload:
+                setattr(self.settings, key, max(0.0, float(payload[key])))
+        logger.info(f"SnagSimulator: runtime settings updated: {payload}")
+        return web.json_response(self.settings.as_dict())
+
+    # --- Внесение сбоев ---
+    def _count(self, route: str, status: int):
+        per_route = self.request_counts.setdefault(route, {})
+        per_route[str(status)] = per_route.get(str(status), 0) + 1
+
+    def _over_rate_limit(self) -> bool:
+        if not self.settings.max_rps:
+            return False
+        now = time.monotonic()
+        capacity = max(1.0, self.settings.max_rps)
+        self._bucket_tokens = min(capacity, self._bucket_tokens + (now - self._bucket_updated_at) * self.settings.max_rps)
+        self._bucket_updated_at = now
+        if self._bucket_tokens < 1.0:
+            return True
+        self._bucket_tokens -= 1.0
+        return False
+
+    @web.middleware
+    async def _fault_middleware(self, request: web.Request, handler):
+        route = request.match_info.route.resource.canonical if request.match_info.route.resource else request.path
+        if route.startswith("/_simulator"):
+            return await handler(request)
+        settings = self.settings
+        if settings.api_key and request.headers.get(API_KEY_HEADER) != settings.api_key:
+            self._count(route, 401)
+            return web.json_response({"message": "Invalid API key"}, status=401)
+        if self._over_rate_limit() or self._fault_rng.random() < settings.rate_limit_rate:
+            self._count(route, 429)
+            return web.json_response({"message": "Too Many Requests"}, status=429,
+                                     headers={"Retry-After": f"{settings.retry_after:g}"})
+        delay = settings.latency + (self._fault_rng.uniform(-1.0, 1.0) * settings.latency_jitter)
+        if delay > 0:
+            await asyncio.sleep(delay)
+        if self._fault_rng.random() < settings.error_rate:
+            status = self._fault_rng.choice([500, 502, 503, 504])
+            self._count(route, status)
+            return web.json_response({"message": "Simulated upstream error"}, status=status)
+        try:
+            response = await handler(request)
+        except web.HTTPException as e:
+            self._count(route, e.status)
+            raise
+        self._count(route, response.status)
+        return response
+
+    def make_app(self) -> web.Application:
+        app = web.Application(middlewares=[self._fault_middleware])
+        app.router.add_get("/api/users", self.handle_users)
+        app.router.add_post("/api/users/metadatas", self.handle_user_metadatas)
+        app.router.add_get("/api/loyalty/accounts", self.handle_accounts)
+        app.router.add_get("/api/loyalty/transaction_entries", self.handle_transaction_entries)
+        app.router.add_post("/api/loyalty/transactions", self.handle_transactions)
+        app.router.add_get("/api/loyalty/rules", self.handle_rules)
+        app.router.add_post("/api/loyalty/rules/{rule_id}", self.handle_rule_update)
+        app.router.add_post("/api/loyalty/rules/{rule_id}/complete", self.handle_rule_complete)
+        app.router.add_get("/api/loyalty/badges", self.handle_badges)
+        app.router.add_post("/api/loyalty/badges/{badge_id}/reward", self.handle_badge_reward)
+        app.router.add_get("/api/loyalty/currencies", self.handle_currencies)
+        app.router.add_get("/_simulator/stats", self.handle_stats)
+        app.router.add_post("/_simulator/config", self.handle_config)
+        return app
+
+    # --- Запуск внутри чужого event loop (бенчмарки) ---
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        """Запускает сервер и возвращает base URL. port=0 - любой свободный порт."""
+        self._runner = web.AppRunner(self.make_app(), access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        bound_port = site._server.sockets[0].getsockname()[1]
+        self.base_url = f"http://{host}:{bound_port}"
+        logger.info(f"SnagSimulator listening on {self.base_url} ({len(self.users)} users, {len(self.rules)} rules).")
+        return self.base_url
+
+    async def stop(self):
+        if self._runner:
+            await self._runner.cleanup()
+            self._runner = None
+
+
+def _parse_args(argv: Optional[List[str]] = None) -> Tuple[argparse.Namespace, SimulatorSettings]:
+    parser = argparse.ArgumentParser(description="Offline Snag API simulator for load testing.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8787)
+    parser.add_argument("--users", type=int, default=500)
+    parser.add_argument("--rules", type=int, default=300)
+    parser.add_argument("--max-entries-per-user", type=int, default=400)
+    parser.add_argument("--max-badges-per-user", type=int, default=30)
+    parser.add_argument("--latency", type=float, default=0.05, help="Base response latency, seconds.")
+    parser.add_argument("--latency-jitter", type=float, default=0.02, help="Uniform +/- jitter, seconds.")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of requests answered with 5xx.")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="Share of requests answered with 429.")
+    parser.add_argument("--max-rps", type=float, default=0.0, help="Answer 429 above this many requests per second (0 = off).")
+    parser.add_argument("--retry-after", type=float, default=1.0, help="Retry-After value sent with 429, seconds.")
+    parser.add_argument("--api-key", default=None, help="Require this X-API-KEY (default: accept any).")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args(argv)
+    settings = SimulatorSettings(
+        users=args.users, rules=args.rules, max_entries_per_user=args.max_entries_per_user,
+        max_badges_per_user=args.max_badges_per_user, latency=args.latency, latency_jitter=args.latency_jitter,
+        error_rate=args.error_rate, rate_limit_rate=args.rate_limit_rate, max_rps=args.max_rps,
+        retry_after=args.retry_after, api_key=args.api_key, seed=args.seed,
+    )
+    return args, settings
+
+
+def main(argv: Optional[List[str]] = None):
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    args, settings = _parse_args(argv)
+    simulator = SnagSimulator(settings)
+    sample = simulator.users[0]
+    logger.info(f"Sample user: wallet {sample['walletAddress']}, discord {sample['userMetadata'][0]['discordUser']}")
+    logger.info(f"Point the bot at it with SNAG_API_BASE_URL=http://{args.host}:{args.port}")
+    web.run_app(simulator.make_app(), host=args.host, port=args.port, access_log=None, print=None)
+
+
+if __name__ == "__main__":
+    main()
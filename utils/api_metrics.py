@@ -0,0 +1,249 @@
+# utils/api_metrics.py
+import re
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+# Границы корзин гистограммы задержек (секунды), как у Prometheus histogram
+LATENCY_BUCKETS: Tuple[float, ...] = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Сегменты пути, похожие на ID (UUID, числа), заменяются на {id}, чтобы не плодить метки
+_ID_SEGMENT_PATTERN = re.compile(r"^(?:[0-9a-fA-F-]{8,}|\d+)$")
+
+CIRCUIT_STATE_VALUES = {"closed": 0, "half-open": 1, "open": 2}
+
+
+def endpoint_label(endpoint: str) -> str:
+    """/api/loyalty/rules/<uuid>/complete -> /api/loyalty/rules/{id}/complete"""
+    path = endpoint.split('?', 1)[0]
+    return "/".join("{id}" if _ID_SEGMENT_PATTERN.match(segment) else segment for segment in path.split('/'))
+
+
+class EndpointMetrics:
+    """Счетчики одного эндпоинта одного клиента (метод + путь)."""
+    __slots__ = ("requests", "statuses", "bucket_counts", "latency_sum", "bytes_received",
+                 "retries", "cache_hits", "cache_misses", "coalesced", "circuit_rejections")
+
+    def __init__(self):
+        self.requests = 0
+        self.statuses: Dict[str, int] = {}
+        self.bucket_counts: List[int] = [0] * (len(LATENCY_BUCKETS) + 1)  # последняя корзина - +Inf
+        self.latency_sum = 0.0
+        self.bytes_received = 0
+        self.retries = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.coalesced = 0
+        self.circuit_rejections = 0
+
+    def observe(self, status: Any, duration: float, bytes_received: int):
+        self.requests += 1
+        status_key = str(status)
+        self.statuses[status_key] = self.statuses.get(status_key, 0) + 1
+        self.latency_sum += duration
+        self.bytes_received += bytes_received
+        for index, upper_bound in enumerate(LATENCY_BUCKETS):
+            if duration <= upper_bound:
+                self.bucket_counts[index] += 1
+                return
+        self.bucket_counts[-1] += 1
+
+    @property
+    def errors(self) -> int:
+        return sum(count for status, count in self.statuses.items() if not status.startswith("2"))
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Оценка квантиля по гистограмме (линейная интерполяция внутри корзины), в секундах."""
+        if not self.requests:
+            return None
+        rank = q * self.requests
+        cumulative = 0
+        lower_bound = 0.0
+        for index, count in enumerate(self.bucket_counts):
+            upper_bound = LATENCY_BUCKETS[index] if index < len(LATENCY_BUCKETS) else None
+            if count and cumulative + count >= rank:
+                if upper_bound is None:
+                    return lower_bound  # дальше последней границы оценить нельзя
+                return lower_bound + (upper_bound - lower_bound) * ((rank - cumulative) / count)
+            cumulative += count
+            if upper_bound is not None:
+                lower_bound = upper_bound
+        return lower_bound
+
+
+class ApiMetrics:
+    """
+    Метрики SnagApiClient по эндпоинтам: число запросов, коды ответов, гистограмма задержек,
+    полученные байты, повторы, попадания в кэш, объединенные запросы и отказы circuit breaker'а.
+    Задержка считается от получения слота соединения до прочтения тела ответа (без ожидания в очереди).
+    """
+    def __init__(self, client_name: str):
+        self.client_name = client_name
+        self.started_at = time.time()
+        self._endpoints: Dict[Tuple[str, str], EndpointMetrics] = {}
+
+    def endpoint(self, method: str, endpoint: str) -> EndpointMetrics:
+        key = (method.upper(), endpoint_label(endpoint))
+        metrics = self._endpoints.get(key)
+        if metrics is None:
+            metrics = EndpointMetrics()
+            self._endpoints[key] = metrics
+        return metrics
+
+    def record_response(self, method: str, endpoint: str, status: Any, duration: float, bytes_received: int = 0):
+        self.endpoint(method, endpoint).observe(status, duration, bytes_received)
+
+    def record_retry(self, method: str, endpoint: str):
+        self.endpoint(method, endpoint).retries += 1
+
+    def record_cache(self, endpoint: str, hit: bool):
+        metrics = self.endpoint("GET", endpoint)
+        if hit:
+            metrics.cache_hits += 1
+        else:
+            metrics.cache_misses += 1
+
+    def record_coalesced(self, endpoint: str):
+        self.endpoint("GET", endpoint).coalesced += 1
+
+    def record_circuit_rejection(self, method: str, endpoint: str):
+        self.endpoint(method, endpoint).circuit_rejections += 1
+
+    def items(self) -> List[Tuple[Tuple[str, str], EndpointMetrics]]:
+        return sorted(self._endpoints.items())
+
+    def summary(self) -> List[Dict[str, Any]]:
+        """Сводка по эндпоинтам для !snagstats, от самых нагруженных к менее нагруженным."""
+        rows = []
+        for (method, endpoint), metrics in self._endpoints.items():
+            rows.append({
+                "method": method,
+                "endpoint": endpoint,
+                "requests": metrics.requests,
+                "errors": metrics.errors,
+                "statuses": dict(metrics.statuses),
+                "avg_latency": (metrics.latency_sum / metrics.requests) if metrics.requests else None,
+                "p50_latency": metrics.quantile(0.5),
+                "p95_latency": metrics.quantile(0.95),
+                "bytes_received": metrics.bytes_received,
+                "retries": metrics.retries,
+                "cache_hits": metrics.cache_hits,
+                "cache_misses": metrics.cache_misses,
+                "coalesced": metrics.coalesced,
+                "circuit_rejections": metrics.circuit_rejections,
+            })
+        rows.sort(key=lambda row: (row["requests"] + row["cache_hits"] + row["coalesced"]), reverse=True)
+        return rows
+
+
+# Семейства метрик Prometheus: имя -> (тип, описание)
+METRIC_FAMILIES: Dict[str, Tuple[str, str]] = {
+    "snag_api_requests_total": ("counter", "Snag API responses by status (including transport errors)."),
+    "snag_api_request_duration_seconds": ("histogram", "Snag API request latency (slot acquired to body read)."),
+    "snag_api_response_bytes_total": ("counter", "Bytes of Snag API response bodies received."),
+    "snag_api_retries_total": ("counter", "Snag API request retries."),
+    "snag_api_circuit_rejections_total": ("counter", "Requests rejected by an open circuit breaker."),
+    "snag_api_cache_lookups_total": ("counter", "Response cache lookups by result."),
+    "snag_api_coalesced_requests_total": ("counter", "GET requests served by joining an identical in-flight request."),
+    "snag_api_cache_entries": ("gauge", "Entries in the response cache."),
+    "snag_api_cache_evictions_total": ("counter", "Response cache evictions."),
+    "snag_api_active_requests": ("gauge", "Requests holding a connection slot."),
+    "snag_api_queued_requests": ("gauge", "Requests waiting for a connection slot or rate limit token."),
+    "snag_api_circuit_state": ("gauge", "Circuit breaker state: 0 closed, 1 half-open, 2 open."),
+}
+
+
+# --- Prometheus text format ---
+def _escape_label(value: Any) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(**labels: Any) -> str:
+    return "{" + ",".join(f'{key}="{_escape_label(value)}"' for key, value in labels.items()) + "}"
+
+
+def _format_bound(bound: float) -> str:
+    return f"{bound:g}"
+
+
+def render_prometheus(clients: Iterable[Any]) -> str:
+    """
+    Метрики всех клиентов в текстовом формате Prometheus (exposition format 0.0.4).
+    Клиенты - объекты SnagApiClient (или совместимые: metrics, cache_stats, scheduler_stats, circuit_states).
+    """
+    families: Dict[str, List[str]] = {}
+
+    def add(name: str, line: str):
+        families.setdefault(name, []).append(line)
+
+    for client in clients:
+        metrics: Optional[ApiMetrics] = getattr(client, "metrics", None)
+        if metrics is None:
+            continue
+        client_name = metrics.client_name
+        for (method, endpoint), m in metrics.items():
+            base = dict(client=client_name, method=method, endpoint=endpoint)
+            for status, count in sorted(m.statuses.items()):
+                add("snag_api_requests_total", f"snag_api_requests_total{_labels(**base, status=status)} {count}")
+            cumulative = 0
+            for index, upper_bound in enumerate(LATENCY_BUCKETS):
+                cumulative += m.bucket_counts[index]
+                add("snag_api_request_duration_seconds", f"snag_api_request_duration_seconds_bucket{_labels(**base, le=_format_bound(upper_bound))} {cumulative}")
+            add("snag_api_request_duration_seconds", f"snag_api_request_duration_seconds_bucket{_labels(**base, le='+Inf')} {m.requests}")
+            add("snag_api_request_duration_seconds", f"snag_api_request_duration_seconds_sum{_labels(**base)} {m.latency_sum:.6f}")
+            add("snag_api_request_duration_seconds", f"snag_api_request_duration_seconds_count{_labels(**base)} {m.requests}")
+            add("snag_api_response_bytes_total", f"snag_api_response_bytes_total{_labels(**base)} {m.bytes_received}")
+            add("snag_api_retries_total", f"snag_api_retries_total{_labels(**base)} {m.retries}")
+            add("snag_api_circuit_rejections_total", f"snag_api_circuit_rejections_total{_labels(**base)} {m.circuit_rejections}")
+            if method == "GET":
+                add("snag_api_cache_lookups_total", f"snag_api_cache_lookups_total{_labels(client=client_name, endpoint=endpoint, result='hit')} {m.cache_hits}")
+                add("snag_api_cache_lookups_total", f"snag_api_cache_lookups_total{_labels(client=client_name, endpoint=endpoint, result='miss')} {m.cache_misses}")
+                add("snag_api_coalesced_requests_total", f"snag_api_coalesced_requests_total{_labels(client=client_name, endpoint=endpoint)} {m.coalesced}")
+
+        cache_stats = client.cache_stats() if hasattr(client, "cache_stats") else None
+        if cache_stats:
+            add("snag_api_cache_entries", f"snag_api_cache_entries{_labels(client=client_name)} {cache_stats.get('entries', 0)}")
+            add("snag_api_cache_evictions_total", f"snag_api_cache_evictions_total{_labels(client=client_name)} {cache_stats.get('evictions', 0)}")
+
+        scheduler = client.scheduler_stats() if hasattr(client, "scheduler_stats") else {}
+        slots = scheduler.get("slots") if scheduler else None
+        if slots:
+            for lane in ("interactive", "bulk"):
+                lane_stats = slots.get(lane) or {}
+                add("snag_api_active_requests", f"snag_api_active_requests{_labels(client=client_name, lane=lane)} {lane_stats.get('active', 0)}")
+                add("snag_api_queued_requests", f"snag_api_queued_requests{_labels(client=client_name, lane=lane, stage='slots')} {lane_stats.get('queued', 0)}")
+        for bucket_name, waiting in ((scheduler or {}).get("rate_limit_queues") or {}).items():
+            for lane, count in waiting.items():
+                add("snag_api_queued_requests", f"snag_api_queued_requests{_labels(client=client_name, lane=lane, stage=f'rate_limit:{bucket_name}')} {count}")
+
+        circuit_states = client.circuit_states() if hasattr(client, "circuit_states") else {}
+        for endpoint, info in circuit_states.items():
+            add("snag_api_circuit_state", f"snag_api_circuit_state{_labels(client=client_name, endpoint=endpoint)} {CIRCUIT_STATE_VALUES.get(info['state'], -1)}")
+
+    lines: List[str] = []
+    for name, samples in families.items():
+        metric_type, help_text = METRIC_FAMILIES[name]
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {metric_type}")
+        lines.extend(samples)
+    return "\n".join(lines) + "\n"
+
+
+async def start_metrics_server(clients_provider: Callable[[], Iterable[Any]], host: str, port: int):
+    """
+    Поднимает локальный HTTP-эндпоинт GET /metrics в текстовом формате Prometheus.
+    clients_provider вызывается на каждый запрос, чтобы отдавать текущий набор клиентов.
+    Возвращает aiohttp AppRunner; остановка - `await runner.cleanup()`.
+    """
+    from aiohttp import web
+
+    async def handle_metrics(request: web.Request) -> web.Response:
+        return web.Response(text=render_prometheus(clients_provider()),
+                            content_type="text/plain", charset="utf-8",
+                            headers={"X-Content-Type-Options": "nosniff"})
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle_metrics)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
@@ -0,0 +1,82 @@
+# utils/circuit_breaker.py
+import logging
+import time
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+STATE_CLOSED = "closed"
+STATE_OPEN = "open"
+STATE_HALF_OPEN = "half-open"
+
+
+class CircuitBreaker:
+    """
+    Автомат "closed -> open -> half-open" для одного эндпоинта одного клиента.
+
+    После `failure_threshold` сбоев подряд запросы отклоняются сразу (open) в течение
+    `recovery_timeout` секунд. Затем пропускается одна пробная попытка (half-open):
+    успех закрывает автомат, сбой снова открывает его. Пробная попытка, не сообщившая
+    результат (например, отмененная), через `recovery_timeout` уступает место новой.
+    """
+    def __init__(self, name: str, failure_threshold: int = 5, recovery_timeout: float = 30.0):
+        self.name = name
+        self.failure_threshold = max(1, int(failure_threshold))
+        self.recovery_timeout = max(0.0, float(recovery_timeout))
+        self._state = STATE_CLOSED
+        self._consecutive_failures = 0
+        self._opened_at = 0.0
+        self._probe_started_at: Optional[float] = None
+        self.rejected_requests = 0
+        self.times_opened = 0
+
+    @property
+    def state(self) -> str:
+        if self._state == STATE_OPEN and time.monotonic() - self._opened_at >= self.recovery_timeout:
+            self._state = STATE_HALF_OPEN
+            self._probe_started_at = None
+            logger.info(f"CircuitBreaker [{self.name}]: recovery timeout passed, HALF-OPEN (next request is a probe).")
+        return self._state
+
+    @property
+    def consecutive_failures(self) -> int:
+        return self._consecutive_failures
+
+    def retry_in(self) -> float:
+        """Через сколько секунд автомат пропустит следующую попытку."""
+        now = time.monotonic()
+        state = self.state
+        if state == STATE_OPEN:
+            return max(0.0, self.recovery_timeout - (now - self._opened_at))
+        if state == STATE_HALF_OPEN and self._probe_started_at is not None:
+            return max(0.0, self.recovery_timeout - (now - self._probe_started_at))
+        return 0.0
+
+    def allow_request(self) -> bool:
+        state = self.state
+        if state == STATE_CLOSED:
+            return True
+        if state == STATE_HALF_OPEN:
+            now = time.monotonic()
+            if self._probe_started_at is None or now - self._probe_started_at >= self.recovery_timeout:
+                self._probe_started_at = now
+                return True
+        self.rejected_requests += 1
+        return False
+
+    def record_success(self):
+        if self._state != STATE_CLOSED:
+            logger.info(f"CircuitBreaker [{self.name}]: probe succeeded, CLOSED.")
+        self._state = STATE_CLOSED
+        self._consecutive_failures = 0
+        self._probe_started_at = None
+
+    def record_failure(self):
+        self._consecutive_failures += 1
+        if self._state == STATE_HALF_OPEN or (self._state == STATE_CLOSED and self._consecutive_failures >= self.failure_threshold):
+            reason = "probe failed" if self._state == STATE_HALF_OPEN else f"{self._consecutive_failures} consecutive failures"
+            self._state = STATE_OPEN
+            self._opened_at = time.monotonic()
+            self._probe_started_at = None
+            self.times_opened += 1
+            logger.warning(f"CircuitBreaker [{self.name}]: OPEN ({reason}). Failing fast for {self.recovery_timeout:g}s.")
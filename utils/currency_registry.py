@@ -0,0 +1,134 @@
+# utils/currency_registry.py
+import asyncio
+import logging
+import time
+from typing import Any, Dict, Optional, Set
+
+from utils.priority_scheduler import PRIORITY_BULK
+
+logger = logging.getLogger(__name__)
+
+# Пауза перед повторной загрузкой после ошибки (если refresh_interval больше)
+RETRY_AFTER_ERROR = 60.0
+
+
+class CurrencyRegistry:
+    """
+    Общий для бота справочник валют лояльности одной системы (включая удаленные).
+
+    Загружается при старте и обновляется в фоне каждые `refresh_interval` секунд. Чтение
+    никогда не ждет API: отдается текущий снимок, а если он устарел (или еще не загружен),
+    обновление запускается в фоне (stale-while-revalidate). Пока валюты нет в справочнике,
+    вместо имени показывается сокращенный ID или переданное имя по умолчанию.
+    """
+    def __init__(self, client, refresh_interval: float = 1800.0, page_size: int = 1000,
+                 priority: int = PRIORITY_BULK):
+        self.client = client
+        self.refresh_interval = max(0.0, float(refresh_interval))
+        self.page_size = page_size
+        self.priority = priority
+        self.loaded_at: Optional[float] = None   # time.monotonic() последнего успешного обновления
+        self.last_error: Optional[str] = None
+        self._failed_at: Optional[float] = None
+        self._currencies: Dict[str, Dict[str, Any]] = {}
+        self._refresh_lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self._background_tasks: Set[asyncio.Task] = set()
+
+    @property
+    def loaded(self) -> bool:
+        return self.loaded_at is not None
+
+    def _is_stale(self) -> bool:
+        if self.loaded_at is None:
+            return True
+        return self.refresh_interval > 0 and time.monotonic() - self.loaded_at >= self.refresh_interval
+
+    # --- Чтение (без ожидания API) ---
+    def get(self, currency_id: Optional[str]) -> Optional[Dict[str, Any]]:
+        if self._is_stale():
+            self._schedule_refresh()
+        return self._currencies.get(currency_id) if currency_id else None
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        if self._is_stale():
+            self._schedule_refresh()
+        return dict(self._currencies)
+
+    def name(self, currency_id: Optional[str], default: Optional[str] = None) -> str:
+        """Имя валюты; если ее нет в справочнике - `default` или сокращенный ID."""
+        currency = self.get(currency_id)
+        if currency and currency.get("name"):
+            return currency["name"]
+        return default or f"Currency ID: {(currency_id or 'N/A')[:8]}"
+
+    def display_name(self, currency_id: Optional[str]) -> str:
+        """Имя с символом и пометкой об удалении, для списков балансов."""
+        currency = self.get(currency_id)
+        if not currency:
+            return f"Currency ID: {currency_id} (Not in map)"
+        currency_name = currency.get("name", f"Unknown Currency (ID: {(currency_id or '')[:8]})")
+        currency_symbol = currency.get("symbol", "")
+        display_name = f"{currency_name} ({currency_symbol})" if currency_symbol else currency_name
+        if currency.get("deletedAt"):
+            display_name += " (Deleted Currency)"
+        return display_name
+
+    def is_deleted(self, currency_id: Optional[str]) -> Optional[bool]:
+        """True/False по справочнику; None - валюта неизвестна (справочник не загружен или ее нет)."""
+        currency = self.get(currency_id)
+        return bool(currency.get("deletedAt")) if currency else None
+
+    # --- Обновление ---
+    async def refresh(self) -> bool:
+        async with self._refresh_lock:
+            response = await self.client.get_currencies(limit=self.page_size, include_deleted=True, priority=self.priority)
+            if not isinstance(response, dict) or response.get("error") or not isinstance(response.get("data"), list):
+                self.last_error = response.get("message") if isinstance(response, dict) else "No API response."
+                self._failed_at = time.monotonic()
+                logger.error(f"CurrencyRegistry: failed to refresh currencies: {self.last_error}")
+                return False
+            self._currencies = {c["id"]: c for c in response["data"] if isinstance(c, dict) and c.get("id")}
+            self.loaded_at = time.monotonic()
+            self.last_error = None
+            self._failed_at = None
+            logger.info(f"CurrencyRegistry: {len(self._currencies)} currencies loaded.")
+            return True
+
+    def _schedule_refresh(self):
+        # Одно фоновое обновление за раз; пока идет загрузка по расписанию, отдельное не нужно
+        if self._refresh_lock.locked() or self._background_tasks:
+            return
+        # После ошибки не повторяем запрос на каждое чтение
+        if self._failed_at is not None and time.monotonic() - self._failed_at < RETRY_AFTER_ERROR:
+            return
+        try:
+            task = asyncio.get_running_loop().create_task(self.refresh())
+        except RuntimeError:
+            return  # Вне event loop обновлять некому: загрузится при start()
+        self._background_tasks.add(task)
+        task.add_done_callback(self._background_tasks.discard)
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._refresh_loop())
+
+    async def _refresh_loop(self):
+        while True:
+            try:
+                success = await self.refresh()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"CurrencyRegistry: background refresh failed: {e}", exc_info=True)
+                success = False
+            if self.refresh_interval <= 0:
+                return
+            await asyncio.sleep(self.refresh_interval if success else min(self.refresh_interval, RETRY_AFTER_ERROR))
+
+    async def close(self):
+        tasks = [task for task in (self._task, *self._background_tasks) if task and not task.done()]
+        for task in tasks:
+            task.cancel()
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
@@ -0,0 +1,84 @@
+# utils/history_export.py
+import asyncio
+import csv
+import gzip
+import io
+import json
+import logging
+from typing import Any, Awaitable, BinaryIO, Callable, Dict, List, Optional
+
+from utils.snag_api_client import SnagPageIterator
+
+logger = logging.getLogger(__name__)
+
+EXPORT_FORMATS = ("csv", "ndjson")
+
+CSV_COLUMNS = [
+    "id", "createdAt", "direction", "amount", "loyaltyCurrencyId", "currencyName",
+    "loyaltyRuleId", "loyaltyRuleName", "loyaltyTransactionId", "description",
+]
+
+ProgressCallback = Callable[[int, int], Awaitable[None]]
+
+
+class ExportResult:
+    """Итог выгрузки: сколько записей и страниц записано, размер сжатого файла и ошибка API, если была."""
+    __slots__ = ("entries", "pages", "compressed_bytes", "error")
+
+    def __init__(self):
+        self.entries = 0
+        self.pages = 0
+        self.compressed_bytes = 0
+        self.error: Optional[Dict[str, Any]] = None
+
+
+def _csv_row(entry: Dict[str, Any], currency_name: Optional[Callable[[Optional[str]], str]]) -> List[Any]:
+    loyalty_transaction = entry.get("loyaltyTransaction") if isinstance(entry.get("loyaltyTransaction"), dict) else {}
+    loyalty_rule = loyalty_transaction.get("loyaltyRule") if isinstance(loyalty_transaction.get("loyaltyRule"), dict) else {}
+    currency_id = entry.get("loyaltyCurrencyId")
+    return [
+        entry.get("id"), entry.get("createdAt"), entry.get("direction"), entry.get("amount"), currency_id,
+        currency_name(currency_id) if currency_name and currency_id else "",
+        loyalty_rule.get("id"), loyalty_rule.get("name"), loyalty_transaction.get("id"),
+        entry.get("description") or loyalty_transaction.get("description"),
+    ]
+
+
+def _encode_page(page: List[Dict[str, Any]], fmt: str, currency_name: Optional[Callable[[Optional[str]], str]]) -> bytes:
+    if fmt == "ndjson":
+        return "".join(json.dumps(entry, ensure_ascii=False, separators=(",", ":")) + "\n" for entry in page).encode("utf-8")
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for entry in page:
+        writer.writerow(_csv_row(entry, currency_name))
+    return buffer.getvalue().encode("utf-8")
+
+
+async def write_transaction_export(entries: SnagPageIterator, fileobj: BinaryIO, fmt: str = "csv",
+                                   currency_name: Optional[Callable[[Optional[str]], str]] = None,
+                                   on_page: Optional[ProgressCallback] = None) -> ExportResult:
+    """
+    Пишет записи истории в `fileobj` как gzip CSV или NDJSON по мере прихода страниц: в памяти
+    держится только текущая страница. NDJSON сохраняет записи API целиком, CSV - основные поля.
+    Сжатие и запись идут в отдельном потоке, чтобы не блокировать event loop.
+    """
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Unsupported export format: {fmt!r}")
+    result = ExportResult()
+    gz = gzip.GzipFile(fileobj=fileobj, mode="wb", mtime=0)
+    try:
+        if fmt == "csv":
+            header = io.StringIO()
+            csv.writer(header).writerow(CSV_COLUMNS)
+            gz.write(header.getvalue().encode("utf-8"))
+        async for page in entries.pages():
+            await asyncio.to_thread(gz.write, _encode_page(page, fmt, currency_name))
+            result.entries += len(page)
+            result.pages += 1
+            if on_page:
+                await on_page(result.pages, result.entries)
+    finally:
+        gz.close()
+    result.error = entries.error
+    result.compressed_bytes = fileobj.tell()
+    return result
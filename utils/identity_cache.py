@@ -0,0 +1,157 @@
+# utils/identity_cache.py
+import logging
+import os
+import sqlite3
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from utils.snag_api_client import USER_METADATAS_ENDPOINT
+
+logger = logging.getLogger(__name__)
+
+# Состояния записи кэша
+FRESH = "fresh"      # можно использовать без запроса к API
+STALE = "stale"      # можно использовать, но стоит обновить в фоне
+EXPIRED = "expired"  # нужно запросить API
+
+# Типы идентификаторов совпадают с именами аргументов SnagApiClient.get_user_data
+IDENTIFIER_TYPES = ("discord_user", "twitter_user")
+
+
+class CachedIdentity:
+    """Запись кэша: кошелек (None - "не найден") и время последней проверки через API."""
+    __slots__ = ("wallet", "verified_at", "state")
+
+    def __init__(self, wallet: Optional[str], verified_at: float, state: str):
+        self.wallet = wallet
+        self.verified_at = verified_at
+        self.state = state
+
+
+class IdentityCache:
+    """
+    Локальный кэш соответствий "Discord/Twitter handle -> кошелек" для Main и Legacy систем в SQLite.
+
+    Положительные записи считаются свежими `fresh_ttl` секунд и пригодными (с фоновым
+    обновлением) до `stale_ttl`. Отрицательные записи ("кошелек не найден") живут
+    `negative_ttl` секунд, чтобы недавно привязанные аккаунты не терялись надолго.
+    """
+    def __init__(self, path: str, fresh_ttl: float = 6 * 3600, stale_ttl: float = 7 * 86400,
+                 negative_ttl: float = 3600):
+        self.path = path
+        self.fresh_ttl = max(0.0, float(fresh_ttl))
+        self.stale_ttl = max(self.fresh_ttl, float(stale_ttl))
+        self.negative_ttl = max(0.0, float(negative_ttl))
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS identities (
+                   system TEXT NOT NULL,
+                   id_type TEXT NOT NULL,
+                   id_value TEXT NOT NULL,
+                   wallet TEXT COLLATE NOCASE,
+                   verified_at REAL NOT NULL,
+                   PRIMARY KEY (system, id_type, id_value)
+               )"""
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_identities_wallet ON identities (wallet)")
+        self._conn.commit()
+        logger.info(f"IdentityCache opened at {path} (fresh {self.fresh_ttl:.0f}s, stale {self.stale_ttl:.0f}s, negative {self.negative_ttl:.0f}s).")
+
+    def close(self):
+        try:
+            self._conn.close()
+        except sqlite3.Error as e:
+            logger.warning(f"IdentityCache: error closing database: {e}")
+
+    def _state(self, wallet: Optional[str], verified_at: float, now: float) -> str:
+        age = now - verified_at
+        if wallet is None:
+            return FRESH if age < self.negative_ttl else EXPIRED
+        if age < self.fresh_ttl:
+            return FRESH
+        if age < self.stale_ttl:
+            return STALE
+        return EXPIRED
+
+    def get_many(self, system: str, id_type: str, id_values: Iterable[str]) -> Dict[str, CachedIdentity]:
+        """Возвращает записи для найденных идентификаторов (включая просроченные, с state=EXPIRED)."""
+        values = list(dict.fromkeys(v for v in id_values if v))
+        found: Dict[str, CachedIdentity] = {}
+        now = time.time()
+        # SQLite ограничивает число параметров в запросе, поэтому читаем пачками
+        for start in range(0, len(values), 500):
+            chunk = values[start:start + 500]
+            placeholders = ",".join("?" * len(chunk))
+            try:
+                rows = self._conn.execute(
+                    f"SELECT id_value, wallet, verified_at FROM identities "
+                    f"WHERE system = ? AND id_type = ? AND id_value IN ({placeholders})",
+                    (system, id_type, *chunk)
+                ).fetchall()
+            except sqlite3.Error as e:
+                logger.error(f"IdentityCache: read failed for {system}/{id_type}: {e}")
+                return found
+            for id_value, wallet, verified_at in rows:
+                found[id_value] = CachedIdentity(wallet, verified_at, self._state(wallet, verified_at, now))
+        return found
+
+    def get(self, system: str, id_type: str, id_value: str) -> Optional[CachedIdentity]:
+        return self.get_many(system, id_type, [id_value]).get(id_value)
+
+    def put_many(self, system: str, id_type: str, mappings: Iterable[Tuple[str, Optional[str]]]):
+        """Сохраняет пары (идентификатор, кошелек или None) с текущим временем проверки."""
+        now = time.time()
+        rows = [(system, id_type, id_value, wallet or None, now)
+                for id_value, wallet in mappings if id_value]
+        if not rows:
+            return
+        try:
+            with self._conn:
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO identities (system, id_type, id_value, wallet, verified_at) VALUES (?, ?, ?, ?, ?)",
+                    rows
+                )
+        except sqlite3.Error as e:
+            logger.error(f"IdentityCache: write failed for {system}/{id_type} ({len(rows)} rows): {e}")
+
+    def put(self, system: str, id_type: str, id_value: str, wallet: Optional[str]):
+        self.put_many(system, id_type, [(id_value, wallet)])
+
+    def forget_wallets(self, wallets: Iterable[str]) -> int:
+        """Удаляет все записи, указывающие на кошельки (например, после переноса кошелька)."""
+        wallet_list = [w for w in wallets if w]
+        if not wallet_list:
+            return 0
+        try:
+            with self._conn:
+                cursor = self._conn.executemany("DELETE FROM identities WHERE wallet = ?", [(w,) for w in wallet_list])
+            if cursor.rowcount:
+                logger.info(f"IdentityCache: forgot {cursor.rowcount} mapping(s) for {len(wallet_list)} wallet(s).")
+            return max(0, cursor.rowcount)
+        except sqlite3.Error as e:
+            logger.error(f"IdentityCache: delete failed: {e}")
+            return 0
+
+    def handle_snag_write(self, endpoint: str, wallets: List[str]):
+        """Слушатель записей SnagApiClient: метаданные (в т.ч. перенос кошелька) меняют привязки handle."""
+        if endpoint == USER_METADATAS_ENDPOINT:
+            self.forget_wallets(wallets)
+
+    def stats(self) -> Dict[str, int]:
+        try:
+            rows: List[Tuple[str, int, int]] = self._conn.execute(
+                "SELECT system, COUNT(*), SUM(wallet IS NULL) FROM identities GROUP BY system"
+            ).fetchall()
+        except sqlite3.Error as e:
+            logger.error(f"IdentityCache: stats query failed: {e}")
+            return {}
+        stats: Dict[str, int] = {}
+        for system, total, negative in rows:
+            stats[f"{system}_entries"] = total
+            stats[f"{system}_negative"] = negative or 0
+        return stats
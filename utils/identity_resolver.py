@@ -0,0 +1,225 @@
+# utils/identity_resolver.py
+import asyncio
+import logging
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+from utils.identity_cache import IdentityCache, CachedIdentity, FRESH, STALE
+from utils.priority_scheduler import PRIORITY_BULK
+
+logger = logging.getLogger(__name__)
+
+ProgressCallback = Callable[[int, int], Awaitable[None]]
+
+SYSTEM_MAIN = "main"
+SYSTEM_LEGACY = "legacy"
+
+
+class ResolvedIdentity:
+    """Результат поиска кошелька по Discord handle в обеих системах лояльности."""
+    __slots__ = ("handle", "main_wallet", "legacy_wallet", "chosen_wallet", "error", "from_cache")
+
+    def __init__(self, handle: str, main_wallet: Optional[str] = None, legacy_wallet: Optional[str] = None,
+                 chosen_wallet: Optional[str] = None, error: Optional[str] = None, from_cache: bool = False):
+        self.handle = handle
+        self.main_wallet = main_wallet
+        self.legacy_wallet = legacy_wallet
+        self.chosen_wallet = chosen_wallet
+        self.error = error
+        self.from_cache = from_cache
+
+    def __repr__(self):
+        return (f"ResolvedIdentity(handle={self.handle!r}, main={self.main_wallet!r}, "
+                f"legacy={self.legacy_wallet!r}, chosen={self.chosen_wallet!r}, error={self.error!r})")
+
+
+class IdentityResolver:
+    """
+    Пакетный поиск кошельков по Discord handle через Main и Legacy SnagApiClient.
+
+    Одинаковые handle запрашиваются один раз, одновременно обрабатывается не больше
+    `max_concurrency` handle (по запросу в каждую систему), прогресс сообщается через
+    необязательный колбэк. Если кошельки в системах различаются, выбирается Main.
+    С `identity_cache` свежие записи берутся из SQLite без запросов к API, а устаревшие
+    отдаются сразу и обновляются в фоне. Запросы к API идут с приоритетом `priority`
+    (по умолчанию BULK), чтобы пакетный поиск не тормозил интерактивные кнопки.
+    """
+    def __init__(self, snag_client=None, snag_client_legacy=None, max_concurrency: int = 25,
+                 identity_cache: Optional[IdentityCache] = None, priority: int = PRIORITY_BULK):
+        self.snag_client = snag_client
+        self.snag_client_legacy = snag_client_legacy
+        self.max_concurrency = max(1, int(max_concurrency))
+        self.identity_cache = identity_cache
+        self.priority = priority
+        self._refreshing: Set[str] = set()
+        self._refresh_tasks: Set[asyncio.Task] = set()
+
+    @staticmethod
+    def _client_available(client) -> bool:
+        return bool(client and getattr(client, '_api_key', None))
+
+    def _clients(self) -> List[Tuple[str, object]]:
+        return [(system, client) for system, client in ((SYSTEM_MAIN, self.snag_client), (SYSTEM_LEGACY, self.snag_client_legacy))
+                if self._client_available(client)]
+
+    async def _fetch_wallet(self, client, handle: str) -> Tuple[Optional[str], bool]:
+        """Возвращает (кошелек или None, получен ли достоверный ответ API)."""
+        response = await client.get_user_data(discord_user=handle, priority=self.priority)
+        if not response or response.get("error"):
+            return None, False
+        if isinstance(response.get("data"), list) and response["data"]:
+            wallet_address = response["data"][0].get("walletAddress")
+            if wallet_address:
+                return str(wallet_address).lower(), True
+        return None, True
+
+    @staticmethod
+    def _build_identity(handle: str, wallets: Dict[str, Optional[str]], errors: List[str], from_cache: bool = False) -> ResolvedIdentity:
+        identity = ResolvedIdentity(handle, wallets.get(SYSTEM_MAIN), wallets.get(SYSTEM_LEGACY), from_cache=from_cache)
+        if identity.main_wallet and identity.legacy_wallet and identity.main_wallet != identity.legacy_wallet:
+            logger.info(f"IdentityResolver: for {handle} addresses DIFFER. Main: {identity.main_wallet}, Legacy: {identity.legacy_wallet}. Chose Main.")
+        identity.chosen_wallet = identity.main_wallet or identity.legacy_wallet
+        if errors and not identity.chosen_wallet:
+            identity.error = "; ".join(errors)
+        return identity
+
+    async def _resolve_uncached(self, handle: str, known: Dict[str, Optional[str]],
+                                verified: Dict[str, List[Tuple[str, Optional[str]]]]) -> ResolvedIdentity:
+        """Запрашивает API только для систем, которых нет в `known`; достоверные ответы складывает в `verified`."""
+        wallets = dict(known)
+        pending = [(system, client) for system, client in self._clients() if system not in known]
+        results = await asyncio.gather(*(self._fetch_wallet(client, handle) for _, client in pending), return_exceptions=True)
+        errors: List[str] = []
+        for (system, _), result in zip(pending, results):
+            if isinstance(result, Exception):
+                logger.error(f"IdentityResolver: API error ({system}) for {handle}: {result}")
+                errors.append(f"{system}: {result}")
+                continue
+            wallet, is_verified = result
+            wallets[system] = wallet
+            if is_verified:
+                verified.setdefault(system, []).append((handle, wallet))
+        return self._build_identity(handle, wallets, errors)
+
+    def _cached_lookup(self, handles: List[str]) -> Dict[str, Dict[str, CachedIdentity]]:
+        if not self.identity_cache or not handles:
+            return {}
+        return {system: self.identity_cache.get_many(system, "discord_user", handles) for system, _ in self._clients()}
+
+    def _store_verified(self, verified: Dict[str, List[Tuple[str, Optional[str]]]]):
+        if not self.identity_cache:
+            return
+        for system, mappings in verified.items():
+            self.identity_cache.put_many(system, "discord_user", mappings)
+
+    async def resolve(self, handle: str) -> ResolvedIdentity:
+        """Ищет кошелек одного handle в обеих системах."""
+        return (await self.resolve_many([handle]))[handle]
+
+    async def resolve_many(self, handles: Iterable[str],
+                           progress_callback: Optional[ProgressCallback] = None,
+                           progress_every: int = 20,
+                           use_cache: bool = True) -> Dict[str, ResolvedIdentity]:
+        """
+        Ищет кошельки для списка handle. Возвращает словарь handle -> ResolvedIdentity
+        в порядке первого появления handle. progress_callback(done, total) вызывается
+        каждые `progress_every` handle и в конце; медленный колбэк не тормозит поиск.
+        """
+        unique_handles = list(dict.fromkeys(h for h in handles if h))
+        total = len(unique_handles)
+        results: Dict[str, ResolvedIdentity] = {handle: ResolvedIdentity(handle) for handle in unique_handles}
+        if not total:
+            return results
+
+        cached = self._cached_lookup(unique_handles) if use_cache else {}
+        systems = [system for system, _ in self._clients()]
+        queue: asyncio.Queue = asyncio.Queue()
+        stale_handles: List[str] = []
+        for handle in unique_handles:
+            known: Dict[str, Optional[str]] = {}
+            is_stale = False
+            for system in systems:
+                entry = cached.get(system, {}).get(handle)
+                if entry and entry.state in (FRESH, STALE):
+                    known[system] = entry.wallet
+                    is_stale = is_stale or entry.state == STALE
+            if len(known) == len(systems):
+                results[handle] = self._build_identity(handle, known, [], from_cache=True)
+                if is_stale:
+                    stale_handles.append(handle)
+            else:
+                queue.put_nowait((handle, known))
+
+        done = total - queue.qsize()
+        verified: Dict[str, List[Tuple[str, Optional[str]]]] = {}
+        progress_task: Optional[asyncio.Task] = None
+
+        async def report_progress(done_now: int):
+            try:
+                await progress_callback(done_now, total)
+            except Exception as e:
+                logger.warning(f"IdentityResolver: progress callback failed: {e}")
+
+        def schedule_progress():
+            nonlocal progress_task
+            # Промежуточный отчет идет отдельной задачей, чтобы воркер не ждал колбэк (например, редактирование
+            # сообщения в Discord). Если предыдущий отчет еще выполняется, этот пропускаем.
+            if not progress_callback or (progress_task is not None and not progress_task.done()):
+                return
+            progress_task = asyncio.create_task(report_progress(done))
+
+        async def worker():
+            nonlocal done
+            while True:
+                try:
+                    handle, known = queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+                try:
+                    results[handle] = await self._resolve_uncached(handle, known, verified)
+                except Exception as e:
+                    logger.error(f"IdentityResolver: error resolving {handle}: {e}", exc_info=True)
+                    results[handle] = ResolvedIdentity(handle, error=str(e))
+                done += 1
+                if progress_every > 0 and done % progress_every == 0 and done < total:
+                    schedule_progress()
+
+        to_fetch = queue.qsize()
+        logger.info(f"IdentityResolver: {total} unique handle(s), {total - to_fetch} from cache ({len(stale_handles)} stale), "
+                    f"{to_fetch} via API with concurrency {self.max_concurrency}.")
+        try:
+            if to_fetch:
+                await asyncio.gather(*(worker() for _ in range(min(self.max_concurrency, to_fetch))))
+        except BaseException:
+            if progress_task is not None:
+                progress_task.cancel()
+            raise
+        finally:
+            self._store_verified(verified)
+        # Итоговый отчет - после промежуточного, чтобы последним пришел полный счетчик
+        if progress_task is not None:
+            await progress_task
+        if progress_callback:
+            await report_progress(done)
+        if stale_handles:
+            self._schedule_refresh(stale_handles)
+        return results
+
+    def _schedule_refresh(self, handles: List[str]):
+        """Обновляет устаревшие записи кэша в фоне, не задерживая ответ пользователю."""
+        handles = [h for h in handles if h not in self._refreshing]
+        if not handles:
+            return
+        self._refreshing.update(handles)
+
+        async def refresh():
+            try:
+                await self.resolve_many(handles, use_cache=False)
+                logger.info(f"IdentityResolver: refreshed {len(handles)} stale cache entries in background.")
+            except Exception as e:
+                logger.error(f"IdentityResolver: background refresh failed: {e}", exc_info=True)
+            finally:
+                self._refreshing.difference_update(handles)
+
+        task = asyncio.create_task(refresh())
+        self._refresh_tasks.add(task)
+        task.add_done_callback(self._refresh_tasks.discard)
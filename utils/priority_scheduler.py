@@ -0,0 +1,129 @@
+# utils/priority_scheduler.py
+import asyncio
+import contextlib
+import logging
+import time
+from collections import deque
+from typing import Any, AsyncIterator, Deque, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Классы приоритета запросов: меньшее значение обслуживается раньше
+PRIORITY_INTERACTIVE = 0  # кнопки и модальные окна, где ждет человек
+PRIORITY_BULK = 1         # массовые и фоновые задачи
+
+LANE_NAMES = {PRIORITY_INTERACTIVE: "interactive", PRIORITY_BULK: "bulk"}
+
+
+class PriorityGate:
+    """
+    Ограничитель одновременных запросов с двумя очередями приоритета.
+
+    Свободный слот получает сначала интерактивный запрос. Массовые запросы никогда не
+    занимают последние `interactive_reserve` слотов, поэтому одиночный клик не ждет,
+    пока освободится соединение из-под массовой задачи. Чтобы массовая очередь не
+    голодала при потоке интерактивных запросов, после `fairness` интерактивных выдач
+    подряд очередной слот отдается массовому запросу.
+    """
+    def __init__(self, limit: int, name: str = "gate", interactive_reserve: Optional[int] = None, fairness: int = 4):
+        self.name = name
+        self.limit = max(1, int(limit))
+        reserve = max(1, self.limit // 5) if interactive_reserve is None else int(interactive_reserve)
+        self.bulk_limit = max(1, self.limit - max(0, reserve))
+        self.fairness = max(1, int(fairness))
+        self._active: Dict[int, int] = {PRIORITY_INTERACTIVE: 0, PRIORITY_BULK: 0}
+        self._waiters: Dict[int, Deque[Tuple[asyncio.Future, float]]] = {PRIORITY_INTERACTIVE: deque(), PRIORITY_BULK: deque()}
+        self._interactive_streak = 0
+        self._granted: Dict[int, int] = {PRIORITY_INTERACTIVE: 0, PRIORITY_BULK: 0}
+        self._wait_total: Dict[int, float] = {PRIORITY_INTERACTIVE: 0.0, PRIORITY_BULK: 0.0}
+        self._wait_max: Dict[int, float] = {PRIORITY_INTERACTIVE: 0.0, PRIORITY_BULK: 0.0}
+
+    @staticmethod
+    def _lane(priority: int) -> int:
+        return PRIORITY_INTERACTIVE if priority <= PRIORITY_INTERACTIVE else PRIORITY_BULK
+
+    def _total_active(self) -> int:
+        return self._active[PRIORITY_INTERACTIVE] + self._active[PRIORITY_BULK]
+
+    def _can_start(self, lane: int) -> bool:
+        if self._total_active() >= self.limit:
+            return False
+        return lane == PRIORITY_INTERACTIVE or self._active[PRIORITY_BULK] < self.bulk_limit
+
+    def _grant(self, lane: int, waited: float):
+        self._active[lane] += 1
+        self._granted[lane] += 1
+        self._wait_total[lane] += waited
+        self._wait_max[lane] = max(self._wait_max[lane], waited)
+        if lane == PRIORITY_INTERACTIVE:
+            self._interactive_streak += 1
+        else:
+            self._interactive_streak = 0
+
+    async def acquire(self, priority: int = PRIORITY_INTERACTIVE):
+        lane = self._lane(priority)
+        # Быстрый путь: слот свободен и никто из этой или более приоритетной очереди не ждет
+        if self._can_start(lane) and not self._waiters[lane] and (lane == PRIORITY_INTERACTIVE or not self._waiters[PRIORITY_INTERACTIVE]):
+            self._grant(lane, 0.0)
+            return
+        future: asyncio.Future = asyncio.get_running_loop().create_future()
+        item = (future, time.monotonic())
+        self._waiters[lane].append(item)
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # Слот уже был выдан, но ожидающий отменен - возвращаем слот
+                self.release(priority)
+            else:
+                with contextlib.suppress(ValueError):
+                    self._waiters[lane].remove(item)
+            raise
+
+    def release(self, priority: int = PRIORITY_INTERACTIVE):
+        lane = self._lane(priority)
+        self._active[lane] = max(0, self._active[lane] - 1)
+        self._dispatch()
+
+    def _next_lane(self) -> Optional[int]:
+        interactive_waiting = bool(self._waiters[PRIORITY_INTERACTIVE])
+        bulk_ready = bool(self._waiters[PRIORITY_BULK]) and self._can_start(PRIORITY_BULK)
+        if interactive_waiting and bulk_ready and self._interactive_streak >= self.fairness:
+            return PRIORITY_BULK
+        if interactive_waiting:
+            return PRIORITY_INTERACTIVE
+        if bulk_ready:
+            return PRIORITY_BULK
+        return None
+
+    def _dispatch(self):
+        while self._total_active() < self.limit:
+            lane = self._next_lane()
+            if lane is None:
+                return
+            future, enqueued_at = self._waiters[lane].popleft()
+            if future.done():
+                continue
+            self._grant(lane, time.monotonic() - enqueued_at)
+            future.set_result(None)
+
+    @contextlib.asynccontextmanager
+    async def slot(self, priority: int = PRIORITY_INTERACTIVE) -> AsyncIterator[None]:
+        await self.acquire(priority)
+        try:
+            yield
+        finally:
+            self.release(priority)
+
+    def stats(self) -> Dict[str, Any]:
+        stats: Dict[str, Any] = {"limit": self.limit, "bulk_limit": self.bulk_limit}
+        for lane, lane_name in LANE_NAMES.items():
+            granted = self._granted[lane]
+            stats[lane_name] = {
+                "active": self._active[lane],
+                "queued": len(self._waiters[lane]),
+                "granted": granted,
+                "avg_wait": (self._wait_total[lane] / granted) if granted else 0.0,
+                "max_wait": self._wait_max[lane],
+            }
+        return stats
@@ -0,0 +1,103 @@
+# utils/rate_limiter.py
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """
+    Асинхронный токен-бакет: пополняется со скоростью `rate` токенов в секунду
+    и хранит не больше `burst` токенов. Ожидающие обслуживаются по приоритету
+    (меньшее значение - раньше), внутри одного приоритета строго по очереди (FIFO).
+    """
+    def __init__(self, rate: float, burst: int, name: str = "bucket"):
+        if rate <= 0:
+            raise ValueError(f"TokenBucket '{name}': rate must be positive, got {rate}")
+        self.name = name
+        self.rate = float(rate)
+        self.capacity = float(max(1, int(burst)))
+        self._tokens = self.capacity
+        self._updated_at = time.monotonic()
+        self._waiters: List[Tuple[int, int]] = []
+        self._sequence = itertools.count()
+        self._changed = asyncio.Event()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate)
+        self._updated_at = now
+
+    def _notify(self):
+        # Будим всех ожидающих: новый первый в очереди сам рассчитает свою задержку
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+
+    @property
+    def available_tokens(self) -> float:
+        self._refill()
+        return self._tokens
+
+    def waiting_by_priority(self) -> Dict[int, int]:
+        counts: Dict[int, int] = {}
+        for priority, _ in self._waiters:
+            counts[priority] = counts.get(priority, 0) + 1
+        return counts
+
+    async def acquire(self, tokens: float = 1.0, priority: int = 0) -> float:
+        """Ждет, пока в бакете появятся токены, и забирает их. Возвращает время ожидания в секундах."""
+        started_at = time.monotonic()
+        entry = (priority, next(self._sequence))
+        heapq.heappush(self._waiters, entry)
+        try:
+            while True:
+                self._refill()
+                timeout: Optional[float] = None
+                if self._waiters[0] == entry:
+                    if self._tokens >= tokens:
+                        heapq.heappop(self._waiters)
+                        self._tokens -= tokens
+                        if self._waiters:
+                            self._notify()
+                        return time.monotonic() - started_at
+                    timeout = (tokens - self._tokens) / self.rate
+                changed = self._changed
+                try:
+                    await asyncio.wait_for(changed.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+        except BaseException:
+            if entry in self._waiters:
+                self._waiters.remove(entry)
+                heapq.heapify(self._waiters)
+                self._notify()
+            raise
+
+
+def parse_endpoint_rate_limits(spec: Optional[str]) -> Dict[str, Tuple[float, int]]:
+    """
+    Разбирает строку вида "/api/users=5:10;/api/loyalty/transaction_entries=2:2"
+    в словарь {эндпоинт: (запросов в секунду, burst)}. Некорректные элементы пропускаются.
+    """
+    limits: Dict[str, Tuple[float, int]] = {}
+    if not spec:
+        return limits
+    for item in spec.split(';'):
+        item = item.strip()
+        if not item:
+            continue
+        try:
+            endpoint, limit_str = item.split('=', 1)
+            rate_str, _, burst_str = limit_str.partition(':')
+            rate = float(rate_str)
+            burst = int(burst_str) if burst_str else max(1, int(rate))
+            if rate <= 0:
+                raise ValueError("rate must be positive")
+            limits[endpoint.strip().rstrip('/')] = (rate, burst)
+        except ValueError as e:
+            logger.warning(f"Invalid endpoint rate limit entry '{item}': {e}. Skipping.")
+    return limits
@@ -0,0 +1,144 @@
+# utils/response_cache.py
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Iterable, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+CacheKey = Tuple[str, Tuple[Tuple[str, str], ...]]
+
+
+def make_cache_key(endpoint: str, params: Optional[Dict[str, Any]]) -> CacheKey:
+    """Ключ кэша: эндпоинт + отсортированные query-параметры (значения приводятся к строке)."""
+    items = tuple(sorted((str(k), str(v)) for k, v in (params or {}).items()))
+    return endpoint, items
+
+
+class ResponseCache:
+    """
+    In-memory кэш ответов с ограничением по размеру (LRU) и TTL для каждой записи.
+
+    Записи можно привязать к кошелькам: `invalidate_wallet()` удаляет все ответы,
+    в которых фигурировал кошелек. Ответы отдаются как есть, без копирования,
+    поэтому вызывающий код не должен их изменять.
+    """
+    def __init__(self, max_entries: int = 2000, name: str = "cache"):
+        self.name = name
+        self.max_entries = max(1, int(max_entries))
+        self._entries: "OrderedDict[Hashable, Tuple[float, Any, Set[str]]]" = OrderedDict()
+        self._wallet_index: Dict[str, Set[Hashable]] = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        # Растет при каждой инвалидации: позволяет не класть в кэш ответ на запрос, начатый до записи
+        self.generation = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        expires_at, value, _ = entry
+        if expires_at <= time.monotonic():
+            self._remove(key)
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key: Hashable, value: Any, ttl: float, wallets: Iterable[str] = ()):
+        if ttl <= 0:
+            return
+        if key in self._entries:
+            self._remove(key)
+        wallet_set = {w.lower() for w in wallets if isinstance(w, str) and w}
+        self._entries[key] = (time.monotonic() + ttl, value, wallet_set)
+        for wallet in wallet_set:
+            self._wallet_index.setdefault(wallet, set()).add(key)
+        while len(self._entries) > self.max_entries:
+            oldest_key = next(iter(self._entries))
+            self._remove(oldest_key)
+            self.evictions += 1
+
+    def invalidate_wallet(self, wallet_address: Optional[str]) -> int:
+        if not wallet_address:
+            return 0
+        self.generation += 1
+        keys = self._wallet_index.pop(wallet_address.lower(), set())
+        removed = 0
+        for key in keys:
+            if key in self._entries:
+                self._remove(key)
+                removed += 1
+        self.invalidations += removed
+        if removed:
+            logger.debug(f"[{self.name}] Invalidated {removed} cached response(s) for wallet {wallet_address}.")
+        return removed
+
+    def invalidate_endpoint(self, endpoint: str) -> int:
+        self.generation += 1
+        keys = [key for key in self._entries if isinstance(key, tuple) and key and key[0] == endpoint]
+        for key in keys:
+            self._remove(key)
+        self.invalidations += len(keys)
+        if keys:
+            logger.debug(f"[{self.name}] Invalidated {len(keys)} cached response(s) for endpoint {endpoint}.")
+        return len(keys)
+
+    def clear(self):
+        self.generation += 1
+        self.invalidations += len(self._entries)
+        self._entries.clear()
+        self._wallet_index.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": (self.hits / lookups) if lookups else 0.0,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+        }
+
+    def _remove(self, key: Hashable):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        for wallet in entry[2]:
+            wallet_keys = self._wallet_index.get(wallet)
+            if wallet_keys is not None:
+                wallet_keys.discard(key)
+                if not wallet_keys:
+                    del self._wallet_index[wallet]
+
+
+def parse_endpoint_ttls(spec: Optional[str]) -> Dict[str, float]:
+    """
+    Разбирает строку вида "/api/users=60;/api/loyalty/rules=300" в словарь {эндпоинт: TTL в секундах}.
+    TTL 0 отключает кэширование эндпоинта. Некорректные элементы пропускаются.
+    """
+    ttls: Dict[str, float] = {}
+    if not spec:
+        return ttls
+    for item in spec.split(';'):
+        item = item.strip()
+        if not item:
+            continue
+        try:
+            endpoint, ttl_str = item.split('=', 1)
+            ttl = float(ttl_str)
+            if ttl < 0:
+                raise ValueError("TTL must not be negative")
+            ttls[endpoint.strip().rstrip('/')] = ttl
+        except ValueError as e:
+            logger.warning(f"Invalid cache TTL entry '{item}': {e}. Skipping.")
+    return ttls
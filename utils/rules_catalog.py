@@ -0,0 +1,242 @@
+# utils/rules_catalog.py
+import asyncio
+import logging
+import time
+from typing import Any, Dict, List, Optional, Set
+
+from utils.priority_scheduler import PRIORITY_BULK, PRIORITY_INTERACTIVE
+from utils.snag_api_client import RULES_ENDPOINT
+
+logger = logging.getLogger(__name__)
+
+# Пауза перед повторной загрузкой каталога после ошибки (если refresh_interval больше)
+RETRY_AFTER_ERROR = 60.0
+
+
+class RulesCatalog:
+    """
+    Общий для бота каталог правил лояльности (квестов) одной системы.
+
+    Загружается один раз и обновляется в фоне каждые `refresh_interval` секунд. API не умеет
+    отдавать только изменившиеся правила, поэтому обновление скачивает список (обычно одна
+    страница) и переиндексирует только добавленные, измененные и удаленные правила.
+    Индексы: по id, валюте, состоянию (активно / скрыто / удалено) и имени.
+    Изменение правила через клиент (update_loyalty_rule) сразу перечитывает это правило.
+    """
+    def __init__(self, client, organization_id: Optional[str] = None, website_id: Optional[str] = None,
+                 refresh_interval: float = 300.0, page_size: int = 1000, max_pages: Optional[int] = 20,
+                 priority: int = PRIORITY_BULK):
+        self.client = client
+        self.organization_id = organization_id
+        self.website_id = website_id
+        self.refresh_interval = max(0.0, float(refresh_interval))
+        self.page_size = page_size
+        self.max_pages = max_pages
+        self.priority = priority
+        self.loaded_at: Optional[float] = None   # time.monotonic() последней успешной полной загрузки
+        self.complete = False                    # последняя загрузка не уперлась в max_pages
+        self.last_error: Optional[str] = None
+        self._rules: Dict[str, Dict[str, Any]] = {}
+        self._names: Dict[str, str] = {}                    # id -> имя в нижнем регистре
+        self._by_currency: Dict[Optional[str], Set[str]] = {}
+        self._active: Set[str] = set()
+        self._hidden: Set[str] = set()
+        self._deleted: Set[str] = set()
+        self._retrievable: Dict[str, bool] = {}             # результат проверки правила запросом по id
+        self._refresh_lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self._rule_tasks: Set[asyncio.Task] = set()
+
+    @property
+    def loaded(self) -> bool:
+        return self.loaded_at is not None
+
+    # --- Индексы ---
+    def _index(self, rule_id: str, rule: Dict[str, Any]):
+        self._names[rule_id] = str(rule.get("name") or "").lower()
+        self._by_currency.setdefault(rule.get("loyaltyCurrencyId"), set()).add(rule_id)
+        if rule.get("isActive") is True: self._active.add(rule_id)
+        if rule.get("hideInUi") is True: self._hidden.add(rule_id)
+        if rule.get("deletedAt"): self._deleted.add(rule_id)
+
+    def _unindex(self, rule_id: str, rule: Dict[str, Any]):
+        self._names.pop(rule_id, None)
+        currency_ids = self._by_currency.get(rule.get("loyaltyCurrencyId"))
+        if currency_ids is not None:
+            currency_ids.discard(rule_id)
+            if not currency_ids:
+                del self._by_currency[rule.get("loyaltyCurrencyId")]
+        self._active.discard(rule_id)
+        self._hidden.discard(rule_id)
+        self._deleted.discard(rule_id)
+        self._retrievable.pop(rule_id, None)
+
+    def _upsert(self, rule: Any) -> Optional[bool]:
+        """Добавляет или обновляет правило. True - новое, False - изменилось, None - без изменений или не правило."""
+        rule_id = rule.get("id") if isinstance(rule, dict) else None
+        if not isinstance(rule_id, str) or not rule_id:
+            return None
+        previous = self._rules.get(rule_id)
+        if previous == rule:
+            return None
+        if previous is not None:
+            self._unindex(rule_id, previous)
+        self._rules[rule_id] = rule
+        self._index(rule_id, rule)
+        return previous is None
+
+    def _remove(self, rule_id: str) -> bool:
+        rule = self._rules.pop(rule_id, None)
+        if rule is None:
+            return False
+        self._unindex(rule_id, rule)
+        return True
+
+    # --- Чтение ---
+    def get(self, rule_id: str) -> Optional[Dict[str, Any]]:
+        return self._rules.get(rule_id)
+
+    def rules(self, active: Optional[bool] = None, hidden: Optional[bool] = None,
+              include_deleted: bool = False, currency_id: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Правила в порядке API с фильтрами по состоянию и валюте (None - фильтр не применяется)."""
+        rule_ids = self._by_currency.get(currency_id, set()) if currency_id is not None else self._rules.keys()
+        result = []
+        for rule_id, rule in self._rules.items():
+            if rule_id not in rule_ids: continue
+            if not include_deleted and rule_id in self._deleted: continue
+            if active is not None and (rule_id in self._active) != active: continue
+            if hidden is not None and (rule_id in self._hidden) != hidden: continue
+            result.append(rule)
+        return result
+
+    def search_by_name(self, substring: str, include_deleted: bool = False) -> List[Dict[str, Any]]:
+        needle = substring.lower()
+        return [self._rules[rule_id] for rule_id, name in self._names.items()
+                if needle in name and (include_deleted or rule_id not in self._deleted)]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "rules": len(self._rules),
+            "active": len(self._active - self._deleted),
+            "hidden": len(self._hidden - self._deleted),
+            "deleted": len(self._deleted),
+            "currencies": len(self._by_currency),
+            "age": round(time.monotonic() - self.loaded_at, 1) if self.loaded_at is not None else None,
+            "complete": self.complete,
+        }
+
+    # --- Загрузка ---
+    async def ensure_loaded(self) -> bool:
+        """Загружает каталог при первом обращении; одновременные вызовы ждут одну загрузку."""
+        if self.loaded:
+            return True
+        async with self._refresh_lock:
+            if self.loaded:
+                return True
+            return await self._refresh_locked(PRIORITY_INTERACTIVE)
+
+    async def refresh(self) -> bool:
+        async with self._refresh_lock:
+            return await self._refresh_locked(self.priority)
+
+    async def _refresh_locked(self, priority: int) -> bool:
+        started_at = time.monotonic()
+        rules_iter = self.client.iter_loyalty_rules(
+            page_size=self.page_size, include_deleted=True,
+            organization_id_filter=self.organization_id, website_id_filter=self.website_id,
+            max_pages=self.max_pages, prefetch=True, priority=priority
+        )
+        seen: Set[str] = set()
+        added = changed = 0
+        async for page in rules_iter.pages():
+            for rule in page:
+                outcome = self._upsert(rule)
+                if outcome is True: added += 1
+                elif outcome is False: changed += 1
+                if isinstance(rule, dict) and rule.get("id"):
+                    seen.add(rule["id"])
+        if rules_iter.error:
+            self.last_error = rules_iter.error.get("message") or "Failed to fetch loyalty rules."
+            logger.warning(f"RulesCatalog: refresh failed after {rules_iter.pages_fetched} page(s): {self.last_error}")
+            return False
+        removed = 0
+        # Удалять пропавшие правила можно только по полному списку
+        if not rules_iter.truncated:
+            for rule_id in [rule_id for rule_id in self._rules if rule_id not in seen]:
+                removed += self._remove(rule_id)
+        self.complete = not rules_iter.truncated
+        self.last_error = None
+        self.loaded_at = time.monotonic()
+        logger.info(f"RulesCatalog: {len(self._rules)} rules ({added} added, {changed} changed, {removed} removed) "
+                    f"in {rules_iter.pages_fetched} page(s), {self.loaded_at - started_at:.2f}s"
+                    f"{'' if self.complete else ', truncated'}.")
+        return True
+
+    async def refresh_rule(self, rule_id: str) -> Optional[Dict[str, Any]]:
+        """Перечитывает одно правило (например, после изменения) и возвращает его; None - не найдено или ошибка."""
+        response = await self.client.get_loyalty_rules(
+            loyalty_rule_id=rule_id, limit=1, include_deleted=True,
+            organization_id_filter=self.organization_id, website_id_filter=self.website_id
+        )
+        if not isinstance(response, dict) or response.get("error") or not isinstance(response.get("data"), list):
+            logger.warning(f"RulesCatalog: failed to refresh rule {rule_id}: {response.get('message') if isinstance(response, dict) else response}")
+            return None
+        if not response["data"]:
+            self._remove(rule_id)
+            return None
+        rule = response["data"][0]
+        self._upsert(rule)
+        return rule if isinstance(rule, dict) else None
+
+    async def is_retrievable(self, rule_id: str) -> bool:
+        """
+        Находится ли правило запросом только по id. Некоторые правила есть в общем списке,
+        но по id возвращают пустой `data` ("призраки"). Результат запоминается до изменения правила.
+        """
+        cached = self._retrievable.get(rule_id)
+        if cached is not None:
+            return cached
+        response = await self.client.get_loyalty_rules(loyalty_rule_id=rule_id, limit=1)
+        if not isinstance(response, dict) or response.get("error") or not isinstance(response.get("data"), list):
+            return False  # Ошибку не запоминаем: в следующий раз проверим снова
+        retrievable = bool(response["data"])
+        if rule_id in self._rules:
+            self._retrievable[rule_id] = retrievable
+        return retrievable
+
+    # --- Фоновое обновление ---
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._refresh_loop())
+
+    async def _refresh_loop(self):
+        while True:
+            try:
+                success = await self.refresh()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"RulesCatalog: background refresh failed: {e}", exc_info=True)
+                success = False
+            if self.refresh_interval <= 0:
+                return
+            await asyncio.sleep(self.refresh_interval if success else min(self.refresh_interval, RETRY_AFTER_ERROR))
+
+    def handle_snag_write(self, endpoint: str, wallets: List[str]):
+        """Слушатель записей SnagApiClient: измененное правило перечитывается в фоне."""
+        prefix = f"{RULES_ENDPOINT}/"
+        if not endpoint.startswith(prefix) or endpoint.endswith("/complete"):
+            return
+        rule_id = endpoint[len(prefix):].split("/")[0]
+        if not rule_id:
+            return
+        task = asyncio.create_task(self.refresh_rule(rule_id))
+        self._rule_tasks.add(task)
+        task.add_done_callback(self._rule_tasks.discard)
+
+    async def close(self):
+        tasks = [task for task in (self._task, *self._rule_tasks) if task and not task.done()]
+        for task in tasks:
+            task.cancel()
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
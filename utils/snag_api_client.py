@@ -3,7 +3,23 @@ import aiohttp
 import logging
 import json
 import asyncio
-from typing import Optional, Dict, List, Any
+import contextlib
+import datetime
+import email.utils
+import random
+import time
+from typing import Optional, Dict, List, Any, Tuple, Callable, Awaitable, AsyncIterator
+
+try:
+    import orjson  # Необязательный быстрый JSON-декодер, работает прямо с bytes
+except ImportError:
+    orjson = None
+
+from utils.api_metrics import ApiMetrics
+from utils.circuit_breaker import CircuitBreaker, STATE_OPEN
+from utils.priority_scheduler import PriorityGate, PRIORITY_INTERACTIVE, PRIORITY_BULK, LANE_NAMES
+from utils.rate_limiter import TokenBucket
+from utils.response_cache import ResponseCache, make_cache_key
 
 # Константы
 SNAG_API_BASE_URL = "https://admin.snagsolutions.io"
@@ -18,14 +34,132 @@ GET_USER_ENDPOINT = "/api/users"
 USER_METADATAS_ENDPOINT = "/api/users/metadatas"
 
 SNAG_API_KEY_HEADER = "X-API-KEY"
+
+# Статусы, после которых GET-запрос имеет смысл повторить
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504, "TimeoutError", "ConnectionError"}
+# Статусы, означающие недоступность API (429 - это троттлинг, а не сбой, и автомат не трогает)
+CIRCUIT_FAILURE_STATUSES = {500, 502, 503, 504, "TimeoutError", "ConnectionError"}
+
+# TTL кэша ответов по умолчанию (секунды). Эндпоинты без TTL не кэшируются:
+# история транзакций должна быть свежей и занимает слишком много памяти.
+DEFAULT_CACHE_TTLS: Dict[str, float] = {
+    GET_USER_ENDPOINT: 120.0,
+    ACCOUNTS_ENDPOINT: 30.0,
+    CURRENCIES_ENDPOINT: 600.0,
+    RULES_ENDPOINT: 60.0,
+    BADGES_ENDPOINT: 60.0,
+    REFERRALS_ENDPOINT: 60.0,
+}
 logger = logging.getLogger(__name__)
 
+
+def _json_loads(raw_body: bytes) -> Any:
+    """Декодирует JSON из bytes через orjson, если он установлен, иначе через стандартный json."""
+    if orjson is not None:
+        return orjson.loads(raw_body)
+    return json.loads(raw_body)
+
+
+def _body_snippet(raw_body: bytes, limit: int) -> str:
+    return raw_body[:limit].decode('utf-8', errors='replace')
+
 BROWSER_USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/119.0.0.0 Safari/537.36"
 
+
+class SnagPageIterator:
+    """
+    Асинхронный итератор по списочным эндпоинтам Snag с курсором startingAfter/hasNextPage.
+
+    `async for item in iterator` отдает элементы по мере прихода страниц, `iterator.pages()`
+    отдает страницы целиком. С prefetch=True следующая страница запрашивается, пока
+    вызывающий код обрабатывает текущую. Ошибки не выбрасываются, как и в остальном клиенте:
+    после обхода проверьте `error` (словарь ошибки API) и `truncated` (достигнут max_pages).
+    """
+    def __init__(self, fetch_page: Callable[[Optional[str]], Awaitable[Optional[Dict]]],
+                 max_pages: Optional[int] = None, prefetch: bool = False,
+                 starting_after: Optional[str] = None, description: str = "items"):
+        self._fetch_page = fetch_page
+        self.max_pages = max_pages
+        self.prefetch = prefetch
+        self.starting_after = starting_after
+        self.description = description
+        self.pages_fetched = 0
+        self.items_fetched = 0
+        self.has_more = True
+        self.truncated = False
+        self.last_cursor: Optional[str] = starting_after
+        self.error: Optional[Dict[str, Any]] = None
+
+    def __aiter__(self) -> AsyncIterator[Dict[str, Any]]:
+        return self._iterate_items()
+
+    async def _iterate_items(self) -> AsyncIterator[Dict[str, Any]]:
+        async for page in self.pages():
+            for item in page:
+                yield item
+
+    async def pages(self) -> AsyncIterator[List[Dict[str, Any]]]:
+        cursor = self.starting_after
+        next_page_task: Optional[asyncio.Task] = None
+        try:
+            while True:
+                if next_page_task is not None:
+                    page_response = await next_page_task
+                    next_page_task = None
+                else:
+                    page_response = await self._fetch_page(cursor)
+                self.pages_fetched += 1
+
+                if not page_response or page_response.get("error"):
+                    self.error = page_response or {"error": True, "status": "NoResponse", "message": "No API response."}
+                    self.has_more = False
+                    logger.error(f"Pagination of {self.description} stopped on page {self.pages_fetched}: {self.error.get('status')} {self.error.get('message')}")
+                    return
+                page_items = page_response.get("data", [])
+                if not isinstance(page_items, list):
+                    logger.warning(f"Pagination of {self.description}: 'data' is not a list on page {self.pages_fetched}. Stopping.")
+                    self.has_more = False
+                    return
+
+                next_cursor = page_items[-1].get("id") if page_items and isinstance(page_items[-1], dict) else None
+                self.has_more = bool(page_response.get("hasNextPage", False)) and bool(next_cursor)
+                if next_cursor:
+                    self.last_cursor = next_cursor
+                if self.has_more and self.max_pages is not None and self.pages_fetched >= self.max_pages:
+                    self.truncated = True
+                elif self.has_more and self.prefetch:
+                    next_page_task = asyncio.create_task(self._fetch_page(next_cursor))
+
+                self.items_fetched += len(page_items)
+                if page_items:
+                    yield page_items
+                if not self.has_more or self.truncated:
+                    return
+                cursor = next_cursor
+        finally:
+            if next_page_task is not None and not next_page_task.done():
+                next_page_task.cancel()
+
+
 class SnagApiClient:
     def __init__(self, session: aiohttp.ClientSession, api_key: Optional[str],
                  organization_id: Optional[str], website_id: Optional[str],
-                 client_name: str = "SnagClient"):
+                 client_name: str = "SnagClient",
+                 max_concurrent_requests: Optional[int] = None,
+                 rate_limit: Optional[float] = None,
+                 rate_burst: Optional[int] = None,
+                 endpoint_rate_limits: Optional[Dict[str, Tuple[float, int]]] = None,
+                 max_retries: int = 3,
+                 retry_backoff_base: float = 0.5,
+                 retry_backoff_max: float = 8.0,
+                 retry_budget: float = 30.0,
+                 cache_max_entries: int = 0,
+                 cache_ttls: Optional[Dict[str, float]] = None,
+                 circuit_failure_threshold: int = 5,
+                 circuit_recovery_timeout: float = 30.0,
+                 interactive_reserve: Optional[int] = None,
+                 bulk_fairness: int = 4,
+                 base_url: Optional[str] = None):
         
         self._client_name = client_name
         if not api_key: logger.error(f"[{self._client_name}] SnagApiClient initialized without API Key!")
@@ -34,15 +168,92 @@ class SnagApiClient:
         self._api_key = api_key
         self._organization_id = organization_id # Глобальный для клиента
         self._website_id = website_id         # Глобальный для клиента
-        self._base_url = SNAG_API_BASE_URL
+        # base_url позволяет направить клиент на локальный симулятор (tools/snag_simulator.py)
+        self._base_url = (base_url or SNAG_API_BASE_URL).rstrip('/')
+        if self._base_url != SNAG_API_BASE_URL:
+            logger.info(f"[{self._client_name}] Using non-default Snag API base URL: {self._base_url}")
+
+        # Собственный бюджет соединений клиента внутри общего пула сессии,
+        # чтобы массовые задачи одного клиента не забирали весь пул.
+        # Слоты выдаются по приоритету: интерактивные запросы раньше массовых, часть слотов - только для интерактивных.
+        self._max_concurrent_requests = max_concurrent_requests if max_concurrent_requests and max_concurrent_requests > 0 else None
+        self._request_slots: Optional[PriorityGate] = (
+            PriorityGate(self._max_concurrent_requests, name=self._client_name,
+                         interactive_reserve=interactive_reserve, fairness=bulk_fairness)
+            if self._max_concurrent_requests else None
+        )
+        if self._request_slots:
+            logger.info(f"[{self._client_name}] Connection budget: {self._max_concurrent_requests} concurrent requests "
+                        f"(bulk up to {self._request_slots.bulk_limit}, fairness 1 bulk per {self._request_slots.fairness} interactive).")
+
+        # Клиентский rate limiter: общий бакет клиента + необязательные бакеты по эндпоинтам.
+        self._rate_limiter: Optional[TokenBucket] = None
+        if rate_limit and rate_limit > 0:
+            burst = rate_burst if rate_burst and rate_burst > 0 else max(1, int(rate_limit))
+            self._rate_limiter = TokenBucket(rate_limit, burst, name=self._client_name)
+            logger.info(f"[{self._client_name}] Rate limit: {rate_limit} req/s, burst {burst}.")
+        self._endpoint_rate_limiters: Dict[str, TokenBucket] = {}
+        for limited_endpoint, (endpoint_rate, endpoint_burst) in (endpoint_rate_limits or {}).items():
+            self._endpoint_rate_limiters[limited_endpoint] = TokenBucket(
+                endpoint_rate, endpoint_burst, name=f"{self._client_name}:{limited_endpoint}"
+            )
+            logger.info(f"[{self._client_name}] Rate limit for {limited_endpoint}: {endpoint_rate} req/s, burst {endpoint_burst}.")
+
+        # Повторы GET-запросов: экспоненциальная задержка с джиттером и общий бюджет времени на вызов.
+        self._max_retries = max(0, int(max_retries))
+        self._retry_backoff_base = max(0.0, float(retry_backoff_base))
+        self._retry_backoff_max = max(self._retry_backoff_base, float(retry_backoff_max))
+        self._retry_budget = max(0.0, float(retry_budget))
+
+        # Кэш ответов только для чтения (GET). cache_max_entries=0 отключает кэш.
+        self._cache_ttls: Dict[str, float] = {**DEFAULT_CACHE_TTLS, **(cache_ttls or {})}
+        self._response_cache: Optional[ResponseCache] = (
+            ResponseCache(cache_max_entries, name=self._client_name) if cache_max_entries and cache_max_entries > 0 else None
+        )
+        self._inflight_requests: Dict[Any, asyncio.Future] = {}
+        self.coalesced_requests = 0
+        self._write_listeners: List[Callable[[str, List[str]], None]] = []
+
+        # Автоматы "circuit breaker" по эндпоинтам: при падении API отвечаем ошибкой сразу, а не по таймауту.
+        # circuit_failure_threshold=0 отключает их.
+        self._circuit_failure_threshold = max(0, int(circuit_failure_threshold))
+        self._circuit_recovery_timeout = max(0.0, float(circuit_recovery_timeout))
+        self._circuit_breakers: Dict[str, CircuitBreaker] = {}
+        # Метрики по эндпоинтам (задержки, коды ответов, байты, повторы, кэш) для !snagstats и /metrics
+        self.metrics = ApiMetrics(self._client_name)
+        if self._response_cache is not None:
+            logger.info(f"[{self._client_name}] Response cache: up to {cache_max_entries} entries, TTLs {self._cache_ttls}.")
 
         self._endpoints_with_org_site_in_query = [
             ACCOUNTS_ENDPOINT, TRANSACTION_ENTRIES_ENDPOINT, CURRENCIES_ENDPOINT,
             REFERRALS_ENDPOINT, RULES_ENDPOINT, BADGES_ENDPOINT,
         ]
 
+    async def _throttle(self, base_endpoint: str, priority: int = PRIORITY_INTERACTIVE):
+        """Ждет токены в бакете эндпоинта (если задан) и в общем бакете клиента; интерактивные запросы идут первыми."""
+        waited = 0.0
+        endpoint_limiter = self._endpoint_rate_limiters.get(base_endpoint)
+        if endpoint_limiter:
+            waited += await endpoint_limiter.acquire(priority=priority)
+        if self._rate_limiter:
+            waited += await self._rate_limiter.acquire(priority=priority)
+        if waited > 0:
+            logger.debug(f"[{self._client_name}] Throttled {LANE_NAMES.get(priority, priority)} request to {base_endpoint} for {waited:.3f}s.")
+
+    def scheduler_stats(self) -> Dict[str, Any]:
+        """Глубина очередей по классам приоритета: слоты соединений и ожидающие токенов rate limiter'а."""
+        stats: Dict[str, Any] = {"slots": self._request_slots.stats() if self._request_slots else None}
+        buckets = {"client": self._rate_limiter} if self._rate_limiter else {}
+        buckets.update(self._endpoint_rate_limiters)
+        stats["rate_limit_queues"] = {
+            name: {LANE_NAMES.get(p, str(p)): count for p, count in bucket.waiting_by_priority().items()}
+            for name, bucket in buckets.items()
+        }
+        return stats
+
     async def _make_request(self, method: str, endpoint: str, params: Optional[Dict] = None,
-                            json_data: Optional[Dict] = None, timeout: int = 20) -> Optional[Dict]:
+                            json_data: Optional[Dict] = None, timeout: int = 20,
+                            use_cache: bool = True, priority: int = PRIORITY_INTERACTIVE) -> Optional[Dict]:
         if not self._api_key:
             logger.error(f"[{self._client_name}] Cannot make API request to {endpoint}: API Key is missing.")
             return None
@@ -63,49 +274,264 @@ class SnagApiClient:
             "User-Agent": BROWSER_USER_AGENT 
         }
         url = f"{self._base_url}{endpoint}"
-        response_text = ""
+
+        if method.upper() != "GET":
+            return await self._request_with_retries(method, url, endpoint, base_endpoint_for_check_str, headers, request_params, json_data, timeout, priority)
+
+        request_key = make_cache_key(endpoint, request_params)
+        cache_ttl = self._cache_ttls.get(endpoint, 0) if self._response_cache is not None and use_cache else 0
+        if cache_ttl > 0:
+            cached = self._response_cache.get(request_key)
+            self.metrics.record_cache(endpoint, hit=cached is not None)
+            if cached is not None:
+                logger.debug(f"[{self._client_name}] Cache hit: GET {endpoint} | Params: {request_params}")
+                return cached
+
+        # Single-flight: одинаковые GET (эндпоинт + параметры), идущие параллельно, ждут один общий запрос.
+        # Запрос выполняется отдельной задачей, поэтому отмена одного из ожидающих не отменяет его для остальных.
+        inflight = self._inflight_requests.get(request_key)
+        if inflight is not None:
+            self.coalesced_requests += 1
+            self.metrics.record_coalesced(endpoint)
+            logger.debug(f"[{self._client_name}] Coalesced GET {endpoint} | Params: {request_params}")
+            return await asyncio.shield(inflight)
+
+        cache_generation = self._response_cache.generation if cache_ttl > 0 else None
+        inflight = asyncio.ensure_future(
+            self._request_with_retries(method, url, endpoint, base_endpoint_for_check_str, headers, request_params, json_data, timeout, priority)
+        )
+        self._inflight_requests[request_key] = inflight
+        inflight.add_done_callback(lambda _: self._inflight_requests.pop(request_key, None))
+        result = await asyncio.shield(inflight)
+        # Не кэшируем ответ, если пока шел запрос кэш был инвалидирован (например, записью для этого кошелька)
+        if (cache_ttl > 0 and isinstance(result, dict) and not result.get("error")
+                and self._response_cache.generation == cache_generation):
+            self._response_cache.set(request_key, result, cache_ttl, self._wallets_in_response(request_params, result))
+        return result
+
+    async def _request_with_retries(self, method: str, url: str, endpoint: str, base_endpoint: str,
+                                    headers: Dict[str, str], request_params: Dict,
+                                    json_data: Optional[Dict], timeout: int,
+                                    priority: int = PRIORITY_INTERACTIVE) -> Optional[Dict]:
+        # Повторяем только идемпотентные GET-запросы; POST (транзакции, метаданные) отправляем один раз.
+        max_attempts = 1 + (self._max_retries if method.upper() == "GET" else 0)
+        retry_deadline = time.monotonic() + self._retry_budget
+        attempt = 0
+        breaker = self._get_circuit_breaker(base_endpoint)
+        while True:
+            attempt += 1
+            if breaker and not breaker.allow_request():
+                retry_in = breaker.retry_in()
+                self.metrics.record_circuit_rejection(method, endpoint)
+                logger.warning(f"[{self._client_name}] {method} {endpoint}: circuit OPEN, failing fast (next probe in {retry_in:.0f}s).")
+                return {"error": True, "status": "CircuitOpen",
+                        "message": f"Snag API ({self._client_name}) is unavailable for {base_endpoint}; retry in {retry_in:.0f}s."}
+            await self._throttle(base_endpoint, priority)
+            result, retry_after = await self._send_request(method, url, endpoint, headers, request_params, json_data, timeout, priority)
+            if breaker:
+                self._record_circuit_result(breaker, result)
+            if not self._is_retryable_result(result):
+                return result
+            if breaker and breaker.state == STATE_OPEN:
+                # Автомат только что открылся: повторять бессмысленно
+                result["attempts"] = attempt
+                return result
+            if attempt >= max_attempts:
+                if max_attempts > 1:
+                    logger.error(f"[{self._client_name}] {method} {endpoint}: giving up after {attempt} attempts. Last status: {result.get('status')}")
+                    result["attempts"] = attempt
+                return result
+
+            delay = self._compute_retry_delay(attempt, retry_after)
+            if time.monotonic() + delay > retry_deadline:
+                logger.error(f"[{self._client_name}] {method} {endpoint}: retry budget of {self._retry_budget}s exhausted after {attempt} attempts. Last status: {result.get('status')}")
+                result["attempts"] = attempt
+                return result
+            logger.warning(f"[{self._client_name}] {method} {endpoint}: status {result.get('status')}, retrying in {delay:.2f}s (attempt {attempt + 1}/{max_attempts}).")
+            self.metrics.record_retry(method, endpoint)
+            await asyncio.sleep(delay)
+
+    def _get_circuit_breaker(self, base_endpoint: str) -> Optional[CircuitBreaker]:
+        if not self._circuit_failure_threshold:
+            return None
+        breaker = self._circuit_breakers.get(base_endpoint)
+        if breaker is None:
+            breaker = CircuitBreaker(f"{self._client_name}:{base_endpoint}", self._circuit_failure_threshold, self._circuit_recovery_timeout)
+            self._circuit_breakers[base_endpoint] = breaker
+        return breaker
+
+    @staticmethod
+    def _record_circuit_result(breaker: CircuitBreaker, result: Optional[Dict]):
+        status = result.get("status") if isinstance(result, dict) and result.get("error") else None
+        if status in CIRCUIT_FAILURE_STATUSES:
+            breaker.record_failure()
+        elif status != 429:
+            # Любой ответ API (включая 4xx) означает, что сервис доступен
+            breaker.record_success()
+
+    def circuit_states(self) -> Dict[str, Dict[str, Any]]:
+        """Состояние автоматов по эндпоинтам: state, retry_in (сек), consecutive_failures, rejected_requests."""
+        return {
+            endpoint: {
+                "state": breaker.state,
+                "retry_in": breaker.retry_in(),
+                "consecutive_failures": breaker.consecutive_failures,
+                "rejected_requests": breaker.rejected_requests,
+            }
+            for endpoint, breaker in self._circuit_breakers.items()
+        }
+
+    @staticmethod
+    def _wallets_in_response(request_params: Dict, result: Dict) -> List[str]:
+        """Кошельки, к которым относится ответ: из запроса и из самих записей (для поиска по Discord/Twitter)."""
+        wallets = [request_params.get('walletAddress')]
+        items = result.get("data")
+        if isinstance(items, list):
+            for item in items:
+                if not isinstance(item, dict):
+                    continue
+                wallets.append(item.get("walletAddress"))
+                user = item.get("user") or (item.get("loyaltyAccount") or {}).get("user")
+                if isinstance(user, dict):
+                    wallets.append(user.get("walletAddress"))
+        return [w for w in wallets if isinstance(w, str) and w]
+
+    # --- КЭШ ОТВЕТОВ ---
+    def invalidate_wallet(self, wallet_address: Optional[str]) -> int:
+        """Сбрасывает все закэшированные ответы, относящиеся к кошельку."""
+        return self._response_cache.invalidate_wallet(wallet_address) if self._response_cache is not None else 0
+
+    def invalidate_cache(self, endpoint: Optional[str] = None) -> int:
+        """Сбрасывает кэш эндпоинта или весь кэш клиента, если endpoint не указан."""
+        if self._response_cache is None:
+            return 0
+        if endpoint:
+            return self._response_cache.invalidate_endpoint(endpoint)
+        removed = len(self._response_cache)
+        self._response_cache.clear()
+        return removed
+
+    def cache_stats(self) -> Optional[Dict[str, Any]]:
+        return self._response_cache.stats() if self._response_cache is not None else None
+
+    def add_write_listener(self, callback: Callable[[str, List[str]], None]):
+        """Регистрирует колбэк (эндпоинт, кошельки), вызываемый после каждой записи (для внешних кэшей)."""
+        self._write_listeners.append(callback)
+
+    def _invalidate_after_write(self, endpoint: str, wallets: List[Optional[str]]):
+        # Сбрасываем кэш и при ошибке: запись могла частично примениться на стороне API
+        affected = sorted({w.lower() for w in wallets if isinstance(w, str) and w})
+        for wallet in affected:
+            self.invalidate_wallet(wallet)
+        if affected:
+            self._notify_write_listeners(endpoint, affected)
+
+    def _notify_write_listeners(self, endpoint: str, wallets: List[str]):
+        for listener in self._write_listeners:
+            try:
+                listener(endpoint, wallets)
+            except Exception as e:
+                logger.error(f"[{self._client_name}] Write listener {listener!r} failed: {e}")
+
+    def _is_retryable_result(self, result: Optional[Dict]) -> bool:
+        if not isinstance(result, dict) or not result.get("error"):
+            return False
+        return result.get("status") in RETRYABLE_STATUSES
+
+    def _compute_retry_delay(self, attempt: int, retry_after: Optional[float]) -> float:
+        """Экспоненциальная задержка с полным джиттером; Retry-After от сервера имеет приоритет."""
+        if retry_after is not None:
+            return max(0.0, retry_after) + random.uniform(0, self._retry_backoff_base)
+        backoff_cap = min(self._retry_backoff_max, self._retry_backoff_base * (2 ** (attempt - 1)))
+        return random.uniform(0, backoff_cap)
+
+    @staticmethod
+    def _parse_retry_after(header_value: Optional[str]) -> Optional[float]:
+        """Retry-After бывает либо числом секунд, либо HTTP-датой."""
+        if not header_value:
+            return None
+        try:
+            return float(header_value)
+        except ValueError:
+            pass
+        try:
+            retry_at = email.utils.parsedate_to_datetime(header_value)
+        except (TypeError, ValueError):
+            return None
+        if retry_at.tzinfo is None:
+            retry_at = retry_at.replace(tzinfo=datetime.timezone.utc)
+        return max(0.0, (retry_at - datetime.datetime.now(datetime.timezone.utc)).total_seconds())
+
+    async def _send_request(self, method: str, url: str, endpoint: str, headers: Dict[str, str],
+                            request_params: Dict, json_data: Optional[Dict], timeout: int,
+                            priority: int = PRIORITY_INTERACTIVE) -> Tuple[Optional[Dict], Optional[float]]:
+        """Одна попытка запроса. Возвращает (результат в прежнем формате, Retry-After в секундах или None)."""
+        async with self._request_slots.slot(priority) if self._request_slots else contextlib.nullcontext():
+            # Задержку меряем после получения слота: ожидание в очереди клиента - не задержка API
+            started_at = time.monotonic()
+            result, retry_after, status, bytes_received = await self._perform_request(
+                method, url, endpoint, headers, request_params, json_data, timeout
+            )
+            self.metrics.record_response(method, endpoint, status, time.monotonic() - started_at, bytes_received)
+        return result, retry_after
+
+    async def _perform_request(self, method: str, url: str, endpoint: str, headers: Dict[str, str],
+                               request_params: Dict, json_data: Optional[Dict],
+                               timeout: int) -> Tuple[Optional[Dict], Optional[float], Any, int]:
+        """HTTP-запрос внутри слота. Возвращает (результат, Retry-After, статус для метрик, байт получено)."""
+        raw_body = b""
+        retry_after: Optional[float] = None
         try:
             logger.debug(f"[{self._client_name}] API Req: {method} {url} | Params: {request_params} | JSON: {json_data}")
             async with self._session.request(
                 method, url, headers=headers, params=request_params, json=json_data,
                 timeout=aiohttp.ClientTimeout(total=timeout)
             ) as response:
-                response_text = await response.text()
-                log_level = logging.INFO if response.ok else logging.ERROR
-                logger.log(log_level, f"[{self._client_name}] API Resp {method} {url.split('?')[0]}: Status {response.status} | Resp text (first 300): {response_text[:300]}")
+                raw_body = await response.read()
+                # Тело ответа форматируем только для ошибок и при включенном DEBUG:
+                # на страницах в 1000 записей это заметная лишняя работа на каждый запрос.
+                if not response.ok:
+                    logger.error(f"[{self._client_name}] API Resp {method} {url.split('?')[0]}: Status {response.status} | Resp text (first 300): {_body_snippet(raw_body, 300)}")
+                else:
+                    logger.info(f"[{self._client_name}] API Resp {method} {url.split('?')[0]}: Status {response.status} | {len(raw_body)} bytes")
+                    if logger.isEnabledFor(logging.DEBUG):
+                        logger.debug(f"[{self._client_name}] Resp text (first 300): {_body_snippet(raw_body, 300)}")
+                if response.status in RETRYABLE_STATUSES:
+                    retry_after = self._parse_retry_after(response.headers.get("Retry-After"))
                 response.raise_for_status() # Вызовет ошибку для статусов 4xx/5xx
 
                 # Обрабатываем ВСЕ успешные ответы с пустым телом как успех.
                 # Это включает и 204 No Content, и 200 OK с пустым телом.
-                if not response_text.strip(): 
+                if not raw_body.strip(): 
                     logger.info(f"[{self._client_name}] Handled successful response (Status: {response.status}) with empty body.")
-                    return {"success": True, "status": response.status, "message": "Operation successful, no content returned."}
+                    return {"success": True, "status": response.status, "message": "Operation successful, no content returned."}, None, response.status, len(raw_body)
 
-                # Теперь мы уверены, что response_text не пустой, можно декодировать.
-                return json.loads(response_text)
+                # Теперь мы уверены, что тело не пустое, можно декодировать.
+                return _json_loads(raw_body), None, response.status, len(raw_body)
         except json.JSONDecodeError:
              status_code = response.status if 'response' in locals() and hasattr(response, 'status') else 'N/A'
-             logger.error(f"[{self._client_name}] JSON Decode Error for {endpoint}. Status: {status_code}. Raw Text (first 200): {response_text[:200]}...")
-             return {"error": True, "status": "JSONDecodeError", "message": "Failed to decode JSON response.", "raw_response": response_text[:1000]}
+             logger.error(f"[{self._client_name}] JSON Decode Error for {endpoint}. Status: {status_code}. Raw Text (first 200): {_body_snippet(raw_body, 200)}...")
+             return {"error": True, "status": "JSONDecodeError", "message": "Failed to decode JSON response.", "raw_response": _body_snippet(raw_body, 1000)}, None, "JSONDecodeError", len(raw_body)
         except asyncio.TimeoutError:
             logger.error(f"[{self._client_name}] API Request {method} {endpoint}: Request timed out after {timeout} seconds.")
-            return {"error": True, "status": "TimeoutError", "message": f"Request timed out after {timeout} seconds."}
+            return {"error": True, "status": "TimeoutError", "message": f"Request timed out after {timeout} seconds."}, None, "TimeoutError", len(raw_body)
         except aiohttp.ClientResponseError as e:
             logger.error(f"[{self._client_name}] HTTP Error {e.status} for {method} {endpoint} - {e.message}. Full response was logged.")
-            return {"error": True, "status": e.status, "message": e.message, "raw_response": response_text[:1000]}
+            return {"error": True, "status": e.status, "message": e.message, "raw_response": _body_snippet(raw_body, 1000)}, retry_after, e.status, len(raw_body)
         except aiohttp.ClientConnectionError as e:
              logger.error(f"[{self._client_name}] API Request {method} {endpoint}: Connection Error - {e}")
-             return {"error": True, "status": "ConnectionError", "message": f"Connection Error: {e}"}
+             return {"error": True, "status": "ConnectionError", "message": f"Connection Error: {e}"}, None, "ConnectionError", len(raw_body)
         except Exception as e:
             logger.exception(f"[{self._client_name}] Unexpected API Error for {endpoint}")
-            return {"error": True, "status": "Exception", "message": f"Unexpected error: {e}"}
+            return {"error": True, "status": "Exception", "message": f"Unexpected error: {e}"}, None, "Exception", len(raw_body)
 
     # --- НОВЫЙ УНИФИЦИРОВАННЫЙ МЕТОД ---
     async def get_user_data(self, 
                             wallet_address: Optional[str] = None, 
                             discord_user: Optional[str] = None, 
                             twitter_user: Optional[str] = None,
-                            user_id: Optional[str] = None) -> Optional[Dict]:
+                            user_id: Optional[str] = None,
+                            priority: int = PRIORITY_INTERACTIVE) -> Optional[Dict]:
         """
         Унифицированный метод для получения данных пользователя по любому основному идентификатору.
         Использует эндпоинт GET /api/users.
@@ -123,40 +549,47 @@ class SnagApiClient:
             logger.error(f"[{self._client_name}] get_user_data called without any identifier.")
             return {"error": True, "status": "ClientError", "message": "No identifier provided to get_user_data."}
         
-        return await self._make_request("GET", GET_USER_ENDPOINT, params=params)
+        return await self._make_request("GET", GET_USER_ENDPOINT, params=params, priority=priority)
 
-    async def get_all_accounts_for_wallet(self, wallet_address: str, limit: int = 100) -> Optional[Dict]:
+    async def get_all_accounts_for_wallet(self, wallet_address: str, limit: int = 100,
+                                          starting_after: Optional[str] = None,
+                                          priority: int = PRIORITY_INTERACTIVE) -> Optional[Dict]:
         params = {'walletAddress': wallet_address, 'limit': limit}
-        return await self._make_request("GET", ACCOUNTS_ENDPOINT, params=params)
+        if starting_after: params['startingAfter'] = starting_after
+        return await self._make_request("GET", ACCOUNTS_ENDPOINT, params=params, priority=priority)
 
     async def get_transaction_entries(self, wallet_address: Optional[str] = None,
                                       rule_id: Optional[str] = None, direction: Optional[str] = None,
                                       limit: int = 100, starting_after: Optional[str] = None,
-                                      exclude_deleted_currency: bool = True) -> Optional[Dict]:
+                                      exclude_deleted_currency: bool = True,
+                                      priority: int = PRIORITY_INTERACTIVE) -> Optional[Dict]:
         params = {'limit': limit}
         if wallet_address: params['walletAddress'] = wallet_address
         if rule_id: params['loyaltyRuleId'] = rule_id
         if direction: params['direction'] = direction
         if starting_after: params['startingAfter'] = starting_after
         params['excludeDeletedCurrency'] = str(exclude_deleted_currency).lower()
-        return await self._make_request("GET", TRANSACTION_ENTRIES_ENDPOINT, params=params, timeout=30)
+        return await self._make_request("GET", TRANSACTION_ENTRIES_ENDPOINT, params=params, timeout=30, priority=priority)
 
-    async def get_currencies(self, limit: int = 100, include_deleted: bool = True) -> Optional[Dict]:
+    async def get_currencies(self, limit: int = 100, include_deleted: bool = True,
+                             priority: int = PRIORITY_INTERACTIVE) -> Optional[Dict]:
         params = {'limit': limit, 'includeDeleted': str(include_deleted).lower()}
-        return await self._make_request("GET", CURRENCIES_ENDPOINT, params=params)
+        return await self._make_request("GET", CURRENCIES_ENDPOINT, params=params, priority=priority)
 
     async def get_referrals(self, referrer_wallet: str, limit: int = 50,
-                           starting_after: Optional[str] = None, include_eligibility: bool = True) -> Optional[Dict]:
+                           starting_after: Optional[str] = None, include_eligibility: bool = True,
+                           priority: int = PRIORITY_INTERACTIVE) -> Optional[Dict]:
          params = {'walletAddress': referrer_wallet, 'limit': limit, 'includeEligibility': str(include_eligibility).lower()}
          if starting_after: params['startingAfter'] = starting_after
-         return await self._make_request("GET", REFERRALS_ENDPOINT, params=params)
+         return await self._make_request("GET", REFERRALS_ENDPOINT, params=params, priority=priority)
 
     async def get_badges_by_wallet(self, wallet_address: str, limit: int = 100,
                                    starting_after: Optional[str] = None,
-                                   include_deleted: bool = False) -> Optional[Dict]:
+                                   include_deleted: bool = False,
+                                   priority: int = PRIORITY_INTERACTIVE) -> Optional[Dict]:
         params = {'walletAddress': wallet_address, 'limit': limit, 'includeDeleted': str(include_deleted).lower()}
         if starting_after: params['startingAfter'] = starting_after
-        return await self._make_request("GET", BADGES_ENDPOINT, params=params)
+        return await self._make_request("GET", BADGES_ENDPOINT, params=params, priority=priority)
 
     async def get_loyalty_rules(self, 
                                 limit: int = 100, 
@@ -166,7 +599,9 @@ class SnagApiClient:
                                 hide_in_ui: Optional[bool] = None, 
                                 loyalty_rule_id: Optional[str] = None,
                                 organization_id_filter: Optional[str] = None, # <--- ИЗМЕНЕНО: Используем правильные имена ключей для API
-                                website_id_filter: Optional[str] = None       # <--- ИЗМЕНЕНО: Используем правильные имена ключей для API
+                                website_id_filter: Optional[str] = None,      # <--- ИЗМЕНЕНО: Используем правильные имена ключей для API
+                                priority: int = PRIORITY_INTERACTIVE,
+                                use_cache: bool = True
                                 ) -> Optional[Dict]:
         params = {'limit': limit, 'includeDeleted': str(include_deleted).lower()}
         if starting_after: params['startingAfter'] = starting_after
@@ -181,14 +616,17 @@ class SnagApiClient:
         if website_id_filter:
             params['websiteId'] = website_id_filter         # Ключ 'websiteId' для API
             
-        return await self._make_request("GET", RULES_ENDPOINT, params=params)
+        return await self._make_request("GET", RULES_ENDPOINT, params=params, priority=priority, use_cache=use_cache)
 
-    async def get_loyalty_rule_details(self, rule_id: str, organization_id_filter: Optional[str] = None, website_id_filter: Optional[str] = None) -> Optional[Dict[str, Any]]:
+    async def get_loyalty_rule_details(self, rule_id: str, organization_id_filter: Optional[str] = None, website_id_filter: Optional[str] = None,
+                                       use_cache: bool = True) -> Optional[Dict[str, Any]]:
+        # use_cache=False - для чтения перед полной перезаписью правила (read-modify-write)
         response = await self.get_loyalty_rules(
             loyalty_rule_id=rule_id, 
             limit=1,
             organization_id_filter=organization_id_filter, # Передаем дальше
-            website_id_filter=website_id_filter         # Передаем дальше
+            website_id_filter=website_id_filter,        # Передаем дальше
+            use_cache=use_cache
         )
         if response and not response.get("error") and isinstance(response.get("data"), list):
             if response["data"]:
@@ -203,27 +641,101 @@ class SnagApiClient:
         logger.error(f"[{self._client_name}] Unexpected response or format when fetching rule ID {rule_id}: {response}")
         return {"error": True, "status": "InternalFormatError", "message": "Unexpected response format from API when fetching rule details."}
 
-    async def create_transaction(self, tx_data: Dict[str, Any]) -> Optional[Dict]:
+    # --- ПОСТРАНИЧНЫЕ ИТЕРАТОРЫ ---
+    def iter_transaction_entries(self, wallet_address: Optional[str] = None,
+                                 rule_id: Optional[str] = None, direction: Optional[str] = None,
+                                 page_size: int = 1000, exclude_deleted_currency: bool = True,
+                                 max_pages: Optional[int] = None, prefetch: bool = False,
+                                 starting_after: Optional[str] = None,
+                                 priority: int = PRIORITY_INTERACTIVE) -> SnagPageIterator:
+        async def fetch_page(cursor: Optional[str]) -> Optional[Dict]:
+            return await self.get_transaction_entries(
+                wallet_address=wallet_address, rule_id=rule_id, direction=direction,
+                limit=page_size, starting_after=cursor, exclude_deleted_currency=exclude_deleted_currency,
+                priority=priority
+            )
+        return SnagPageIterator(fetch_page, max_pages=max_pages, prefetch=prefetch, starting_after=starting_after,
+                                description=f"[{self._client_name}] transaction entries")
+
+    def iter_loyalty_rules(self, page_size: int = 1000, include_deleted: bool = False,
+                           is_active: Optional[bool] = None, hide_in_ui: Optional[bool] = None,
+                           organization_id_filter: Optional[str] = None, website_id_filter: Optional[str] = None,
+                           max_pages: Optional[int] = None, prefetch: bool = False,
+                           priority: int = PRIORITY_INTERACTIVE) -> SnagPageIterator:
+        async def fetch_page(cursor: Optional[str]) -> Optional[Dict]:
+            return await self.get_loyalty_rules(
+                limit=page_size, starting_after=cursor, include_deleted=include_deleted,
+                is_active=is_active, hide_in_ui=hide_in_ui,
+                organization_id_filter=organization_id_filter, website_id_filter=website_id_filter,
+                priority=priority
+            )
+        return SnagPageIterator(fetch_page, max_pages=max_pages, prefetch=prefetch,
+                                description=f"[{self._client_name}] loyalty rules")
+
+    def iter_badges_by_wallet(self, wallet_address: str, page_size: int = 1000, include_deleted: bool = False,
+                              max_pages: Optional[int] = None, prefetch: bool = False,
+                              priority: int = PRIORITY_INTERACTIVE) -> SnagPageIterator:
+        async def fetch_page(cursor: Optional[str]) -> Optional[Dict]:
+            return await self.get_badges_by_wallet(
+                wallet_address=wallet_address, limit=page_size, starting_after=cursor, include_deleted=include_deleted,
+                priority=priority
+            )
+        return SnagPageIterator(fetch_page, max_pages=max_pages, prefetch=prefetch,
+                                description=f"[{self._client_name}] badges")
+
+    def iter_referrals(self, referrer_wallet: str, page_size: int = 50, include_eligibility: bool = True,
+                       max_pages: Optional[int] = None, prefetch: bool = False,
+                       priority: int = PRIORITY_INTERACTIVE) -> SnagPageIterator:
+        async def fetch_page(cursor: Optional[str]) -> Optional[Dict]:
+            return await self.get_referrals(
+                referrer_wallet, limit=page_size, starting_after=cursor, include_eligibility=include_eligibility,
+                priority=priority
+            )
+        return SnagPageIterator(fetch_page, max_pages=max_pages, prefetch=prefetch,
+                                description=f"[{self._client_name}] referrals")
+
+    def iter_accounts_for_wallet(self, wallet_address: str, page_size: int = 100,
+                                 max_pages: Optional[int] = None, prefetch: bool = False,
+                                 priority: int = PRIORITY_INTERACTIVE) -> SnagPageIterator:
+        async def fetch_page(cursor: Optional[str]) -> Optional[Dict]:
+            return await self.get_all_accounts_for_wallet(wallet_address, limit=page_size, starting_after=cursor, priority=priority)
+        return SnagPageIterator(fetch_page, max_pages=max_pages, prefetch=prefetch,
+                                description=f"[{self._client_name}] accounts")
+
+    async def create_transaction(self, tx_data: Dict[str, Any], priority: int = PRIORITY_INTERACTIVE) -> Optional[Dict]:
         final_tx_data = tx_data.copy()
         # Не добавляем org/website ID автоматически сюда, предполагаем, что они переданы в tx_data, если нужны API в теле
-        return await self._make_request("POST", CREATE_TRANSACTION_ENDPOINT, json_data=final_tx_data)
+        result = await self._make_request("POST", CREATE_TRANSACTION_ENDPOINT, json_data=final_tx_data, priority=priority)
+        entries = final_tx_data.get("entries") or []
+        self._invalidate_after_write(CREATE_TRANSACTION_ENDPOINT, [e.get("walletAddress") for e in entries if isinstance(e, dict)])
+        return result
 
     async def reward_badge(self, badge_id: str, data: Dict[str, Any]) -> Optional[Dict]:
         endpoint = f"{BADGES_ENDPOINT}/{badge_id}/reward"
         final_data = data.copy()
-        return await self._make_request("POST", endpoint, json_data=final_data)
+        result = await self._make_request("POST", endpoint, json_data=final_data)
+        self._invalidate_after_write(endpoint, [final_data.get("walletAddress")])
+        return result
     
     async def complete_loyalty_rule(self, rule_id: str, data: Dict[str, Any]) -> Optional[Dict]:
         endpoint = f"{RULES_ENDPOINT}/{rule_id}/complete"
         final_data = data.copy()
-        return await self._make_request("POST", endpoint, json_data=final_data)
+        result = await self._make_request("POST", endpoint, json_data=final_data)
+        self._invalidate_after_write(endpoint, [final_data.get("walletAddress")])
+        return result
 
     async def update_loyalty_rule(self, rule_id: str, update_data: Dict[str, Any]) -> Optional[Dict]:
         endpoint = f"{RULES_ENDPOINT}/{rule_id}"
-        return await self._make_request("POST", endpoint, json_data=update_data)
+        result = await self._make_request("POST", endpoint, json_data=update_data)
+        self.invalidate_cache(RULES_ENDPOINT)
+        # Кошельков у правила нет, но слушателям (каталог правил) важен сам факт изменения
+        self._notify_write_listeners(endpoint, [])
+        return result
     
-    async def create_user_metadata(self, metadata_payload: Dict[str, Any]) -> Optional[Dict]:
+    async def create_user_metadata(self, metadata_payload: Dict[str, Any], priority: int = PRIORITY_INTERACTIVE) -> Optional[Dict]:
         """
         Creates or updates user metadata. This is used for wallet transfers.
         """
-        return await self._make_request("POST", USER_METADATAS_ENDPOINT, json_data=metadata_payload)
\ No newline at end of file
+        result = await self._make_request("POST", USER_METADATAS_ENDPOINT, json_data=metadata_payload, priority=priority)
+        self._invalidate_after_write(USER_METADATAS_ENDPOINT, [metadata_payload.get("walletAddress")])
+        return result
@@ -0,0 +1,99 @@
+# utils/transaction_records.py
+import datetime
+import logging
+import sys
+from datetime import timezone
+from decimal import Decimal, InvalidOperation
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+UNKNOWN_TRANSACTION_NAME = "Unknown Transaction"
+# Суммы квестов повторяются: одинаковые Decimal (неизменяемые) делятся между записями
+AMOUNT_CACHE_SIZE = 4096
+_amount_cache: Dict[str, Decimal] = {}
+# Ключ сортировки для записей без даты: они оказываются в конце (самые старые)
+OLDEST = datetime.datetime.min.replace(tzinfo=timezone.utc)
+
+
+def parse_api_datetime(value: Optional[str]) -> Optional[datetime.datetime]:
+    """Дата из API ("2024-01-31T12:00:00.000Z") в UTC, с точностью до секунды; None - не удалось разобрать."""
+    if not value: return None
+    try:
+        return datetime.datetime.strptime(value.split('.')[0].replace('Z', ''), '%Y-%m-%dT%H:%M:%S').replace(tzinfo=timezone.utc)
+    except ValueError:
+        return None
+
+
+def entry_display_name(entry: Dict[str, Any]) -> str:
+    """Название записи: имя правила, иначе описание транзакции лояльности, иначе описание самой записи."""
+    loyalty_transaction = entry.get("loyaltyTransaction")
+    if isinstance(loyalty_transaction, dict):
+        loyalty_rule = loyalty_transaction.get("loyaltyRule")
+        if isinstance(loyalty_rule, dict):
+            name_from_rule = loyalty_rule.get("name")
+            if name_from_rule and name_from_rule.strip(): return name_from_rule.strip()
+        desc_from_lt = loyalty_transaction.get("description")
+        if desc_from_lt and desc_from_lt.strip(): return desc_from_lt.strip()
+    desc_from_entry = entry.get("description")
+    if desc_from_entry and desc_from_entry.strip(): return desc_from_entry.strip()
+    return UNKNOWN_TRANSACTION_NAME
+
+
+def _intern(value: Any) -> Optional[str]:
+    return sys.intern(value) if isinstance(value, str) else None
+
+
+def _parse_amount(raw_amount: Any) -> Optional[Decimal]:
+    if raw_amount is None:
+        return None
+    key = str(raw_amount)
+    amount = _amount_cache.get(key)
+    if amount is None:
+        try:
+            amount = Decimal(key)
+        except (InvalidOperation, ValueError):
+            return None
+        if len(_amount_cache) < AMOUNT_CACHE_SIZE:
+            _amount_cache[key] = amount
+    return amount
+
+
+class TransactionRecord:
+    """
+    Компактная запись истории для пагинаторов: только поля, которые показываются в embed.
+    Сырой ответ API (вложенные loyaltyTransaction, loyaltyRule, user и т.д.) не хранится.
+    Направление, валюта, имя правила и сумма общие для одинаковых записей: у тысяч записей
+    кошелька это обычно несколько десятков разных значений.
+    Дата разбирается один раз при создании записи, а не при каждой отрисовке страницы.
+    """
+    __slots__ = ("created_at", "raw_created_at", "amount", "direction", "currency_id", "rule_name")
+
+    def __init__(self, created_at: Optional[datetime.datetime], amount: Optional[Decimal], direction: Optional[str],
+                 currency_id: Optional[str], rule_name: str, raw_created_at: Optional[str] = None):
+        self.created_at = created_at            # None - даты нет или она не разобралась
+        self.raw_created_at = raw_created_at    # исходная строка, только если ее не удалось разобрать
+        self.amount = amount                    # None - сумма отсутствует или не число
+        self.direction = direction
+        self.currency_id = currency_id
+        self.rule_name = rule_name
+
+    @classmethod
+    def from_entry(cls, entry: Dict[str, Any]) -> "TransactionRecord":
+        raw_created_at = entry.get("createdAt") if isinstance(entry.get("createdAt"), str) else None
+        created_at = parse_api_datetime(raw_created_at)
+        if raw_created_at and created_at is None:
+            logger.warning(f"Could not parse date format: {raw_created_at}")
+        return cls(
+            created_at, _parse_amount(entry.get("amount")),
+            _intern(entry.get("direction")), _intern(entry.get("loyaltyCurrencyId")),
+            sys.intern(entry_display_name(entry)), raw_created_at if created_at is None else None,
+        )
+
+    @property
+    def sort_key(self) -> datetime.datetime:
+        return self.created_at or OLDEST
+
+    def __repr__(self) -> str:
+        return (f"TransactionRecord(created_at={(self.created_at.isoformat() if self.created_at else self.raw_created_at)!r}, amount={self.amount!r}, direction={self.direction!r}, "
+                f"currency_id={self.currency_id!r}, rule_name={self.rule_name!r})")
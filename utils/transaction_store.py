@@ -0,0 +1,569 @@
+# utils/transaction_store.py
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from decimal import Decimal, InvalidOperation
+from typing import Any, AsyncIterator, Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+from utils.priority_scheduler import PRIORITY_INTERACTIVE
+from utils.snag_api_client import SnagPageIterator
+
+logger = logging.getLogger(__name__)
+
+# Размер первой страницы при догрузке новых записей: обычно новых записей немного,
+# и не нужно каждый раз скачивать 1000 уже известных.
+HEAD_PAGE_SIZE = 100
+# Сколько сохраненных записей читается (и разбирается из JSON) за один заход в отдельном потоке
+STORED_CHUNK_SIZE = 1000
+
+
+class WalletSyncState:
+    """Что известно о кошельке: самая новая запись, курсор догрузки старых записей и полнота истории."""
+    __slots__ = ("newest_entry_id", "newest_created_at", "oldest_cursor", "complete", "synced_at")
+
+    def __init__(self, newest_entry_id: Optional[str], newest_created_at: Optional[str],
+                 oldest_cursor: Optional[str], complete: bool, synced_at: float):
+        self.newest_entry_id = newest_entry_id
+        self.newest_created_at = newest_created_at
+        self.oldest_cursor = oldest_cursor
+        self.complete = complete
+        self.synced_at = synced_at
+
+
+class WalletAggregates:
+    """
+    Сводка по истории кошелька: суммы кредитов/дебетов по валютам, выполнения квестов по правилам
+    (кредиты с loyaltyRule), первая и последняя активность. Складывается из записей по мере их загрузки.
+    """
+    __slots__ = ("currency_totals", "rule_completions", "first_activity", "last_activity", "entries")
+
+    def __init__(self):
+        self.currency_totals: Dict[str, Dict[str, Decimal]] = {}  # валюта -> {"credit": ..., "debit": ...}
+        self.rule_completions: Dict[str, Dict[str, Any]] = {}    # ID правила -> {"name": ..., "count": ...}
+        self.first_activity: Optional[str] = None
+        self.last_activity: Optional[str] = None
+        self.entries = 0
+
+    @classmethod
+    def from_entries(cls, entries: Iterable[Dict[str, Any]]) -> "WalletAggregates":
+        aggregates = cls()
+        for entry in entries:
+            aggregates.add(entry)
+        return aggregates
+
+    def add(self, entry: Dict[str, Any]):
+        self.entries += 1
+        created_at = entry.get("createdAt")
+        if created_at:
+            if self.first_activity is None or created_at < self.first_activity: self.first_activity = created_at
+            if self.last_activity is None or created_at > self.last_activity: self.last_activity = created_at
+        direction = entry.get("direction")
+        currency_id = entry.get("loyaltyCurrencyId")
+        if currency_id and direction in ("credit", "debit"):
+            try:
+                amount = Decimal(str(entry.get("amount", "0")))
+            except (InvalidOperation, ValueError):
+                amount = None
+            if amount is not None:
+                totals = self.currency_totals.setdefault(currency_id, {"credit": Decimal('0'), "debit": Decimal('0')})
+                totals[direction] += amount
+        if direction == "credit":
+            loyalty_transaction = entry.get("loyaltyTransaction")
+            loyalty_rule = loyalty_transaction.get("loyaltyRule") if isinstance(loyalty_transaction, dict) else None
+            if isinstance(loyalty_rule, dict) and loyalty_rule.get("name"):
+                rule_key = loyalty_rule.get("id") or loyalty_rule["name"]
+                completion = self.rule_completions.setdefault(rule_key, {"name": loyalty_rule["name"], "count": 0})
+                completion["count"] += 1
+
+    def credits(self, currency_id: str) -> Decimal:
+        return self.currency_totals.get(currency_id, {}).get("credit", Decimal('0'))
+
+    def debits(self, currency_id: str) -> Decimal:
+        return self.currency_totals.get(currency_id, {}).get("debit", Decimal('0'))
+
+    @property
+    def total_completions(self) -> int:
+        return sum(completion["count"] for completion in self.rule_completions.values())
+
+    def top_rules(self, limit: int = 10) -> List[Dict[str, Any]]:
+        """Правила с наибольшим числом выполнений: [{"rule_id", "name", "count"}]."""
+        ranked = sorted(self.rule_completions.items(), key=lambda item: (-item[1]["count"], item[1]["name"]))
+        return [{"rule_id": rule_id, "name": completion["name"], "count": completion["count"]} for rule_id, completion in ranked[:limit]]
+
+
+class TransactionStore:
+    """
+    Локальное хранилище записей transaction_entries по кошелькам в SQLite.
+
+    Для каждого кошелька помнится самая новая известная запись и курсор самой старой
+    загруженной страницы. Повторный запрос скачивает только записи новее известной,
+    а если история была загружена не полностью, продолжает с сохраненного курсора.
+    Хранятся записи, запрошенные с excludeDeletedCurrency=false (полная история).
+    Вместе с записями обновляется сводка WalletAggregates, так что статистика не требует обхода истории.
+    Сохраненная история читается порциями по ключу (created_at, entry_id) в отдельном потоке через
+    свое соединение, а запись (с сериализацией в JSON) тоже идет в отдельном потоке под `_write_lock`,
+    чтобы длинная история не блокировала event loop. Асинхронные методы (load_state, save_entries,
+    save_state, restart_wallet, get_aggregates) - для кода в event loop; синхронные - для потоков.
+    """
+    def __init__(self, path: str, fresh_ttl: float = 15.0):
+        self.path = path
+        self.fresh_ttl = max(0.0, float(fresh_ttl))
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS transaction_entries (
+                   system TEXT NOT NULL,
+                   wallet TEXT NOT NULL,
+                   entry_id TEXT NOT NULL,
+                   created_at TEXT NOT NULL,
+                   data TEXT NOT NULL,
+                   PRIMARY KEY (system, wallet, entry_id)
+               )"""
+        )
+        # Индекс под чтение порциями: ORDER BY created_at DESC, entry_id DESC без сортировки всей истории
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_transaction_entries_keyset ON transaction_entries (system, wallet, created_at, entry_id)"
+        )
+        self._conn.execute("DROP INDEX IF EXISTS idx_transaction_entries_created")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS wallet_sync (
+                   system TEXT NOT NULL,
+                   wallet TEXT NOT NULL,
+                   newest_entry_id TEXT,
+                   newest_created_at TEXT,
+                   oldest_cursor TEXT,
+                   complete INTEGER NOT NULL DEFAULT 0,
+                   synced_at REAL NOT NULL,
+                   PRIMARY KEY (system, wallet)
+               )"""
+        )
+        # Сводки по кошелькам, обновляются при добавлении новых записей
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS wallet_currency_totals (
+                   system TEXT NOT NULL,
+                   wallet TEXT NOT NULL,
+                   currency_id TEXT NOT NULL,
+                   credits TEXT NOT NULL,
+                   debits TEXT NOT NULL,
+                   PRIMARY KEY (system, wallet, currency_id)
+               )"""
+        )
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS wallet_rule_completions (
+                   system TEXT NOT NULL,
+                   wallet TEXT NOT NULL,
+                   rule_id TEXT NOT NULL,
+                   rule_name TEXT NOT NULL,
+                   completions INTEGER NOT NULL,
+                   PRIMARY KEY (system, wallet, rule_id)
+               )"""
+        )
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS wallet_activity (
+                   system TEXT NOT NULL,
+                   wallet TEXT NOT NULL,
+                   first_activity TEXT,
+                   last_activity TEXT,
+                   entries INTEGER NOT NULL,
+                   PRIMARY KEY (system, wallet)
+               )"""
+        )
+        self._conn.commit()
+        # Чтения из потоков идут через отдельное соединение (в WAL они не мешают записи); в памяти база одна на соединение
+        self._write_lock = threading.RLock()   # все обращения к self._conn
+        self._read_conn = self._conn if path == ":memory:" else sqlite3.connect(path, check_same_thread=False)
+        self._read_lock = self._write_lock if self._read_conn is self._conn else threading.Lock()
+        self._background_tasks: Set[asyncio.Task] = set()
+        logger.info(f"TransactionStore opened at {path} (fresh {self.fresh_ttl:.0f}s).")
+
+    def close(self):
+        try:
+            if self._read_conn is not self._conn:
+                self._read_conn.close()
+            self._conn.close()
+        except sqlite3.Error as e:
+            logger.warning(f"TransactionStore: error closing database: {e}")
+
+    # --- Чтение и запись ---
+    async def load_state(self, system: str, wallet: str) -> Optional[WalletSyncState]:
+        return await asyncio.to_thread(self.get_state, system, wallet)
+
+    async def save_state(self, system: str, wallet: str, state: WalletSyncState):
+        await asyncio.to_thread(self._save_state, system, wallet, state)
+
+    async def save_entries(self, system: str, wallet: str, entries: List[Dict[str, Any]]):
+        await asyncio.to_thread(self._save_entries, system, wallet, entries)
+
+    async def restart_wallet(self, system: str, wallet: str, entries: List[Dict[str, Any]], state: WalletSyncState):
+        """Забывает сохраненную историю кошелька и начинает ее заново с `entries` и `state`."""
+        await asyncio.to_thread(self._restart_wallet, system, wallet, entries, state)
+
+    def get_state(self, system: str, wallet: str) -> Optional[WalletSyncState]:
+        try:
+            with self._write_lock:
+                row = self._conn.execute(
+                    "SELECT newest_entry_id, newest_created_at, oldest_cursor, complete, synced_at FROM wallet_sync "
+                    "WHERE system = ? AND wallet = ?", (system, wallet.lower())
+                ).fetchone()
+        except sqlite3.Error as e:
+            logger.error(f"TransactionStore: state read failed for {system}/{wallet}: {e}")
+            return None
+        if not row:
+            return None
+        newest_entry_id, newest_created_at, oldest_cursor, complete, synced_at = row
+        return WalletSyncState(newest_entry_id, newest_created_at, oldest_cursor, bool(complete), synced_at)
+
+    def _save_state(self, system: str, wallet: str, state: WalletSyncState):
+        try:
+            with self._write_lock, self._conn:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO wallet_sync (system, wallet, newest_entry_id, newest_created_at, oldest_cursor, complete, synced_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (system, wallet.lower(), state.newest_entry_id, state.newest_created_at,
+                     state.oldest_cursor, int(state.complete), state.synced_at)
+                )
+        except sqlite3.Error as e:
+            logger.error(f"TransactionStore: state write failed for {system}/{wallet}: {e}")
+
+    def _save_entries(self, system: str, wallet: str, entries: Iterable[Dict[str, Any]]):
+        wallet = wallet.lower()
+        by_id = {entry["id"]: entry for entry in entries if isinstance(entry, dict) and entry.get("id")}
+        if not by_id:
+            return
+        rows = [(system, wallet, entry_id, entry.get("createdAt") or "", json.dumps(entry, separators=(",", ":")))
+                for entry_id, entry in by_id.items()]
+        try:
+            with self._write_lock:
+                existing: Set[str] = set()
+                ids = list(by_id)
+                for start in range(0, len(ids), 500):
+                    chunk = ids[start:start + 500]
+                    placeholders = ",".join("?" * len(chunk))
+                    existing.update(entry_id for (entry_id,) in self._conn.execute(
+                        f"SELECT entry_id FROM transaction_entries WHERE system = ? AND wallet = ? AND entry_id IN ({placeholders})",
+                        (system, wallet, *chunk)
+                    ))
+                # В сводку попадают только записи, которых еще не было в хранилище
+                new_aggregates = WalletAggregates.from_entries(entry for entry_id, entry in by_id.items() if entry_id not in existing)
+                with self._conn:
+                    self._conn.executemany(
+                        "INSERT OR REPLACE INTO transaction_entries (system, wallet, entry_id, created_at, data) VALUES (?, ?, ?, ?, ?)",
+                        rows
+                    )
+                    if new_aggregates.entries:
+                        self._apply_aggregates(system, wallet, new_aggregates)
+        except sqlite3.Error as e:
+            logger.error(f"TransactionStore: write failed for {system}/{wallet} ({len(by_id)} entries): {e}")
+
+    def _apply_aggregates(self, system: str, wallet: str, delta: WalletAggregates):
+        """Прибавляет сводку новых записей к сохраненной. Вызывается внутри транзакции под _write_lock."""
+        for currency_id, totals in delta.currency_totals.items():
+            row = self._conn.execute(
+                "SELECT credits, debits FROM wallet_currency_totals WHERE system = ? AND wallet = ? AND currency_id = ?",
+                (system, wallet, currency_id)
+            ).fetchone()
+            credits, debits = (Decimal(row[0]), Decimal(row[1])) if row else (Decimal('0'), Decimal('0'))
+            self._conn.execute(
+                "INSERT OR REPLACE INTO wallet_currency_totals (system, wallet, currency_id, credits, debits) VALUES (?, ?, ?, ?, ?)",
+                (system, wallet, currency_id, str(credits + totals["credit"]), str(debits + totals["debit"]))
+            )
+        self._conn.executemany(
+            "INSERT INTO wallet_rule_completions (system, wallet, rule_id, rule_name, completions) VALUES (?, ?, ?, ?, ?) "
+            "ON CONFLICT (system, wallet, rule_id) DO UPDATE SET completions = completions + excluded.completions, rule_name = excluded.rule_name",
+            [(system, wallet, rule_id, completion["name"], completion["count"]) for rule_id, completion in delta.rule_completions.items()]
+        )
+        self._conn.execute(
+            "INSERT INTO wallet_activity (system, wallet, first_activity, last_activity, entries) VALUES (?, ?, ?, ?, ?) "
+            "ON CONFLICT (system, wallet) DO UPDATE SET "
+            "first_activity = COALESCE(MIN(first_activity, excluded.first_activity), first_activity, excluded.first_activity), "
+            "last_activity = COALESCE(MAX(last_activity, excluded.last_activity), last_activity, excluded.last_activity), "
+            "entries = entries + excluded.entries",
+            (system, wallet, delta.first_activity, delta.last_activity, delta.entries)
+        )
+
+    async def get_aggregates(self, system: str, wallet: str) -> WalletAggregates:
+        """Сводка по сохраненной истории кошелька без обхода записей."""
+        aggregates = await asyncio.to_thread(self._load_aggregates, system, wallet.lower())
+        return aggregates if aggregates is not None else await self._rebuild_aggregates(system, wallet.lower())
+
+    def _load_aggregates(self, system: str, wallet: str) -> Optional[WalletAggregates]:
+        """Сохраненная сводка; None - сводки еще нет и ее нужно пересчитать из записей."""
+        aggregates = WalletAggregates()
+        try:
+            with self._write_lock:
+                activity = self._conn.execute(
+                    "SELECT first_activity, last_activity, entries FROM wallet_activity WHERE system = ? AND wallet = ?",
+                    (system, wallet)
+                ).fetchone()
+                if activity is None:
+                    return None
+                aggregates.first_activity, aggregates.last_activity, aggregates.entries = activity
+                for currency_id, credits, debits in self._conn.execute(
+                    "SELECT currency_id, credits, debits FROM wallet_currency_totals WHERE system = ? AND wallet = ?", (system, wallet)
+                ):
+                    aggregates.currency_totals[currency_id] = {"credit": Decimal(credits), "debit": Decimal(debits)}
+                for rule_id, rule_name, completions in self._conn.execute(
+                    "SELECT rule_id, rule_name, completions FROM wallet_rule_completions WHERE system = ? AND wallet = ?", (system, wallet)
+                ):
+                    aggregates.rule_completions[rule_id] = {"name": rule_name, "count": completions}
+        except sqlite3.Error as e:
+            logger.error(f"TransactionStore: aggregates read failed for {system}/{wallet}: {e}")
+        return aggregates
+
+    async def _rebuild_aggregates(self, system: str, wallet: str) -> WalletAggregates:
+        """Пересчитывает сводку из сохраненных записей (для записей, сохраненных до появления сводок)."""
+        aggregates = WalletAggregates()
+        after: Optional[Tuple[str, str]] = None
+        while True:
+            # Чтение, разбор JSON и подсчет порции - в отдельном потоке
+            count, after = await asyncio.to_thread(self._read_chunk, system, wallet, after, STORED_CHUNK_SIZE, aggregates.add)
+            if count < STORED_CHUNK_SIZE or after is None:
+                break
+        if aggregates.entries:
+            logger.info(f"TransactionStore: rebuilt aggregates for {system}/{wallet} from {aggregates.entries} stored entries.")
+            await asyncio.to_thread(self._store_aggregates, system, wallet, aggregates)
+        return aggregates
+
+    def _store_aggregates(self, system: str, wallet: str, aggregates: WalletAggregates):
+        try:
+            with self._write_lock, self._conn:
+                self._apply_aggregates(system, wallet, aggregates)
+        except sqlite3.Error as e:
+            logger.error(f"TransactionStore: aggregates rebuild failed for {system}/{wallet}: {e}")
+
+    def _read_chunk(self, system: str, wallet: str, after: Optional[Tuple[str, str]], limit: int,
+                    consume: Callable[[Dict[str, Any]], Any]) -> Tuple[int, Optional[Tuple[str, str]]]:
+        """
+        Читает до `limit` записей старше ключа `after` (created_at, entry_id), от новых к старым, и отдает
+        каждую в `consume`. Возвращает число прочитанных строк и ключ последней. Выполняется в потоке.
+        """
+        query = "SELECT created_at, entry_id, data FROM transaction_entries WHERE system = ? AND wallet = ?"
+        params: List[Any] = [system, wallet.lower()]
+        if after is not None:
+            query += " AND (created_at, entry_id) < (?, ?)"
+            params.extend(after)
+        query += " ORDER BY created_at DESC, entry_id DESC LIMIT ?"
+        params.append(limit)
+        try:
+            with self._read_lock:
+                rows = self._read_conn.execute(query, params).fetchall()
+        except sqlite3.Error as e:
+            logger.error(f"TransactionStore: read failed for {system}/{wallet}: {e}")
+            return 0, None
+        for _, _, data in rows:
+            consume(json.loads(data))
+        return len(rows), ((rows[-1][0], rows[-1][1]) if rows else None)
+
+    async def iter_entries(self, system: str, wallet: str, chunk_size: int = STORED_CHUNK_SIZE) -> AsyncIterator[List[Dict[str, Any]]]:
+        """Сохраненные записи кошелька порциями по `chunk_size`, от новых к старым."""
+        after: Optional[Tuple[str, str]] = None
+        while True:
+            chunk: List[Dict[str, Any]] = []
+            count, after = await asyncio.to_thread(self._read_chunk, system, wallet, after, chunk_size, chunk.append)
+            if chunk:
+                yield chunk
+            if count < chunk_size or after is None:
+                return
+
+    def _restart_wallet(self, system: str, wallet: str, entries: List[Dict[str, Any]], state: WalletSyncState):
+        with self._write_lock:
+            self.forget_wallet(system, wallet)
+            self._save_entries(system, wallet, entries)
+            self._save_state(system, wallet, state)
+
+    def forget_wallet(self, system: str, wallet: str):
+        try:
+            with self._write_lock, self._conn:
+                for table in ("transaction_entries", "wallet_sync", "wallet_currency_totals", "wallet_rule_completions", "wallet_activity"):
+                    self._conn.execute(f"DELETE FROM {table} WHERE system = ? AND wallet = ?", (system, wallet.lower()))
+        except sqlite3.Error as e:
+            logger.error(f"TransactionStore: delete failed for {system}/{wallet}: {e}")
+
+    def mark_stale(self, wallets: Iterable[str]) -> int:
+        """Сбрасывает время синхронизации, чтобы следующий запрос сразу проверил новые записи."""
+        wallet_list = [w.lower() for w in wallets if w]
+        if not wallet_list:
+            return 0
+        try:
+            with self._write_lock, self._conn:
+                cursor = self._conn.executemany("UPDATE wallet_sync SET synced_at = 0 WHERE wallet = ?", [(w,) for w in wallet_list])
+            return max(0, cursor.rowcount)
+        except sqlite3.Error as e:
+            logger.error(f"TransactionStore: mark stale failed: {e}")
+            return 0
+
+    def handle_snag_write(self, endpoint: str, wallets: List[str]):
+        """Слушатель записей SnagApiClient: после транзакции у кошелька появляются новые записи."""
+        if not wallets:
+            return
+        try:
+            task = asyncio.get_running_loop().create_task(asyncio.to_thread(self.mark_stale, list(wallets)))
+        except RuntimeError:
+            self.mark_stale(wallets)  # Вне event loop (скрипты) - сразу
+            return
+        self._background_tasks.add(task)
+        task.add_done_callback(self._background_tasks.discard)
+
+    def stats(self) -> Dict[str, int]:
+        try:
+            with self._write_lock:
+                wallets, complete = self._conn.execute("SELECT COUNT(*), SUM(complete) FROM wallet_sync").fetchone()
+                (entries,) = self._conn.execute("SELECT COUNT(*) FROM transaction_entries").fetchone()
+        except sqlite3.Error as e:
+            logger.error(f"TransactionStore: stats query failed: {e}")
+            return {}
+        return {"wallets": wallets, "complete_wallets": complete or 0, "entries": entries}
+
+    # --- Синхронизация с API ---
+    def iter_history(self, client, system: str, wallet: str, page_size: int = 1000,
+                     max_pages: Optional[int] = 20, priority: int = PRIORITY_INTERACTIVE,
+                     include_stored: bool = True) -> "StoredHistoryIterator":
+        return StoredHistoryIterator(self, client, system, wallet, page_size, max_pages, priority, include_stored)
+
+    async def sync(self, client, system: str, wallet: str, page_size: int = 1000,
+                   max_pages: Optional[int] = 20, priority: int = PRIORITY_INTERACTIVE) -> "StoredHistoryIterator":
+        """Догружает новые (и недостающие старые) записи, не читая сохраненные. Сводка после этого актуальна."""
+        history = self.iter_history(client, system, wallet, page_size, max_pages, priority, include_stored=False)
+        async for _ in history.pages():
+            pass
+        return history
+
+
+class StoredHistoryIterator:
+    """
+    История кошелька из TransactionStore, дополненная из API. Интерфейс как у SnagPageIterator:
+    `pages()` отдает страницы от новых записей к старым, после обхода смотрите `error` и
+    `truncated` (история еще не загружена целиком - продолжится при следующем запросе).
+
+    Порядок: новые записи из API (до самой новой известной), затем сохраненные, затем
+    догрузка старых с сохраненного курсора. На все запросы к API одного обхода - max_pages страниц.
+    С include_stored=False сохраненные записи не читаются (нужна только синхронизация и сводка).
+    """
+    def __init__(self, store: TransactionStore, client, system: str, wallet: str,
+                 page_size: int, max_pages: Optional[int], priority: int, include_stored: bool = True):
+        self._store = store
+        self._client = client
+        self.system = system
+        self.wallet = wallet.lower()
+        self.page_size = page_size
+        self.max_pages = max_pages
+        self.priority = priority
+        self.include_stored = include_stored
+        self.pages_fetched = 0
+        self.items_fetched = 0
+        self.new_entries = 0
+        self.stored_entries = 0
+        self.truncated = False
+        self.error: Optional[Dict[str, Any]] = None
+        self.description = f"[{getattr(client, '_client_name', 'SnagClient')}] stored transaction entries"
+
+    def _pages_left(self) -> Optional[int]:
+        return None if self.max_pages is None else max(0, self.max_pages - self.pages_fetched)
+
+    def _api_iterator(self, starting_after: Optional[str], first_page_size: int) -> SnagPageIterator:
+        async def fetch_page(cursor: Optional[str]) -> Optional[Dict]:
+            limit = first_page_size if cursor == starting_after else self.page_size
+            return await self._client.get_transaction_entries(
+                wallet_address=self.wallet, limit=limit, starting_after=cursor,
+                exclude_deleted_currency=False, priority=self.priority
+            )
+        return SnagPageIterator(fetch_page, max_pages=self._pages_left(), starting_after=starting_after,
+                                description=self.description)
+
+    async def pages(self) -> AsyncIterator[List[Dict[str, Any]]]:
+        store = self._store
+        state = await store.load_state(self.system, self.wallet)
+        yielded_ids: Set[str] = set()
+
+        if state is not None and state.complete and time.time() - state.synced_at < store.fresh_ttl:
+            head_complete = True  # Только что синхронизировано: обходимся без запроса к API
+        elif state is not None:
+            head_complete = False
+            head = self._api_iterator(None, HEAD_PAGE_SIZE)
+            head_entries: List[Dict[str, Any]] = []
+            async for page in head.pages():
+                new_entries = []
+                for entry in page:
+                    if entry.get("id") == state.newest_entry_id or (entry.get("createdAt") or "") < (state.newest_created_at or ""):
+                        head_complete = True
+                        break
+                    new_entries.append(entry)
+                if new_entries:
+                    head_entries.extend(new_entries)
+                    await store.save_entries(self.system, self.wallet, new_entries)
+                    yielded_ids.update(entry["id"] for entry in new_entries if entry.get("id"))
+                    self.new_entries += len(new_entries)
+                    self.items_fetched += len(new_entries)
+                    yield new_entries
+                if head_complete:
+                    break
+            self.pages_fetched += head.pages_fetched
+            if head.error:
+                self.error = head.error
+                return
+            if not head_complete and not head.truncated:
+                head_complete = True  # Дошли до конца истории, не встретив известную запись (ее удалили)
+            if not head_complete:
+                # Новых записей больше, чем влезло в лимит страниц: сохраненная часть больше не
+                # примыкает к новой. Начинаем историю заново с того, что успели скачать.
+                logger.warning(f"TransactionStore: {self.system}/{self.wallet} has more new entries than {self.max_pages} pages; restarting its history.")
+                await store.restart_wallet(self.system, self.wallet, head_entries, WalletSyncState(
+                    head_entries[0].get("id"), head_entries[0].get("createdAt"), head.last_cursor, False, time.time()
+                ))
+                self.truncated = True
+                return
+            if head_entries:
+                state.newest_entry_id = head_entries[0].get("id")
+                state.newest_created_at = head_entries[0].get("createdAt")
+            state.synced_at = time.time()
+            await store.save_state(self.system, self.wallet, state)
+
+        if state is not None and self.include_stored:
+            async for stored in store.iter_entries(self.system, self.wallet, self.page_size):
+                chunk = [entry for entry in stored if entry.get("id") not in yielded_ids] if yielded_ids else stored
+                if not chunk:
+                    continue
+                self.stored_entries += len(chunk)
+                self.items_fetched += len(chunk)
+                yield chunk
+        if state is not None and state.complete:
+            return
+
+        # Догрузка старых записей (или первая загрузка кошелька) с сохраненного курсора
+        if self._pages_left() == 0:
+            self.truncated = True
+            return
+        starting_after = state.oldest_cursor if state is not None else None
+        backfill = self._api_iterator(starting_after, self.page_size)
+        async for page in backfill.pages():
+            if state is None:
+                first = page[0]
+                state = WalletSyncState(first.get("id"), first.get("createdAt"), None, False, time.time())
+            await store.save_entries(self.system, self.wallet, page)
+            state.oldest_cursor = backfill.last_cursor
+            state.complete = not backfill.has_more
+            await store.save_state(self.system, self.wallet, state)
+            self.new_entries += len(page)
+            self.items_fetched += len(page)
+            yield page
+        self.pages_fetched += backfill.pages_fetched
+        if backfill.error:
+            self.error = backfill.error
+            return
+        if state is None:
+            # У кошелька нет записей: запоминаем это, чтобы в следующий раз не запрашивать всю историю
+            state = WalletSyncState(None, None, None, True, time.time())
+            await store.save_state(self.system, self.wallet, state)
+            return
+        if not backfill.has_more and not state.complete:
+            state.complete = True
+            await store.save_state(self.system, self.wallet, state)
+        self.truncated = backfill.truncated